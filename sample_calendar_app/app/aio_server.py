@@ -0,0 +1,358 @@
+'''
+grpc.aio implementation of CalendarSync.
+
+The thread-pool server in server.py blocks a worker on every SQLite query and Google
+HTTP call, so max_workers slow Google calls stall the whole server. Here the hot RPCs
+(StoreTokens, OptOut, CRUD, ListEvents) use an async SQLAlchemy session (aiosqlite) and
+an httpx-based Google client, so thousands of RPCs can wait on Google concurrently.
+RPCs that drive googleapiclient directly (OAuth URL, batch mutations, the paginated push
+sync) reuse the blocking servicer on a bounded thread pool, off the event loop.
+
+    CALENDAR_SERVER_MODE=aio python server.py
+'''
+import asyncio
+import contextvars
+import datetime
+import os
+from concurrent import futures
+
+import grpc
+from google.protobuf.empty_pb2 import Empty
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import calendar_pb2_grpc, calendar_pb2
+import change_bus
+import db
+import event_store
+import event_mapping
+import interval_index
+import metrics
+import server
+import token_refresher
+from google_async import AsyncCalendarClient, GoogleApiError, refresh_access_token
+from models import UserCalendar
+from user_cache import user_cache, snapshot
+
+BLOCKING_WORKERS = int(os.environ.get("AIO_BLOCKING_WORKERS", "10"))
+
+# same CALENDAR_DB_URL / pool / WAL settings as the thread-pool server, via the async driver
+async_engine = db.make_async_engine()
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+class _AbortFromThread(Exception):
+    def __init__(self, code, details):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+
+class _ThreadContext:
+    # aio's context.abort is a coroutine, so blocking handlers raise and we abort on the loop
+    def abort(self, code, details):
+        raise _AbortFromThread(code, details)
+
+class _BatchItemContext:
+    async def abort(self, code, details):
+        raise ValueError(details)
+
+async def _read_fields(request, context):
+    # async twin of server._read_fields (context.abort is a coroutine here)
+    try:
+        fields = event_mapping.mask_fields(request.read_mask)
+    except ValueError as e:
+        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+    return fields, (event_mapping.row_columns(fields) if fields else None)
+
+async def _read_page_size(request, context, default=0):
+    # async twin of server._read_page_size
+    try:
+        return server._page_size(request, default)
+    except ValueError as e:
+        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+async def _parse_times(context, *values):
+    # async twin of server._parse_times
+    try:
+        return [event_store.parse_time(v) for v in values]
+    except ValueError:
+        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "time bounds must be RFC3339 timestamps")
+
+async def _read_page_source(u, request, calendar_id, context):
+    # async twin of server._read_page_source
+    try:
+        return server._page_source(u, request, calendar_id)
+    except ValueError:
+        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "bad page_token")
+
+async def _get_user(session, user_id):
+    result = await session.execute(select(UserCalendar).filter_by(user_id=user_id))
+    return result.scalars().first()
+
+async def _list_page(client, params, page_token=None):
+    # params as built by server._list_params (googleapiclient style, calendarId included)
+    params = dict(params, pageToken=page_token)
+    return await client.list(params.pop("calendarId"), **params)
+
+async def _iter_pages(client, params, page_token=None):
+    # async twin of sync_engine.iter_pages
+    while True:
+        page = await _list_page(client, params, page_token)
+        yield page
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+class AsyncCalendarSyncServicer(calendar_pb2_grpc.CalendarSyncServicer):
+    def __init__(self):
+        self._blocking = server.CalendarSyncServicer()
+        self._executor = futures.ThreadPoolExecutor(max_workers=BLOCKING_WORKERS)
+        self._freebusy_slots = asyncio.Semaphore(server.FREEBUSY_CONCURRENCY)
+        self._batch_list_slots = asyncio.Semaphore(server.BATCH_LIST_CONCURRENCY)
+
+    async def _in_thread(self, method, request, context):
+        loop = asyncio.get_running_loop()
+        try:
+            # copy the context so the thread's spans count against this RPC
+            return await loop.run_in_executor(self._executor, contextvars.copy_context().run, method, request, _ThreadContext())
+        except _AbortFromThread as e:
+            await context.abort(e.code, e.details)
+
+    async def _client(self, session, u):
+        # normally the background token refresher got here first; otherwise refresh inline and persist
+        access_token = u.access_token
+        if u.token_expiry and u.token_expiry - datetime.timedelta(seconds=60) <= datetime.datetime.utcnow():
+            token_refresher.metrics.record("on_request")
+            access_token, expiry = await refresh_access_token(u.refresh_token, server.CLIENT_ID, server.CLIENT_SECRET)
+            if await session.run_sync(lambda s: token_refresher.write_back_token(
+                    s, u.user_id, u.refresh_token, access_token, expiry)):
+                await session.commit()
+                await session.refresh(u)
+                user_cache.put(u)
+        return AsyncCalendarClient(access_token, user_id=u.user_id)
+
+    async def _active_user(self, session, user_id, context):
+        u = await _get_user(session, user_id)
+        if not u or u.opted_out:
+            await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+        return u
+
+    async def GetOAuthUrl(self, request, context):
+        return await self._in_thread(self._blocking.GetOAuthUrl, request, context)
+
+    async def StoreTokens(self, request, context):
+        async with AsyncSession() as session:
+            u = await _get_user(session, request.user_id)
+            if not u:
+                u = UserCalendar(user_id=request.user_id)
+                session.add(u)
+            u.access_token = request.access_token
+            u.refresh_token = request.refresh_token
+            u.token_expiry = datetime.datetime.utcfromtimestamp(request.expiry_epoch)
+            u.opted_out = False
+            await session.commit()
+            user_cache.put(u)
+        server.service_cache.invalidate(request.user_id)
+        server.channels.schedule(request.user_id)
+        return Empty()
+
+    async def OptOut(self, request, context):
+        async with AsyncSession() as session:
+            u = await _get_user(session, request.user_id)
+            if u:
+                # channels().stop is a googleapiclient call: off the loop, with a snapshot of the row
+                await asyncio.get_running_loop().run_in_executor(self._executor, server._stop_channel, snapshot(u))
+                await session.run_sync(lambda s: server._opt_out(s, u))
+                await session.commit()
+                user_cache.put(u)
+        server.service_cache.invalidate(request.user_id)
+        return Empty()
+
+    async def CreateEvent(self, request, context):
+        async with AsyncSession() as session:
+            u = await self._active_user(session, request.user_id, context)
+            client = await self._client(session, u)
+            calendar_id = request.calendar_id or u.calendar_id
+            created = await client.insert(calendar_id, server._create_body(request))
+            if calendar_id == u.calendar_id:
+                await session.run_sync(lambda s: event_store.apply_changes(s, u.user_id, u.calendar_id, [created], write_through=True))
+                await session.commit()
+            return event_mapping.to_event(created)
+
+    async def UpdateEvent(self, request, context):
+        async with AsyncSession() as session:
+            u = await self._active_user(session, request.user_id, context)
+            client = await self._client(session, u)
+            calendar_id = request.calendar_id or u.calendar_id
+            etag = request.etag
+            if not etag and calendar_id == u.calendar_id:
+                etag = await session.run_sync(lambda s: event_store.get_etag(s, u.user_id, request.event_id))
+            try:
+                updated = await client.patch(calendar_id, request.event_id, server._patch_body(request), etag=etag)
+            except GoogleApiError as e:
+                if e.status_code == 412:
+                    await context.abort(grpc.StatusCode.ABORTED, "conflict: event %s was modified since etag %s" % (request.event_id, etag))
+                raise
+            if calendar_id == u.calendar_id:
+                await session.run_sync(lambda s: event_store.apply_changes(s, u.user_id, u.calendar_id, [updated], write_through=True))
+                await session.commit()
+            return event_mapping.to_event(updated)
+
+    async def DeleteEvent(self, request, context):
+        async with AsyncSession() as session:
+            u = await self._active_user(session, request.user_id, context)
+            client = await self._client(session, u)
+            calendar_id = request.calendar_id or u.calendar_id
+            await client.delete(calendar_id, request.event_id)
+            if calendar_id == u.calendar_id:
+                await session.run_sync(lambda s: event_store.delete_event(s, u.user_id, request.event_id))
+                await session.commit()
+            return Empty()
+
+    async def BatchMutateEvents(self, request, context):
+        return await self._in_thread(self._blocking.BatchMutateEvents, request, context)
+
+    async def ListEvents(self, request, context):
+        async with AsyncSession() as session:
+            u = await _get_user(session, request.user_id)
+            if not u or u.opted_out:
+                return calendar_pb2.ListEventsResp()
+            calendar_id = request.calendar_id or u.calendar_id
+            page_size = await _read_page_size(request, context)
+            await _parse_times(context, request.time_min, request.time_max)
+            fields, columns = await _read_fields(request, context)
+            source, token = await _read_page_source(u, request, calendar_id, context)
+            if source == "local":
+                resp = calendar_pb2.ListEventsResp()
+                if not page_size:
+                    rows = await session.run_sync(lambda s: event_store.query_range(
+                        s, u.user_id, request.time_min, request.time_max, columns))
+                    event_mapping.add_rows(resp.events, rows, fields)
+                    return resp
+                rows, cursor = await session.run_sync(lambda s: event_store.query_page(
+                    s, u.user_id, request.time_min, request.time_max, page_size, token, columns))
+                event_mapping.add_rows(resp.events, rows, fields)
+                resp.next_page_token = server._page_token("local", cursor)
+                return resp
+            client = await self._client(session, u)
+        if page_size:
+            page = await _list_page(client, dict(server._list_params(request, calendar_id), maxResults=page_size), token)
+            resp = calendar_pb2.ListEventsResp(next_page_token=server._page_token("google", page.get("nextPageToken")))
+            event_mapping.add_events(resp.events, page.get("items", []))
+            return resp
+        resp = calendar_pb2.ListEventsResp()
+        async for page in _iter_pages(client, server._list_params(request, calendar_id)):
+            event_mapping.add_events(resp.events, page.get("items", []))
+        return resp
+
+    async def BatchListEvents(self, request, context):
+        async def one(req):
+            try:
+                async with self._batch_list_slots:
+                    return calendar_pb2.ListEventsResult(resp=await self.ListEvents(req, _BatchItemContext()))
+            except Exception as e:
+                return calendar_pb2.ListEventsResult(error=str(e))
+        results = await asyncio.gather(*(one(req) for req in request.requests))
+        return calendar_pb2.BatchListEventsResp(results=results)
+
+    async def StreamEvents(self, request, context):
+        async with AsyncSession() as session:
+            u = await _get_user(session, request.user_id)
+            if not u or u.opted_out:
+                return
+            calendar_id = request.calendar_id or u.calendar_id
+            page_size = await _read_page_size(request, context, server.STREAM_PAGE_SIZE)
+            await _parse_times(context, request.time_min, request.time_max)
+            fields, columns = await _read_fields(request, context)
+            source, token = await _read_page_source(u, request, calendar_id, context)
+            if source != "local":
+                client = await self._client(session, u)
+        if source == "local":
+            while True:
+                # short-lived session per page so a slow reader doesn't pin a pooled connection
+                async with AsyncSession() as session:
+                    rows, token = await session.run_sync(lambda s: event_store.query_page(
+                        s, u.user_id, request.time_min, request.time_max, page_size, token, columns))
+                for r in rows:
+                    yield event_mapping.row_to_event(r, fields)
+                if not token:
+                    return
+        async for page in _iter_pages(client, dict(server._list_params(request, calendar_id), maxResults=page_size), token):
+            for it in page.get("items", []):
+                yield event_mapping.to_event(it)
+
+    async def _lookup_busy(self, user_id, time_min, time_max):
+        async with self._freebusy_slots, AsyncSession() as session:
+            u = await _get_user(session, user_id)
+            if not u or u.opted_out:
+                return calendar_pb2.UserBusy(user_id=user_id, error="user not synced or opted out")
+            try:
+                if server._can_serve(u, time_min):
+                    busy = await session.run_sync(lambda s: event_store.busy_intervals(s, user_id, time_min, time_max))
+                else:
+                    client = await self._client(session, u)
+                    resp = await client.freebusy(server._freebusy_body(u, time_min, time_max))
+                    busy = server._google_busy(resp, u.calendar_id)
+            except Exception as e:
+                return calendar_pb2.UserBusy(user_id=user_id, error=str(e))
+        return server._user_busy(user_id, busy)
+
+    async def QueryFreeBusy(self, request, context):
+        if not request.time_min or not request.time_max:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "time_min and time_max are required")
+        await _parse_times(context, request.time_min, request.time_max)
+        users = await asyncio.gather(*(self._lookup_busy(user_id, request.time_min, request.time_max)
+                                       for user_id in request.user_ids))
+        return calendar_pb2.FreeBusyResp(users=users)
+
+    async def _index(self, user_id, time_min, context):
+        async with AsyncSession() as session:
+            u = await _get_user(session, user_id)
+            if not u or u.opted_out:
+                await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+            if not server._can_serve(u, time_min):
+                await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "calendar not synced for this range yet")
+            return await session.run_sync(lambda s: interval_index.registry.get(s, user_id))
+
+    async def _range(self, start_iso, end_iso, context):
+        start, end = await _parse_times(context, start_iso, end_iso)
+        if start is None or end is None or end <= start:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "a non-empty [start, end) range is required")
+        return start, end
+
+    async def FindOverlaps(self, request, context):
+        start, end = await self._range(request.start_iso, request.end_iso, context)
+        index = await self._index(request.user_id, request.start_iso, context)
+        return server._overlaps_resp(index.overlaps(start, end))
+
+    async def FindFreeSlot(self, request, context):
+        start, end = await self._range(request.time_min, request.time_max, context)
+        if request.duration_minutes <= 0:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "duration_minutes must be positive")
+        index = await self._index(request.user_id, request.time_min, context)
+        return server._free_slot(index.first_free_slot(start, end, datetime.timedelta(minutes=request.duration_minutes)))
+
+    async def HandlePushNotification(self, request, context):
+        # long paginated sync: runs the blocking sync engine on the thread pool
+        return await self._in_thread(self._blocking.HandlePushNotification, request, context)
+
+    async def SubscribeChanges(self, request, context):
+        # syncs run on threads and hand batches to this loop; a full queue blocks them (backpressure)
+        sub = change_bus.bus.subscribe(change_bus.AsyncQueueSubscriber(
+            asyncio.get_running_loop(), request.user_ids, required=False))
+        try:
+            await context.send_initial_metadata(())
+            async for batch in sub:
+                yield change_bus.to_proto(batch)
+        finally:
+            change_bus.bus.unsubscribe(sub)
+            sub.close()
+
+async def serve(address="[::]:50051"):
+    grpc_server = grpc.aio.server(interceptors=[metrics.AioMetricsInterceptor()], options=server.SERVER_OPTIONS)
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(AsyncCalendarSyncServicer(), grpc_server)
+    grpc_server.add_insecure_port(address)
+    await grpc_server.start()
+    await grpc_server.wait_for_termination()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,179 @@
+'''
+Bulk initial sync (onboarding) runner.
+
+A user's first sync pulls the whole FULL_SYNC_WINDOW_DAYS window, which is far more
+work than an incremental one; thousands of them inline in gRPC handlers take the
+server down. BulkSyncRunner runs first syncs on a bounded thread pool instead. The
+checkpoints are the ones sync_engine already keeps in the DB: sync_page_token after
+every page and is_synced + sync_token once the last page lands. Re-running a job
+therefore skips finished users and resumes interrupted ones at their last page.
+Every page is published on the change bus (all "created"), like a push sync's pages.
+
+    python bulk_sync.py --pending            # every user that hasn't finished a first sync
+    python bulk_sync.py --users-file ids.txt # one user_id per line
+'''
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+
+import change_bus
+from db import session_scope
+from models import UserCalendar
+import sync_engine
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+BULK_SYNC_WORKERS = int(os.environ.get("BULK_SYNC_WORKERS", "8"))
+BULK_SYNC_REPORT_SECONDS = float(os.environ.get("BULK_SYNC_REPORT_SECONDS", "10"))
+# a failed first sync is retried from its last page checkpoint (Google 5xx, "database is locked", ...)
+BULK_SYNC_RETRIES = int(os.environ.get("BULK_SYNC_RETRIES", "2"))
+
+def needs_first_sync(u):
+    # rows synced before synced_from existed have a syncToken but no local copy to serve from
+    return not u.opted_out and bool(u.refresh_token) and not (u.is_synced and u.sync_token and u.synced_from)
+
+def pending_users(batch_size=500):
+    """user_ids that haven't completed a first sync, paged by primary key."""
+    after_id = 0
+    while True:
+        with session_scope() as session:
+            rows = (session.query(UserCalendar.id, UserCalendar.user_id)
+                    .filter(UserCalendar.id > after_id,
+                            UserCalendar.opted_out.isnot(True),
+                            UserCalendar.refresh_token.isnot(None),
+                            (UserCalendar.is_synced.isnot(True)) | (UserCalendar.sync_token.is_(None))
+                            | (UserCalendar.synced_from.is_(None)))
+                    .order_by(UserCalendar.id).limit(batch_size).all())
+        if not rows:
+            return
+        after_id = rows[-1].id
+        for row in rows:
+            yield row.user_id
+
+class BulkSyncRunner:
+    def __init__(self, get_service, max_workers=BULK_SYNC_WORKERS, page_size=sync_engine.SYNC_PAGE_SIZE,
+                 retries=BULK_SYNC_RETRIES, report_every=BULK_SYNC_REPORT_SECONDS, clock=time.monotonic):
+        self.get_service = get_service
+        self.max_workers = max_workers
+        self.retries = retries
+        self.page_size = page_size
+        self.report_every = report_every
+        self._clock = clock
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="onboard")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._started_at = clock()
+        self._reported_at = self._started_at
+        self.synced = 0
+        self.skipped = 0   # already synced, opted out or without tokens
+        self.failed = 0
+        self.retried = 0
+        self.events = 0
+
+    def sync_one(self, user_id):
+        """First sync for one user; 'synced' or 'skipped'. Raises on failure (the page checkpoint survives)."""
+        with session_scope() as session:
+            u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+            if not u or not needs_first_sync(u):
+                return "skipped"
+            svc = self.get_service(u)
+            n = 0
+            for changes in sync_engine.sync_pages(session, u, svc, self.page_size, on_commit=user_cache.put):
+                n += len(changes)
+                if changes:
+                    change_bus.bus.publish(change_bus.make_batch(u, changes))
+            with self._lock:
+                self.events += n
+            return "synced"
+
+    def _run(self, user_id):
+        for attempt in range(self.retries + 1):
+            try:
+                outcome = self.sync_one(user_id)
+                break
+            except Exception:
+                logger.exception("first sync for %s failed (attempt %d)", user_id, attempt + 1)
+                outcome = "failed"
+                if attempt < self.retries:
+                    with self._lock:
+                        self.retried += 1
+                    time.sleep(2 ** attempt)
+        with self._lock:
+            self._in_flight.discard(user_id)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        self._maybe_report()
+        return outcome
+
+    def submit(self, user_id):
+        """Queue one user's first sync; no-op if it is already queued or running. Non-blocking."""
+        with self._lock:
+            if user_id in self._in_flight:
+                return None
+            self._in_flight.add(user_id)
+        return self._pool.submit(self._run, user_id)
+
+    def run(self, user_ids):
+        """Sync every user in `user_ids` (any iterable, consumed lazily) and wait; returns stats()."""
+        self._started_at = self._reported_at = self._clock()
+        # keep a bounded number of futures queued so a million-user job doesn't sit in memory
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+        futures = set()
+        for user_id in user_ids:
+            slots.acquire()
+            future = self.submit(user_id)
+            if future is None:
+                slots.release()
+                continue
+            future.add_done_callback(lambda f: slots.release())
+            futures.add(future)
+            futures = {f for f in futures if not f.done()}
+        for future in futures:
+            future.result()
+        stats = self.stats()
+        logger.info("bulk sync done: %s", stats)
+        return stats
+
+    def stats(self):
+        with self._lock:
+            elapsed = max(self._clock() - self._started_at, 1e-9)
+            return {"synced": self.synced, "skipped": self.skipped, "failed": self.failed, "retried": self.retried,
+                    "in_flight": len(self._in_flight), "events": self.events,
+                    "elapsed_seconds": round(elapsed, 1),
+                    "users_per_minute": round(self.synced / elapsed * 60, 1)}
+
+    def _maybe_report(self):
+        now = self._clock()
+        with self._lock:
+            if now - self._reported_at < self.report_every:
+                return
+            self._reported_at = now
+        logger.info("bulk sync progress: %s", self.stats())
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+def main():
+    import argparse
+    import server  # builds the Google services (service cache, token refresh hook, rate limiter)
+
+    parser = argparse.ArgumentParser(description="Run first syncs for many users")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--pending", action="store_true", help="every user without a completed first sync")
+    group.add_argument("--users-file", help="file with one user_id per line")
+    parser.add_argument("--workers", type=int, default=BULK_SYNC_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    runner = BulkSyncRunner(server.get_service, max_workers=args.workers)
+    if args.pending:
+        print(runner.run(pending_users()))
+    else:
+        with open(args.users_file) as f:
+            print(runner.run(line.strip() for line in f if line.strip()))
+    runner.shutdown()
+
+if __name__ == "__main__":
+    main()
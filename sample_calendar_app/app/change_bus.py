@@ -0,0 +1,234 @@
+'''
+Change bus for push-triggered syncs.
+
+HandlePushNotification used to print the changes it pulled. It now publishes one
+ChangeBatch per Google page (created / updated / deleted records) to every subscriber,
+and so do first syncs on the onboarding pool (bulk_sync):
+
+- AsyncQueueSubscriber: a bounded asyncio.Queue on an event loop, for in-process consumers
+- FileLogSubscriber: one JSON line per batch appended to a local file (CHANGE_LOG_PATH)
+- StreamSubscriber: a bounded queue feeding a SubscribeChanges gRPC stream
+
+publish() returns once every subscriber has taken the batch; a full queue blocks it,
+so syncs slow down to the pace of the slowest consumer. sync_engine commits the page's
+checkpoint only after that, so a crash in between re-pulls and republishes the page:
+delivery is at-least-once, and a redelivered batch has the same key (user_id + the
+sync/page token the page was read from) so consumers can drop duplicates. Only the
+file log outlives the process; queue and stream subscribers see what is published
+while they are attached.
+'''
+import asyncio
+from collections import namedtuple
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import calendar_pb2
+import event_mapping
+
+logger = logging.getLogger(__name__)
+
+# how long publish() waits on one full subscriber before giving up on it
+CHANGE_PUBLISH_TIMEOUT_SECONDS = float(os.environ.get("CHANGE_PUBLISH_TIMEOUT_SECONDS", "30"))
+CHANGE_QUEUE_SIZE = int(os.environ.get("CHANGE_QUEUE_SIZE", "100"))  # batches per queue/stream subscriber
+CHANGE_LOG_PATH = os.environ.get("CHANGE_LOG_PATH")                  # set to publish to a file log
+CHANGE_LOG_FSYNC = os.environ.get("CHANGE_LOG_FSYNC", "1") == "1"
+
+ChangeRecord = namedtuple("ChangeRecord", ["kind", "event_id", "event"])  # event: the Google item
+ChangeBatch = namedtuple("ChangeBatch", ["key", "user_id", "calendar_id", "changes"])
+
+def page_key(u):
+    """
+    Key of the page sync_engine.sync_pages is yielding for `u`. The checkpoint is only
+    moved after the yield, so u still holds the token the page was read from.
+    """
+    cursor = u.sync_page_token or u.sync_token or "full:%s" % u.synced_from.isoformat()
+    return "%s:%s" % (u.user_id, cursor)
+
+def make_batch(u, changes):
+    """changes: (kind, item) pairs from event_store.apply_changes."""
+    return ChangeBatch(page_key(u), u.user_id, u.calendar_id,
+                       [ChangeRecord(kind, item.get("id", ""), item) for kind, item in changes])
+
+def to_proto(batch):
+    msg = calendar_pb2.ChangeBatch(key=batch.key, user_id=batch.user_id, calendar_id=batch.calendar_id)
+    for change in batch.changes:
+        rec = msg.changes.add(kind=change.kind, event_id=change.event_id)
+        if change.kind != "deleted":
+            event_mapping.fill_event(rec.event, change.event)
+    return msg
+
+def to_json(batch):
+    return json.dumps({"key": batch.key, "user_id": batch.user_id, "calendar_id": batch.calendar_id,
+                       "changes": [{"kind": c.kind, "event_id": c.event_id, "event": c.event} for c in batch.changes]})
+
+class Subscriber:
+    # required: a failed delivery fails the sync (the page is redelivered later);
+    # otherwise the subscriber is detached and the sync goes on without it
+    required = True
+
+    def __init__(self, user_ids=None):
+        self.user_ids = set(user_ids) if user_ids else None
+
+    def wants(self, batch):
+        return self.user_ids is None or batch.user_id in self.user_ids
+
+    def deliver(self, batch, timeout):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class FileLogSubscriber(Subscriber):
+    def __init__(self, path, fsync=CHANGE_LOG_FSYNC, user_ids=None):
+        super().__init__(user_ids)
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def deliver(self, batch, timeout):
+        line = to_json(batch) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                # the batch counts as delivered once it is on disk
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class StreamSubscriber(Subscriber):
+    """Thread-side queue for a blocking gRPC stream; iterate it to get batches until close()."""
+    required = False
+
+    def __init__(self, user_ids=None, maxsize=CHANGE_QUEUE_SIZE):
+        super().__init__(user_ids)
+        self._queue = queue.Queue(maxsize)
+        self.closed = False
+
+    def deliver(self, batch, timeout):
+        if self.closed:
+            raise RuntimeError("subscriber closed")
+        self._queue.put(batch, timeout=timeout)
+
+    def close(self):
+        self.closed = True
+        # drop what the reader never got and wake it up
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass  # a racing deliver() refilled it; the reader checks `closed` after every get
+
+    def __iter__(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None or self.closed:
+                return
+            yield batch
+
+class AsyncQueueSubscriber(Subscriber):
+    """Bounded asyncio.Queue on `loop`; consume with `await sub.get()` (None once closed) or `async for`."""
+
+    def __init__(self, loop, user_ids=None, maxsize=CHANGE_QUEUE_SIZE, required=True):
+        super().__init__(user_ids)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.required = required
+        self.closed = False
+
+    def deliver(self, batch, timeout):
+        # publish() runs on sync threads; the put itself happens on the subscriber's loop
+        if self.closed:
+            raise RuntimeError("subscriber closed")
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(batch), self.loop)
+        try:
+            future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _close_on_loop(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)  # runs on the loop, so nothing can refill the queue in between
+
+    def close(self):
+        self.closed = True
+        self.loop.call_soon_threadsafe(self._close_on_loop)
+
+    async def get(self):
+        return await self.queue.get()
+
+    async def __aiter__(self):
+        while True:
+            batch = await self.queue.get()
+            if batch is None:
+                return
+            yield batch
+
+class ChangeBus:
+    def __init__(self, timeout=CHANGE_PUBLISH_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._subscribers = []
+        self._lock = threading.Lock()
+        # metrics
+        self.batches = 0
+        self.changes = 0
+        self.blocked_seconds = 0.0  # time spent in deliver(), including waits on full queues (backpressure)
+        self.detached = 0           # optional subscribers dropped for not keeping up
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, batch):
+        """Deliver `batch` to every interested subscriber; raises if a required one fails."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        t0 = time.monotonic()
+        try:
+            for sub in subscribers:
+                if not sub.wants(batch):
+                    continue
+                try:
+                    sub.deliver(batch, self.timeout)
+                except Exception:
+                    if sub.required:
+                        raise
+                    logger.warning("detaching change subscriber that stopped reading (%s)", batch.key)
+                    self.unsubscribe(sub)
+                    sub.close()
+                    with self._lock:
+                        self.detached += 1
+        finally:
+            with self._lock:
+                self.blocked_seconds += time.monotonic() - t0
+        with self._lock:
+            self.batches += 1
+            self.changes += len(batch.changes)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "batches": self.batches, "changes": self.changes,
+                    "blocked_seconds": round(self.blocked_seconds, 3), "detached": self.detached}
+
+bus = ChangeBus()
+if CHANGE_LOG_PATH:
+    bus.subscribe(FileLogSubscriber(CHANGE_LOG_PATH))
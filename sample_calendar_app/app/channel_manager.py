@@ -0,0 +1,254 @@
+'''
+Push notification channel manager.
+
+events().watch channels expire (Google caps their ttl), and once a user's channel has
+lapsed nothing tells us about their changes until the next full resync. ChannelManager
+keeps every active user watched: channels sit in a heap ordered by expiration, and a
+background thread pops the ones expiring within CHANNEL_RENEW_AHEAD_SECONDS and renews
+them in batches on a bounded pool. A renewal opens the new channel before stopping the
+old one, so there is no window without a channel. Users without a channel (new
+StoreTokens, or a channel that was lost) are queued as due right away.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import threading
+import uuid
+
+from googleapiclient.errors import HttpError
+
+from db import session_scope
+from models import UserCalendar
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_ADDRESS = os.environ.get("WEBHOOK_ADDRESS", "https://yourdomain.com/webhook/calendar")
+# requested channel lifetime; Google may grant less and reports the real expiration
+CHANNEL_TTL_SECONDS = int(os.environ.get("CHANNEL_TTL_SECONDS", str(7 * 24 * 3600)))
+CHANNEL_RENEW_AHEAD_SECONDS = int(os.environ.get("CHANNEL_RENEW_AHEAD_SECONDS", "3600"))
+CHANNEL_RENEW_BATCH_SIZE = int(os.environ.get("CHANNEL_RENEW_BATCH_SIZE", "100"))
+CHANNEL_RENEW_CONCURRENCY = int(os.environ.get("CHANNEL_RENEW_CONCURRENCY", "8"))
+# longest sleep between passes; schedule() wakes the thread earlier
+CHANNEL_CHECK_INTERVAL_SECONDS = float(os.environ.get("CHANNEL_CHECK_INTERVAL_SECONDS", "60"))
+
+NOT_WATCHED = datetime.datetime.min  # renew_at of a user that needs a channel now
+
+def channel_expiration(resp, ttl_seconds):
+    # Google returns the expiration as epoch milliseconds (a string)
+    if resp.get("expiration"):
+        return datetime.datetime.utcfromtimestamp(int(resp["expiration"]) / 1000)
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl_seconds)
+
+def stop_channel(svc, channel_id, resource_id):
+    try:
+        svc.channels().stop(body={"id": channel_id, "resourceId": resource_id}).execute()
+    except HttpError as e:
+        if e.resp.status != 404:  # already gone
+            raise
+
+class ChannelManager:
+    def __init__(self, get_service, on_missed=None, address=WEBHOOK_ADDRESS, ttl_seconds=CHANNEL_TTL_SECONDS,
+                 ahead_seconds=CHANNEL_RENEW_AHEAD_SECONDS, batch_size=CHANNEL_RENEW_BATCH_SIZE,
+                 concurrency=CHANNEL_RENEW_CONCURRENCY, interval=CHANNEL_CHECK_INTERVAL_SECONDS):
+        self.get_service = get_service
+        self.on_missed = on_missed  # user_id -> None; pulls the changes whose notifications were lost
+        self.address = address
+        self.ttl_seconds = ttl_seconds
+        self.ahead = datetime.timedelta(seconds=ahead_seconds)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="channel-renew")
+        # (renew_at, seq, user_id, channel_id, expiration); entries whose channel was replaced or stopped
+        # are skipped when popped instead of being searched for and removed
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # metrics
+        self.created = 0   # first channel for a user
+        self.renewed = 0
+        self.stopped = 0
+        self.missed = 0    # channel had already expired when renewed: notifications may have been lost
+        self.failed = 0
+
+    def _entry(self, user_id, channel_id, expiration, renew_at=None):
+        if renew_at is None:
+            renew_at = expiration - self.ahead if channel_id and expiration else NOT_WATCHED
+        return renew_at, next(self._seq), user_id, channel_id, expiration
+
+    def schedule(self, user_id, channel_id=None, expiration=None, renew_at=None):
+        """Queue `user_id`; without a channel it gets one on the next pass."""
+        entry = self._entry(user_id, channel_id, expiration, renew_at)
+        with self._lock:
+            heapq.heappush(self._heap, entry)
+        if entry[0] <= datetime.datetime.utcnow():
+            self._wake.set()
+
+    def load(self, batch_size=500):
+        """Queue every active user with their channel's expiration (users without one as due now)."""
+        after_id = 0
+        while True:
+            with session_scope() as session:
+                rows = (session.query(UserCalendar.id, UserCalendar.user_id, UserCalendar.webhook_channel_id,
+                                      UserCalendar.webhook_expiration)
+                        .filter(UserCalendar.id > after_id,
+                                UserCalendar.opted_out.isnot(True),
+                                UserCalendar.refresh_token.isnot(None))
+                        .order_by(UserCalendar.id).limit(batch_size).all())
+            if not rows:
+                return
+            after_id = rows[-1].id
+            with self._lock:
+                self._heap.extend(self._entry(row.user_id, row.webhook_channel_id, row.webhook_expiration)
+                                  for row in rows)
+                heapq.heapify(self._heap)
+
+    def _record(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def watch(self, svc, calendar_id):
+        """Open a channel on `calendar_id`; returns the events().watch response."""
+        body = {"id": str(uuid.uuid4()), "type": "web_hook", "address": self.address,
+                "params": {"ttl": str(self.ttl_seconds)}}
+        return svc.events().watch(calendarId=calendar_id, body=body).execute()
+
+    def stop(self, u):
+        """Stop `u`'s current channel, if any. Needs the user's tokens, so call it before clearing them."""
+        if not u.webhook_channel_id:
+            return
+        stop_channel(self.get_service(u), u.webhook_channel_id, u.webhook_resource_id)
+        self._record("stopped")
+
+    def _stop_quietly(self, svc, channel_id, resource_id, user_id):
+        # if the stop fails the channel runs out its ttl
+        try:
+            stop_channel(svc, channel_id, resource_id)
+            self._record("stopped")
+        except Exception:
+            logger.exception("stopping channel %s of %s failed", channel_id, user_id)
+
+    def _opted_out(self, user_id):
+        with session_scope() as session:
+            return bool(session.query(UserCalendar.opted_out).filter_by(user_id=user_id).scalar())
+
+    def _renew(self, entry):
+        _, _, user_id, channel_id, expiration = entry
+        resp, swapped = None, False
+        try:
+            with session_scope() as session:
+                u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+                if not u or u.opted_out or not u.refresh_token or u.webhook_channel_id != channel_id:
+                    return None  # opted out, or this heap entry was superseded
+                # the service keeps its credentials, so both stops below work even if OptOut clears the tokens
+                svc = self.get_service(u)
+                calendar_id, resource_id = u.calendar_id, u.webhook_resource_id
+            resp = self.watch(svc, calendar_id)
+            new_expiration = channel_expiration(resp, self.ttl_seconds)
+            with session_scope() as session:
+                # only if nobody replaced the channel or opted the user out while watch() ran
+                swapped = (session.query(UserCalendar)
+                           .filter(UserCalendar.user_id == user_id,
+                                   UserCalendar.webhook_channel_id == channel_id,
+                                   UserCalendar.opted_out.isnot(True))
+                           .update({"webhook_channel_id": resp["id"], "webhook_resource_id": resp.get("resourceId"),
+                                    "webhook_expiration": new_expiration}, synchronize_session=False))
+                session.commit()
+                if swapped:
+                    user_cache.put(session.query(UserCalendar).filter_by(user_id=user_id).first())
+        except Exception:
+            logger.exception("channel renewal for %s failed", user_id)
+            self._record("failed")
+            if resp is not None and not swapped:
+                # watch() went through but the row never got the new channel: nothing would ever stop it
+                self._stop_quietly(svc, resp["id"], resp.get("resourceId"), user_id)
+            return False
+        # the new channel is live (or lost the race), so one of them can go
+        stale = (channel_id, resource_id) if swapped else (resp["id"], resp.get("resourceId"))
+        if stale[0]:
+            self._stop_quietly(svc, *stale, user_id)
+        if not swapped:
+            return None
+        if self._opted_out(user_id):
+            # an OptOut that read the row before the swap stopped the old channel and clears ours; stop the new one
+            self._stop_quietly(svc, resp["id"], resp.get("resourceId"), user_id)
+            return None
+        # an expired channel means notifications may have been dropped since
+        missed = bool(channel_id) and expiration is not None and expiration <= datetime.datetime.utcnow()
+        return resp["id"], new_expiration, missed
+
+    def _pop_due(self, now):
+        batch = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap))
+        return batch
+
+    def run_once(self):
+        """Renew every channel that expires within the look-ahead window; returns how many were opened."""
+        # entries that become due while this pass runs wait for the next one, so a pass always ends
+        opened, now = 0, datetime.datetime.utcnow()
+        while True:
+            batch = self._pop_due(now)
+            if not batch:
+                return opened
+            for entry, result in zip(batch, self._pool.map(self._renew, batch)):
+                _, _, user_id, channel_id, expiration = entry
+                if result is False:
+                    # try again after a check interval rather than spinning on a failing user
+                    retry_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.interval)
+                    self.schedule(user_id, channel_id, expiration, renew_at=retry_at)
+                    continue
+                if result is None:
+                    continue
+                new_channel_id, new_expiration, missed = result
+                opened += 1
+                self._record("renewed" if channel_id else "created")
+                self.schedule(user_id, new_channel_id, new_expiration)
+                if missed:
+                    self._record("missed")
+                    if self.on_missed:
+                        try:
+                            self.on_missed(user_id)
+                        except Exception:
+                            logger.exception("catch-up sync for %s failed", user_id)
+
+    def _next_wait(self):
+        with self._lock:
+            if not self._heap:
+                return self.interval
+            due_in = (self._heap[0][0] - datetime.datetime.utcnow()).total_seconds()
+        return min(max(due_in, 0), self.interval)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("channel renewal pass failed")
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self._loop, name="channel-manager", daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        self._pool.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {"channels_queued": len(self._heap), "created": self.created, "renewed": self.renewed,
+                    "stopped": self.stopped, "missed": self.missed, "failed": self.failed}
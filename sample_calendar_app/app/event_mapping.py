@@ -0,0 +1,122 @@
+'''
+Google event JSON / event-store rows -> calendar_pb2.Event, in one place.
+
+Fields are set directly on the message (no keyword dict, no chained .get(..., {})
+defaults), and the batch helpers fill a repeated field in place with .add() so a
+ListEventsResp is built without creating and then copying a list of Event messages.
+
+A ListEventsReq.read_mask narrows both sources: Google is asked for the matching item
+fields only (google_fields), and local rows are read column by column (row_columns).
+'''
+import calendar_pb2
+import metrics
+
+OUT_OF_OFFICE = "out_of_office"
+
+EVENT_FIELDS = tuple(f.name for f in calendar_pb2.Event.DESCRIPTOR.fields)
+# Event field -> the Google item fields it is read from (see fill_event)
+GOOGLE_ITEM_FIELDS = {
+    "id": ("id",), "title": ("summary",), "description": ("description",), "start": ("start",), "end": ("end",),
+    "event_type": ("extendedProperties/private",), "is_out_of_office": ("eventType", "extendedProperties/private"),
+    "etag": ("etag",),
+}
+# Event field -> the CalendarEvent columns it is read from (see fill_from_row)
+ROW_COLUMNS = {
+    "id": ("event_id",), "title": ("title",), "description": ("description",), "start": ("start",), "end": ("end",),
+    "event_type": ("event_type",), "is_out_of_office": ("event_type", "google_event_type"), "etag": ("etag",),
+}
+
+def mask_fields(mask):
+    """read_mask paths as a tuple of Event fields; None when unset (every field). Raises ValueError on unknown paths."""
+    if not mask.paths:
+        return None
+    unknown = set(mask.paths) - set(EVENT_FIELDS)
+    if unknown:
+        raise ValueError("unknown Event fields in read_mask: %s" % ", ".join(sorted(unknown)))
+    return tuple(mask.paths)
+
+def google_fields(fields):
+    """events().list `fields=` value returning only what `fields` needs, plus the paging token."""
+    items = sorted({path for f in fields for path in GOOGLE_ITEM_FIELDS[f]})
+    return "nextPageToken,items(%s)" % ",".join(items)
+
+def row_columns(fields):
+    """Columns to load for `fields`; event_id and start_time are always kept for ordering and page cursors."""
+    return sorted({column for f in fields for column in ROW_COLUMNS[f]} | {"event_id", "start_time"})
+
+def event_type_of(item):
+    # our type lives in extendedProperties.private.event_type (see server._create_body)
+    props = item.get("extendedProperties")
+    if not props:
+        return ""
+    private = props.get("private")
+    return private.get("event_type", "") if private else ""
+
+def out_of_office(event_type, google_event_type):
+    # Google's own eventType also marks out-of-office blocks created in the Calendar UI
+    return event_type == OUT_OF_OFFICE or google_event_type == "outOfOffice"
+
+def when(part):
+    # timed events carry dateTime, all-day events only date
+    if not part:
+        return ""
+    return part.get("dateTime") or part.get("date", "")
+
+def fill_event(ev, item):
+    get = item.get
+    ev.id = get("id", "")
+    ev.title = get("summary", "")
+    ev.description = get("description", "")
+    ev.start = when(get("start"))
+    ev.end = when(get("end"))
+    event_type = event_type_of(item)
+    ev.event_type = event_type
+    ev.is_out_of_office = out_of_office(event_type, get("eventType"))
+    ev.etag = get("etag", "")
+    return ev
+
+def to_event(item):
+    return fill_event(calendar_pb2.Event(), item)
+
+def add_events(events, items):
+    """Append one Event per Google item to a repeated Event field (e.g. ListEventsResp.events)."""
+    add = events.add
+    with metrics.span("convert"):
+        for item in items:
+            fill_event(add(), item)
+
+def fill_from_row(ev, row):
+    ev.id = row.event_id
+    ev.title = row.title or ""
+    ev.description = row.description or ""
+    ev.start = row.start or ""
+    ev.end = row.end or ""
+    ev.event_type = row.event_type or ""
+    ev.is_out_of_office = out_of_office(row.event_type, row.google_event_type)
+    ev.etag = row.etag or ""
+    return ev
+
+def fill_from_columns(ev, row, fields):
+    # row from a row_columns(fields) query: only those columns are there
+    for f in fields:
+        if f == "is_out_of_office":
+            ev.is_out_of_office = out_of_office(row.event_type, row.google_event_type)
+        else:
+            setattr(ev, f, getattr(row, ROW_COLUMNS[f][0]) or "")
+    return ev
+
+def row_to_event(row, fields=None):
+    if fields is None:
+        return fill_from_row(calendar_pb2.Event(), row)
+    return fill_from_columns(calendar_pb2.Event(), row, fields)
+
+def add_rows(events, rows, fields=None):
+    """Append one Event per CalendarEvent row to a repeated Event field; `fields`: rows were read with row_columns."""
+    add = events.add
+    with metrics.span("convert"):
+        if fields is None:
+            for row in rows:
+                fill_from_row(add(), row)
+        else:
+            for row in rows:
+                fill_from_columns(add(), row, fields)
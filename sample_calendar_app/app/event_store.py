@@ -0,0 +1,163 @@
+'''
+Local, indexed copy of each user's Google Calendar events.
+HandlePushNotification writes incremental changes here and ListEvents answers
+time-range queries from it, so reads stay off the Google API quota. Every change is
+also queued for interval_index, which applies it once the session commits.
+'''
+import base64
+import binascii
+import datetime
+
+from sqlalchemy import and_, or_
+
+from event_mapping import event_type_of, when
+import interval_index
+from models import CalendarEvent
+
+def parse_time(value):
+    """Google dateTime / all-day date / RFC3339 query bound -> naive UTC datetime (None if empty)."""
+    if not value:
+        return None
+    if len(value) == 10:  # all-day event: "2024-05-01"
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _apply(row, item):
+    row.title = item.get("summary", "")
+    row.description = item.get("description", "")
+    row.start = when(item.get("start"))
+    row.end = when(item.get("end"))
+    row.start_time = parse_time(row.start)
+    row.end_time = parse_time(row.end)
+    row.event_type = event_type_of(item)
+    row.google_event_type = item.get("eventType", "")
+    row.transparent = item.get("transparency") == "transparent"
+    row.etag = item.get("etag")
+
+def apply_changes(session, user_id, calendar_id, items, write_through=False):
+    """
+    Upsert changed events and drop cancelled ones. Existing rows are loaded with one
+    IN query per batch instead of one lookup per event. Caller commits.
+    Returns a (kind, item) pair per item, kind being "created", "updated" or "deleted".
+    write_through: items come from our own mutation RPCs rather than a sync. A row first
+    written that way is still reported as "created" when the sync brings the event in.
+    """
+    if not items:
+        return []
+    ids = [it["id"] for it in items if it.get("id")]
+    existing = {r.event_id: r for r in session.query(CalendarEvent)
+                .filter(CalendarEvent.user_id == user_id, CalendarEvent.event_id.in_(ids))}
+    changes = []
+    for it in items:
+        row = existing.get(it.get("id"))
+        if it.get("status") == "cancelled":
+            changes.append(("deleted", it))
+            if row is not None:
+                session.delete(row)
+                existing.pop(it["id"])
+                interval_index.record(session, "delete", user_id, it["id"])
+            continue
+        changes.append(("created" if row is None or row.write_through else "updated", it))
+        if row is None:
+            row = CalendarEvent(user_id=user_id, event_id=it["id"], calendar_id=calendar_id, write_through=write_through)
+            session.add(row)
+            existing[it["id"]] = row
+        elif not write_through:
+            row.write_through = False
+        _apply(row, it)
+        interval_index.record(session, "upsert", user_id, row.event_id, row.start_time, row.end_time, row.event_type)
+    return changes
+
+def get_etag(session, user_id, event_id):
+    row = session.query(CalendarEvent.etag).filter_by(user_id=user_id, event_id=event_id).first()
+    return row.etag if row else None
+
+def delete_event(session, user_id, event_id):
+    session.query(CalendarEvent).filter_by(user_id=user_id, event_id=event_id).delete()
+    interval_index.record(session, "delete", user_id, event_id)
+
+def clear_user(session, user_id):
+    session.query(CalendarEvent).filter_by(user_id=user_id).delete()
+    interval_index.record(session, "clear", user_id)
+
+def can_serve(u, time_min):
+    """Local data is only complete for users with a live syncToken and for ranges inside the synced window."""
+    if not (u.is_synced and u.sync_token and u.synced_from):
+        return False
+    start = parse_time(time_min)
+    return start is not None and start >= u.synced_from
+
+def _range_query(session, user_id, time_min, time_max, columns=None):
+    # columns: load only these CalendarEvent columns (rows are then plain tuples with attribute access)
+    entities = [getattr(CalendarEvent, c) for c in columns] if columns else [CalendarEvent]
+    q = session.query(*entities).filter(CalendarEvent.user_id == user_id)
+    start, end = parse_time(time_min), parse_time(time_max)
+    if start is not None:
+        q = q.filter(CalendarEvent.end_time > start)
+    if end is not None:
+        q = q.filter(CalendarEvent.start_time < end)
+    return q.order_by(CalendarEvent.start_time, CalendarEvent.event_id)
+
+def query_range(session, user_id, time_min, time_max, columns=None):
+    """Events overlapping [time_min, time_max), ordered by start like events().list(orderBy="startTime")."""
+    return _range_query(session, user_id, time_min, time_max, columns).all()
+
+def encode_cursor(row):
+    # keyset cursor: (start_time, event_id) of the last row returned, opaque to clients
+    raw = "%s|%s" % (row.start_time.isoformat() if row.start_time else "", row.event_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    """(start_time, event_id) of an encode_cursor token; ValueError if `token` isn't one."""
+    try:
+        start, sep, event_id = base64.urlsafe_b64decode(token.encode()).decode().partition("|")
+        if not sep or not event_id:
+            raise ValueError("cursor has no event id")
+        return (datetime.datetime.fromisoformat(start) if start else None), event_id
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError("bad cursor: %s" % e) from None
+
+def query_page(session, user_id, time_min, time_max, limit, cursor=None, columns=None):
+    """
+    One page of query_range: at most `limit` rows after `cursor` (from encode_cursor).
+    Seeks on (start_time, event_id) instead of OFFSET, so every page costs the same.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    q = _range_query(session, user_id, time_min, time_max, columns)
+    if cursor:
+        after_start, after_id = decode_cursor(cursor)
+        q = q.filter(or_(CalendarEvent.start_time > after_start,
+                         and_(CalendarEvent.start_time == after_start, CalendarEvent.event_id > after_id)))
+    rows = q.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+def format_time(dt):
+    return dt.isoformat() + "Z"
+
+def merge_intervals(intervals):
+    """(start, end) pairs -> sorted, non-overlapping pairs; touching intervals are joined."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+def busy_intervals(session, user_id, time_min, time_max):
+    """
+    Merged busy intervals inside [time_min, time_max); reads only the time columns, never event bodies.
+    Transparent events ("show me as available") are left out, as Google's freebusy does.
+    """
+    start, end = parse_time(time_min), parse_time(time_max)
+    rows = (session.query(CalendarEvent.start_time, CalendarEvent.end_time)
+            .filter(CalendarEvent.user_id == user_id, CalendarEvent.end_time > start, CalendarEvent.start_time < end,
+                    CalendarEvent.transparent.isnot(True)))
+    return merge_intervals((max(s, start), min(e, end)) for s, e in rows)
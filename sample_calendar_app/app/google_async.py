@@ -0,0 +1,92 @@
+'''
+Minimal async client for the Google Calendar v3 REST API on top of httpx.AsyncClient,
+used by the grpc.aio server so Google round trips never block the event loop.
+Returns the same JSON dicts as the googleapiclient service, so the server helpers
+(_create_body, _patch_body, event_mapping, event_store) work unchanged.
+'''
+import datetime
+import os
+from urllib.parse import quote
+
+import httpx
+
+import metrics
+from rate_limit import limiter, quota_reason, retry_after_seconds
+
+# same env var google_client uses, so both server modes can be pointed at a fake endpoint
+GOOGLE_API_ENDPOINT = os.environ.get("GOOGLE_API_ENDPOINT", "https://www.googleapis.com/calendar/v3/")
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+class GoogleApiError(Exception):
+    def __init__(self, status_code, content):
+        super().__init__("Google API returned %s: %s" % (status_code, content))
+        self.status_code = status_code
+        self.content = content
+
+_client = None
+
+def get_http_client():
+    # one pooled client per process; created lazily so it binds to the running event loop
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=200, max_keepalive_connections=50))
+    return _client
+
+async def refresh_access_token(refresh_token, client_id, client_secret):
+    """Returns (access_token, expiry) for a refresh token."""
+    resp = await get_http_client().post(TOKEN_URI, data={
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+    })
+    if resp.status_code >= 400:
+        raise GoogleApiError(resp.status_code, resp.text)
+    data = resp.json()
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=data.get("expires_in", 3600))
+    return data["access_token"], expiry
+
+def _classify(resp):
+    return quota_reason(resp.status_code, resp.content), retry_after_seconds(resp.headers.get("retry-after"))
+
+class AsyncCalendarClient:
+    def __init__(self, access_token, endpoint=None, user_id=None):
+        self.endpoint = (endpoint or GOOGLE_API_ENDPOINT).rstrip("/")
+        self.headers = {"Authorization": "Bearer %s" % access_token}
+        self.user_id = user_id  # per-user rate limit bucket
+
+    def _events_url(self, calendar_id, event_id=None):
+        url = "%s/calendars/%s/events" % (self.endpoint, quote(calendar_id, safe=""))
+        if event_id:
+            url += "/" + quote(event_id, safe="")
+        return url
+
+    async def _request(self, method, url, params=None, json=None, headers=None):
+        # shared with the thread-pool server's googleapiclient calls: same project and per-user buckets
+        def send():
+            metrics.count_google_call()
+            return get_http_client().request(method, url, params=params, json=json,
+                                             headers=dict(self.headers, **(headers or {})))
+        with metrics.span("google"):
+            resp = await limiter.acall(self.user_id, send, _classify)
+        if resp.status_code >= 400:
+            raise GoogleApiError(resp.status_code, resp.text)
+        return resp.json() if resp.content else None
+
+    async def insert(self, calendar_id, body):
+        return await self._request("POST", self._events_url(calendar_id), json=body)
+
+    async def patch(self, calendar_id, event_id, body, etag=None):
+        headers = {"If-Match": etag} if etag else None
+        return await self._request("PATCH", self._events_url(calendar_id, event_id), json=body, headers=headers)
+
+    async def delete(self, calendar_id, event_id):
+        return await self._request("DELETE", self._events_url(calendar_id, event_id))
+
+    async def freebusy(self, body):
+        return await self._request("POST", "%s/freeBusy" % self.endpoint, json=body)
+
+    async def list(self, calendar_id, **params):
+        # bools must go out as "true"/"false" like googleapiclient sends them
+        params = {k: (str(v).lower() if isinstance(v, bool) else v) for k, v in params.items() if v not in (None, "")}
+        return await self._request("GET", self._events_url(calendar_id), params=params)
@@ -1,21 +1,61 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+import google_auth_httplib2
+import httplib2
 import datetime
 import os
 
-SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
+from rate_limit import LimitedHttp
 
-def build_service_from_tokens(access_token, refresh_token, token_expiry, client_id, client_secret):
-    creds = Credentials(
+# calendar.freebusy is needed by QueryFreeBusy (freebusy.query); users who consented before must re-consent
+SCOPES = ["https://www.googleapis.com/auth/calendar.events", "https://www.googleapis.com/auth/calendar.freebusy"]
+# override the Calendar API base URL (e.g. a local fake Google for load tests)
+GOOGLE_API_ENDPOINT = os.environ.get("GOOGLE_API_ENDPOINT")
+
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+class PersistingCredentials(Credentials):
+    # google-auth refreshes lazily inside a request; on_refresh lets the caller store the new token
+    def __init__(self, *args, on_refresh=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_refresh = on_refresh
+
+    def refresh(self, request):
+        super().refresh(request)
+        if self.on_refresh:
+            self.on_refresh(self)
+
+def refresh_tokens(refresh_token, client_id, client_secret):
+    """Exchange a refresh token for a new access token; returns (access_token, expiry)."""
+    creds = Credentials(token=None, refresh_token=refresh_token, token_uri=TOKEN_URI,
+                        client_id=client_id, client_secret=client_secret)
+    creds.refresh(google_auth_httplib2.Request(httplib2.Http()))
+    return creds.token, creds.expiry
+
+def build_service_from_tokens(access_token, refresh_token, token_expiry, client_id, client_secret, on_refresh=None,
+                              user_id=None):
+    creds = PersistingCredentials(
         token=access_token,
         refresh_token=refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
+        token_uri=TOKEN_URI,
         client_id=client_id,
         client_secret=client_secret,
-        expiry=token_expiry
+        expiry=token_expiry,
+        on_refresh=on_refresh
     )
-    service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+
+    # httplib2.Http is not thread-safe, so a service object that is shared between
+    # gRPC worker threads must give every request its own transport.
+    # LimitedHttp charges the call to the shared project / per-user rate limits (rate_limit.py).
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(LimitedHttp(google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http()), user_id),
+                           *args, **kwargs)
+
+    service = build("calendar", "v3", http=google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http()),
+                    requestBuilder=request_builder, cache_discovery=False,
+                    client_options={"api_endpoint": GOOGLE_API_ENDPOINT} if GOOGLE_API_ENDPOINT else None)
     return service
 
 def make_oauth_flow(redirect_uri, client_secrets_file):
@@ -1,8 +1,13 @@
-from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi import FastAPI, Request, Header, HTTPException, BackgroundTasks
+from fastapi.responses import PlainTextResponse
 import uvicorn
-from sqlalchemy.orm import sessionmaker
-from models import UserCalendar
+import asyncio
+import os
+import metrics
+from user_cache import user_cache
+from calendar_pb2 import UserId
 from server_stub import CalendarSyncStub # gRPC client stub
+from sync_scheduler import SyncScheduler
 
 app = FastAPI()
 # create gRPC client (channel)
@@ -10,20 +15,49 @@ import grpc
 channel = grpc.insecure_channel("localhost:50051")
 client = CalendarSyncStub(channel)
 
+SYNC_RPC_TIMEOUT_SECONDS = float(os.environ.get("SYNC_RPC_TIMEOUT_SECONDS", "300"))
+
+def _still_subscribed(user_id):
+    # a user who opted out while their sync waited in the scheduler is dropped there
+    u = user_cache.get(user_id)
+    return u is not None and not u.opted_out
+
+# bursts of notifications for one user collapse into one HandlePushNotification per debounce window;
+# the blocking stub call runs on the scheduler's worker threads, never on the event loop
+scheduler = SyncScheduler(lambda user_id: client.HandlePushNotification(UserId(user_id=user_id), timeout=SYNC_RPC_TIMEOUT_SECONDS),
+                          should_sync=_still_subscribed)
+
+async def schedule_sync(channel_id, resource_id):
+    # Lookup which user this channel belongs to: cache first, DB (off the event loop) on a miss
+    u = user_cache.peek_by_channel(channel_id) or await asyncio.to_thread(user_cache.get_by_channel, channel_id)
+    if not u:
+        # unknown channel: ignore
+        return
+    # optionally verify resource_id matches u.webhook_resource_id
+    # schedule a (coalesced) sync on the gRPC server
+    scheduler.notify(u.user_id)
+
 @app.post("/webhook/calendar")
 async def google_push(request: Request,
+                      background_tasks: BackgroundTasks,
                       x_goog_channel_id: str = Header(None),
                       x_goog_resource_id: str = Header(None),
+                      x_goog_resource_state: str = Header(None),
                       x_goog_channel_token: str = Header(None)):
-    # Lookup which user this channel belongs to
-    session = Session()
-    u = session.query(UserCalendar).filter_by(webhook_channel_id=x_goog_channel_id).first()
-    if not u:
-        # unknown channel: ignore
-        session.close()
-        return {"status":"ignored"}
-    # optionally verify x_goog_resource_id matches u.webhook_resource_id
-    # notify gRPC server to perform sync
-    client.HandlePushNotification(UserId(user_id=u.user_id))
-    session.close()
+    # "sync" is the handshake Google sends when a channel is created; there is nothing to pull yet
+    if x_goog_resource_state != "sync":
+        # acknowledge right away; the lookup + hand-off run after the 200 has been sent
+        background_tasks.add_task(schedule_sync, x_goog_channel_id, x_goog_resource_id)
     return {"status":"ok"}
+
+@app.get("/webhook/metrics")
+def sync_metrics():
+    # queue depth and notifications-per-sync (coalesce_ratio) of the sync scheduler
+    return scheduler.stats()
+
+metrics.register_stats("sync_scheduler", scheduler.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # same format as the gRPC server's METRICS_PORT endpoint
+    return metrics.registry.render()
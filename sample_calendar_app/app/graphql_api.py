@@ -1,11 +1,170 @@
 # graphql_api.py
+import asyncio
+import itertools
+import logging
+import os
+import weakref
+from typing import List, Optional
+
 import strawberry
+from strawberry.dataloader import DataLoader
+from strawberry.extensions import SchemaExtension
+from strawberry.types.nodes import SelectedField
+from strawberry.utils.str_converters import to_snake_case
 from server_stub import CalendarSyncStub
 import grpc
+from google.protobuf import field_mask_pb2
 from google_protos import calendar_pb2
+from graphql_cache import EventsCache
+
+logger = logging.getLogger(__name__)
+
+GRPC_TARGET = os.environ.get("CALENDAR_GRPC_TARGET", "localhost:50051")
+GRPC_POOL_SIZE = int(os.environ.get("GRAPHQL_GRPC_POOL_SIZE", "4"))  # HTTP/2 connections to the gRPC server
+GRPC_KEEPALIVE_MS = int(os.environ.get("GRPC_KEEPALIVE_MS", "30000"))
+# per-call deadlines; ListEvents/CreateEvent may wait on Google (and its quota) inside the server
+QUERY_TIMEOUT_SECONDS = float(os.environ.get("GRAPHQL_QUERY_TIMEOUT_SECONDS", "10"))
+MUTATION_TIMEOUT_SECONDS = float(os.environ.get("GRAPHQL_MUTATION_TIMEOUT_SECONDS", "15"))
+# follow the server's SubscribeChanges feed to invalidate cached listEvents results; with 0
+# the cache only expires by GRAPHQL_CACHE_TTL_SECONDS and the gateway's own mutations
+GRAPHQL_CACHE_CHANGE_FEED = os.environ.get("GRAPHQL_CACHE_CHANGE_FEED", "1") == "1"
+# reconnect delay, doubled after every failed attempt up to the max (a server at CHANGE_STREAMS_MAX
+# refuses the stream with RESOURCE_EXHAUSTED until another gateway disconnects)
+CHANGE_FEED_RETRY_SECONDS = float(os.environ.get("GRAPHQL_CHANGE_FEED_RETRY_SECONDS", "1"))
+CHANGE_FEED_RETRY_MAX_SECONDS = float(os.environ.get("GRAPHQL_CHANGE_FEED_RETRY_MAX_SECONDS", "60"))
+
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", GRPC_KEEPALIVE_MS),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    # channels with identical args share one subchannel (one TCP connection) by default
+    ("grpc.use_local_subchannel_pool", 1),
+]
+
+class ChannelPool:
+    """
+    Round-robin over `size` grpc.aio channels. An aio channel belongs to the event loop it
+    was created on, so each loop gets its own set, opened on first use.
+    """
+    def __init__(self, target=GRPC_TARGET, size=GRPC_POOL_SIZE, options=CHANNEL_OPTIONS):
+        self.target = target
+        self.size = size
+        self.options = options
+        self._by_loop = weakref.WeakKeyDictionary()  # loop -> (channels, cycle of stubs)
+
+    def stub(self):
+        loop = asyncio.get_running_loop()
+        entry = self._by_loop.get(loop)
+        if entry is None:
+            channels = [grpc.aio.insecure_channel(self.target, options=self.options) for _ in range(self.size)]
+            entry = self._by_loop[loop] = (channels, itertools.cycle([CalendarSyncStub(c) for c in channels]))
+        return next(entry[1])
+
+    async def close(self):
+        entry = self._by_loop.pop(asyncio.get_running_loop(), None)
+        if entry:
+            await asyncio.gather(*(c.close() for c in entry[0]))
+
+pool = ChannelPool()
+
+class ChangeFeed:
+    """
+    Invalidates `cache` for every user in the server's SubscribeChanges stream. The cache is
+    only live while the stream is: the server sends headers once it has registered the
+    subscriber, so from then on no push-sync change can be missed. Reconnects on failure,
+    backing off exponentially while the server keeps refusing it.
+    """
+    def __init__(self, cache, retry_seconds=CHANGE_FEED_RETRY_SECONDS, retry_max_seconds=CHANGE_FEED_RETRY_MAX_SECONDS):
+        self.cache = cache
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._task = None
+        if GRAPHQL_CACHE_CHANGE_FEED:
+            cache.suspend()
+
+    def ensure_running(self):
+        # one feed for the process, on the loop of the first operation (restarted if that loop goes away)
+        if GRAPHQL_CACHE_CHANGE_FEED and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        delay = self.retry_seconds
+        while True:
+            call = pool.stub().SubscribeChanges(calendar_pb2.SubscribeChangesReq())
+            try:
+                await call.initial_metadata()
+                self.cache.resume()
+                delay = self.retry_seconds  # connected: the next loss retries quickly again
+                async for batch in call:
+                    self.cache.invalidate(batch.user_id)
+            except grpc.aio.AioRpcError as e:
+                logger.warning("change feed lost (%s), listEvents cache suspended; retrying in %.0fs", e.code(), delay)
+            finally:
+                self.cache.suspend()
+                call.cancel()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.retry_max_seconds)
+
+events_cache = EventsCache()
+change_feed = ChangeFeed(events_cache)
 
-channel = grpc.insecure_channel("localhost:50051")
-client = CalendarSyncStub(channel)
+class Backend:
+    """
+    One GraphQL request's view of the CalendarSync server. ListEvents lookups made in the
+    same execution tick (aliases, nested user lists) go out as one BatchListEvents; the
+    DataLoader drops repeated (user_id, time_min, time_max, fields) keys and events_cache
+    answers the ones it can. Mutations invalidate the user's cached windows. Every RPC is counted.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.rpcs = 0
+        self.cache_hits = 0
+        self.events = DataLoader(load_fn=self._load_events)
+
+    async def call(self, method, req, timeout):
+        self.rpcs += 1
+        return await getattr(self.pool.stub(), method)(req, timeout=timeout)
+
+    async def _load_events(self, keys):
+        results = [events_cache.get(key[:3], key[3]) for key in keys]
+        self.cache_hits += sum(r is not None for r in results)
+        misses = [i for i, r in enumerate(results) if r is None]
+        if not misses:
+            return results
+        generations = [events_cache.generation(keys[i][0]) for i in misses]
+        req = calendar_pb2.BatchListEventsReq(requests=[
+            calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min, time_max=time_max,
+                                       read_mask=field_mask_pb2.FieldMask(paths=fields))
+            for user_id, time_min, time_max, fields in (keys[i] for i in misses)])
+        resp = await self.call("BatchListEvents", req, QUERY_TIMEOUT_SECONDS)
+        for i, generation, r in zip(misses, generations, resp.results):
+            if r.error:
+                # a failed lookup fails only the fields that asked for it
+                results[i] = RuntimeError(r.error)
+                continue
+            results[i] = [to_event(e) for e in r.resp.events]
+            events_cache.put(keys[i][:3], keys[i][3], results[i], generation)
+        return results
+
+    async def mutate(self, method, req):
+        resp = await self.call(method, req, MUTATION_TIMEOUT_SECONDS)
+        events_cache.invalidate(req.user_id)
+        return resp
+
+class BackendExtension(SchemaExtension):
+    """Puts a fresh Backend in the context (a dict) of every operation and reports its RPC count and cache use."""
+    def on_operation(self):
+        change_feed.ensure_running()
+        context = self.execution_context.context
+        if context is None:
+            context = self.execution_context.context = {}
+        self.backend = context["backend"] = Backend(pool)
+        yield
+
+    def get_results(self):
+        return {"backendRpcs": self.backend.rpcs, "cacheHits": self.backend.cache_hits,
+                "cacheHitRate": round(events_cache.stats()["hit_rate"], 4)}
 
 '''Event Type'''
 @strawberry.type
@@ -17,21 +176,58 @@ class Event:
     end: str
     event_type: str
 
+def selected_event_fields(info):
+    """
+    Event fields the query selected under the current field (fragments included), as
+    ListEventsReq.read_mask paths. The server and Google only fetch and copy these; the
+    other Event attributes stay empty and are never sent to the client.
+    """
+    fields = set()
+    def walk(selections):
+        for sel in selections:
+            if isinstance(sel, SelectedField):
+                if not sel.name.startswith("__"):
+                    fields.add(to_snake_case(sel.name))
+            else:
+                walk(sel.selections)
+    for field in info.selected_fields:
+        walk(field.selections)
+    return tuple(sorted(fields))
+
+def to_event(e):
+    return Event(id=e.id, title=e.title, description=e.description, start=e.start, end=e.end, event_type=e.event_type)
+
 '''Queries for Events'''
 @strawberry.type
 class Query:
     @strawberry.field
-    def list_events(self, user_id: str, time_min: str = None, time_max: str = None):
-        resp = client.ListEvents(calendar_pb2.ListEventsReq(user_id=user_id, time_min=(time_min or ""), time_max=(time_max or "")))
-        return [Event(id=e.id, title=e.title, description=e.description, start=e.start, end=e.end, event_type=e.event_type) for e in resp.events]
+    async def list_events(self, info: strawberry.Info, user_id: str, time_min: Optional[str] = None, time_max: Optional[str] = None) -> List[Event]:
+        key = (user_id, time_min or "", time_max or "", selected_event_fields(info))
+        return await info.context["backend"].events.load(key)
 
 '''Mutations for Events'''
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def create_event(self, user_id: str, title: str, desc: str, start_iso: str, end_iso: str, event_type: str):
+    async def create_event(self, info: strawberry.Info, user_id: str, title: str, desc: str, start_iso: str, end_iso: str, event_type: str) -> Event:
         req = calendar_pb2.CreateEventReq(user_id=user_id, title=title, description=desc, start_iso=start_iso, end_iso=end_iso, event_type=event_type)
-        ev = client.CreateEvent(req)
-        return Event(id=ev.id, title=ev.title, description=ev.description, start=ev.start, end=ev.end, event_type=ev.event_type)
+        ev = await info.context["backend"].mutate("CreateEvent", req)
+        return to_event(ev)
+
+    @strawberry.mutation
+    async def update_event(self, info: strawberry.Info, user_id: str, event_id: str, title: Optional[str] = None,
+                           desc: Optional[str] = None, start_iso: Optional[str] = None, end_iso: Optional[str] = None,
+                           event_type: Optional[str] = None, etag: Optional[str] = None) -> Event:
+        # unset arguments are left unchanged (UpdateEvent is a PATCH)
+        req = calendar_pb2.UpdateEventReq(user_id=user_id, event_id=event_id, title=title or "", description=desc or "",
+                                          start_iso=start_iso or "", end_iso=end_iso or "", event_type=event_type or "",
+                                          etag=etag or "")
+        ev = await info.context["backend"].mutate("UpdateEvent", req)
+        return to_event(ev)
+
+    @strawberry.mutation
+    async def delete_event(self, info: strawberry.Info, user_id: str, event_id: str) -> bool:
+        await info.context["backend"].mutate("DeleteEvent", calendar_pb2.DeleteEventReq(user_id=user_id, event_id=event_id))
+        return True
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+schema = strawberry.Schema(query=Query, mutation=Mutation, extensions=[BackendExtension])
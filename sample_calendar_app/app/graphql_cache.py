@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+GRAPHQL_CACHE_SIZE = int(os.environ.get("GRAPHQL_CACHE_SIZE", "10000"))  # (user, window) entries
+# upper bound on staleness for changes the gateway is not told about (0 disables the cache)
+GRAPHQL_CACHE_TTL_SECONDS = float(os.environ.get("GRAPHQL_CACHE_TTL_SECONDS", "30"))
+
+class EventsCache:
+    """
+    TTL + LRU cache of listEvents results keyed by (user_id, time_min, time_max).
+
+    An entry remembers the Event fields it was fetched with (() = all of them) and only
+    answers lookups that need a subset of those. invalidate(user_id) drops every window
+    of that user; it is called after the gateway's own mutations and for every change
+    batch from the server's SubscribeChanges feed. While that feed is down the cache is
+    suspended (no hits, no stores), since changes could be missed.
+    """
+
+    def __init__(self, max_size=GRAPHQL_CACHE_SIZE, ttl=GRAPHQL_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, fields, events)
+        self._by_user = {}             # user_id -> keys of its entries
+        self._generations = {}         # bumped on invalidate so in-flight fetches can't store stale results
+        self._epoch = 0                # bumped on suspend, for the same reason
+        self._lock = threading.Lock()
+        self.suspended = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._epoch, self._generations.get(user_id, 0)
+
+    def get(self, key, fields):
+        with self._lock:
+            entry = None if self.suspended or not self.ttl else self._entries.get(key)
+            if entry is not None:
+                expires_at, cached_fields, events = entry
+                if expires_at < self._clock():
+                    self._drop(key)
+                elif not cached_fields or (fields and set(fields) <= set(cached_fields)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return events
+            self.misses += 1
+            return None
+
+    def put(self, key, fields, events, generation):
+        """Store a result fetched while the user was at `generation` (see generation())."""
+        user_id = key[0]
+        with self._lock:
+            if self.suspended or not self.ttl or (self._epoch, self._generations.get(user_id, 0)) != generation:
+                return
+            self._drop(key)
+            self._entries[key] = (self._clock() + self.ttl, fields, events)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        if self._entries.pop(key, None) is not None:
+            keys = self._by_user.get(key[0])
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for key in self._by_user.pop(user_id, ()):
+                del self._entries[key]
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def suspend(self):
+        with self._lock:
+            self.suspended = True
+            self._entries.clear()
+            self._by_user.clear()
+            self._epoch += 1  # results fetched before the suspension must not be stored after it
+
+    def resume(self):
+        with self._lock:
+            self.suspended = False
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "suspended": self.suspended,
+            }
@@ -0,0 +1,188 @@
+'''
+In-process interval index of each user's events for overlap / free-slot queries.
+
+Each user's events are kept as an implicit augmented interval tree (the cgranges
+layout): intervals sorted by start in flat arrays, with the max end of every subtree
+stored at the subtree's middle element. Overlap queries are O(log n + k) and return
+hits in start order, so "first free slot of length D" stops at the first gap.
+
+The index is kept current from the sync path: event_store records every upsert /
+delete on the SQLAlchemy session and the changes are applied here only after that
+session commits (dropped on rollback). Changes just mark the index dirty; the arrays
+are rebuilt lazily on the next query.
+'''
+from collections import OrderedDict
+import datetime
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import CalendarEvent
+
+INTERVAL_INDEX_USERS = int(os.environ.get("INTERVAL_INDEX_USERS", "1024"))
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_PENDING = "interval_index.pending"
+
+def _ts(dt):
+    return int((dt - _EPOCH).total_seconds())
+
+def _dt(ts):
+    return _EPOCH + datetime.timedelta(seconds=ts)
+
+class IntervalIndex:
+    def __init__(self, events=()):
+        # event_id -> (start, end, event_type), times as epoch seconds
+        self._events = {event_id: (_ts(start), _ts(end), event_type) for event_id, start, end, event_type in events}
+        self._lock = threading.Lock()
+        self._tree = None  # (starts, ends, max_ends, ids, types, root_k); None = rebuild before next query
+
+    def __len__(self):
+        return len(self._events)
+
+    def upsert(self, event_id, start, end, event_type):
+        with self._lock:
+            if start is None or end is None:
+                self._events.pop(event_id, None)
+            else:
+                self._events[event_id] = (_ts(start), _ts(end), event_type)
+            self._tree = None
+
+    def remove(self, event_id):
+        with self._lock:
+            self._events.pop(event_id, None)
+            self._tree = None
+
+    def _snapshot(self):
+        # queries iterate over an immutable snapshot; a concurrent change only swaps in a new one later
+        with self._lock:
+            if self._tree is None:
+                self._tree = self._build()
+            return self._tree
+
+    def _build(self):
+        items = sorted((s, e, event_id, t) for event_id, (s, e, t) in self._events.items())
+        starts = [it[0] for it in items]
+        ends = [it[1] for it in items]
+        max_ends = list(ends)  # leaves (even positions) hold their own end
+        n = len(items)
+        if not n:
+            return starts, ends, max_ends, [], [], -1
+        last_i = (n - 1) & ~1
+        last = ends[last_i]
+        k = 1
+        while 1 << k <= n:
+            x = 1 << (k - 1)
+            for i in range((x << 1) - 1, n, x << 2):
+                right = max_ends[i + x] if i + x < n else last
+                max_ends[i] = max(ends[i], max_ends[i - x], right)
+            # `last` tracks the max end of the rightmost, possibly incomplete, subtree at this level
+            last_i = last_i - x if last_i >> k & 1 else last_i + x
+            if last_i < n and max_ends[last_i] > last:
+                last = max_ends[last_i]
+            k += 1
+        return starts, ends, max_ends, [it[2] for it in items], [it[3] for it in items], k - 1
+
+    def _iter_overlaps(self, start, end):
+        """Positions of intervals overlapping [start, end), in start order."""
+        starts, ends, max_ends, _, _, root_k = self._snapshot()
+        n = len(starts)
+        if not n:
+            return
+        stack = [(root_k, (1 << root_k) - 1, False)]
+        while stack:
+            k, x, left_done = stack.pop()
+            if k <= 3:
+                # small subtree: a linear scan is cheaper than descending further
+                i = x >> k << k
+                stop = min(i + (1 << (k + 1)) - 1, n)
+                while i < stop and starts[i] < end:
+                    if start < ends[i]:
+                        yield i
+                    i += 1
+            elif not left_done:
+                y = x - (1 << (k - 1))
+                stack.append((k, x, True))
+                if y >= n or max_ends[y] > start:
+                    stack.append((k - 1, y, False))
+            elif x < n and starts[x] < end:
+                if start < ends[x]:
+                    yield x
+                stack.append((k - 1, x + (1 << (k - 1)), False))
+
+    def overlaps(self, start, end):
+        """(event_id, start, end, event_type) for every event overlapping [start, end), ordered by start."""
+        starts, ends, _, ids, types, _ = self._snapshot()
+        return [(ids[i], _dt(starts[i]), _dt(ends[i]), types[i]) for i in self._iter_overlaps(_ts(start), _ts(end))]
+
+    def first_free_slot(self, start, end, duration):
+        """Earliest [slot, slot + duration) inside [start, end) that overlaps no event, or None."""
+        starts, ends, _, _, _, _ = self._snapshot()
+        lo, hi, length = _ts(start), _ts(end), int(duration.total_seconds())
+        cursor = lo
+        for i in self._iter_overlaps(lo, hi):
+            if starts[i] - cursor >= length:
+                break
+            cursor = max(cursor, ends[i])
+        if hi - cursor < length:
+            return None
+        return _dt(cursor), _dt(cursor + length)
+
+class IndexRegistry:
+    """Per-user IntervalIndex, loaded from the event store on first use, LRU-bounded."""
+
+    def __init__(self, max_users=INTERVAL_INDEX_USERS):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._generations = {}  # bumped on every change so a load racing a commit isn't cached stale
+
+    def get(self, session, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+            generation = self._generations.get(user_id, 0)
+        rows = (session.query(CalendarEvent.event_id, CalendarEvent.start_time, CalendarEvent.end_time, CalendarEvent.event_type)
+                .filter(CalendarEvent.user_id == user_id,
+                        CalendarEvent.start_time.isnot(None), CalendarEvent.end_time.isnot(None)))
+        index = IntervalIndex((r.event_id, r.start_time, r.end_time, r.event_type) for r in rows)
+        with self._lock:
+            if self._generations.get(user_id, 0) == generation:
+                self._indexes[user_id] = index
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def apply(self, changes):
+        with self._lock:
+            for op, user_id, *args in changes:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+                index = self._indexes.get(user_id)
+                if op == "clear":
+                    self._indexes.pop(user_id, None)
+                elif index is None:
+                    continue  # not loaded: the next get() reads the committed rows
+                elif op == "upsert":
+                    index.upsert(*args)
+                else:
+                    index.remove(*args)
+
+registry = IndexRegistry()
+
+def record(session, op, user_id, *args):
+    """Queue an index change ("upsert" | "delete" | "clear") to apply once `session` commits."""
+    session.info.setdefault(_PENDING, []).append((op, user_id) + args)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    changes = session.info.pop(_PENDING, None)
+    if changes:
+        registry.apply(changes)
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,344 @@
+'''
+Per-RPC latency metrics for CalendarSync.
+
+MetricsInterceptor (thread server) and AioMetricsInterceptor (grpc.aio) time every RPC
+and make it the current RPC while its handler runs. span(phase) records per-phase time
+against the current RPC. It is called from the DB engine (every statement), Google
+service builds, the Google transports (which also count calls) and the proto
+conversion helpers. Work outside an RPC (token refresher, onboarding, channel renewal)
+is recorded as method="background". Phases are inclusive and may nest (google includes
+quota_wait), so they don't add up to the RPC total.
+
+Everything is served in the Prometheus text format on METRICS_PORT (/metrics), along
+with the stats() of the components registered with register_stats(). With
+METRICS_OTEL=1 the same RPCs and phases are also emitted as OpenTelemetry spans.
+That needs opentelemetry-sdk and an exporter (e.g. OTLP to a local collector)
+configured for the process.
+
+METRICS_PROFILE_SAMPLE_RATE > 0 runs cProfile on that fraction of thread-server RPCs
+(one at a time). It keeps the .prof in METRICS_PROFILE_DIR when the RPC took at least
+METRICS_PROFILE_SLOW_MS. aio RPCs are not profiled: a profiler on the event loop
+thread would also catch every other task.
+'''
+import bisect
+from contextlib import contextmanager, nullcontext
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))  # 0 disables the endpoint
+METRICS_OTEL = os.environ.get("METRICS_OTEL", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("METRICS_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.environ.get("METRICS_PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND = "background"
+
+_current = contextvars.ContextVar("calendar_rpc_method", default=None)
+
+_tracer = None
+if METRICS_OTEL:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("calendar_sync")
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._counters = {}    # name -> {labels: value}
+        self._help = {}
+        self._stats = {}       # prefix -> stats() callable
+
+    def observe(self, name, labels, value, help=""):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            h = series.get(labels)
+            if h is None:
+                h = series[labels] = Histogram()
+                self._help.setdefault(name, help)
+            h.observe(value)
+
+    def inc(self, name, labels, amount=1, help=""):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+            self._help.setdefault(name, help)
+
+    def register_stats(self, prefix, stats_fn):
+        """Export the numeric values of stats_fn() as gauges named calendar_<prefix>_<key>."""
+        with self._lock:
+            self._stats[prefix] = stats_fn
+
+    def render(self):
+        out = []
+        with self._lock:
+            histograms = {name: {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            stats = dict(self._stats)
+        for name, series in sorted(histograms.items()):
+            out.append("# HELP %s %s" % (name, self._help.get(name, "")))
+            out.append("# TYPE %s histogram" % name)
+            for labels, (counts, total, count, buckets) in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(buckets + ("+Inf",), counts):
+                    cumulative += n
+                    out.append("%s_bucket%s %d" % (name, _labels(labels, (("le", bound),)), cumulative))
+                out.append("%s_sum%s %.6f" % (name, _labels(labels), total))
+                out.append("%s_count%s %d" % (name, _labels(labels), count))
+        for name, series in sorted(counters.items()):
+            out.append("# HELP %s %s" % (name, self._help.get(name, "")))
+            out.append("# TYPE %s counter" % name)
+            for labels, value in sorted(series.items()):
+                out.append("%s%s %s" % (name, _labels(labels), value))
+        for prefix, stats_fn in sorted(stats.items()):
+            try:
+                values = stats_fn()
+            except Exception as e:
+                out.append("# %s stats failed: %s" % (prefix, e))
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    name = "calendar_%s_%s" % (prefix, key)
+                    out.append("# TYPE %s gauge" % name)
+                    out.append("%s %s" % (name, float(value)))
+        return "\n".join(out) + "\n"
+
+registry = Registry()
+register_stats = registry.register_stats
+
+def current_method():
+    return _current.get() or BACKGROUND
+
+def in_current_rpc(fn):
+    """Wrap fn so that it records against the calling RPC when run on another thread (e.g. a pool)."""
+    method = _current.get()
+    def run(*args, **kwargs):
+        token = _current.set(method)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+@contextmanager
+def span(phase):
+    """Time the enclosed block as `phase` of the current RPC."""
+    otel = _tracer.start_as_current_span(phase) if _tracer else nullcontext()
+    t0 = time.perf_counter()
+    with otel:
+        try:
+            yield
+        finally:
+            registry.observe("calendar_phase_seconds", (("method", current_method()), ("phase", phase)),
+                             time.perf_counter() - t0, "Time spent per phase of an RPC (phases may nest)")
+
+def count_google_call():
+    registry.inc("calendar_google_calls_total", (("method", current_method()),),
+                 help="Google API HTTP requests, retries included, per RPC method")
+
+def instrument_engine(engine):
+    """Record every SQL statement on `engine` (a sync Engine, or an AsyncEngine's sync_engine) as phase db."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_t0 = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, parameters, context, executemany):
+        t0 = getattr(context, "_metrics_t0", None)
+        if t0 is not None:
+            registry.observe("calendar_phase_seconds", (("method", current_method()), ("phase", "db")),
+                             time.perf_counter() - t0, "Time spent per phase of an RPC (phases may nest)")
+
+# --- slow-request profiling ---
+
+_profile_slot = threading.Lock()
+
+def _start_profile():
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _profile_slot.acquire(blocking=False):
+        return None  # another RPC is being profiled
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def _finish_profile(profiler, method, elapsed):
+    if profiler is None:
+        return
+    profiler.disable()
+    _profile_slot.release()
+    if elapsed * 1000 < PROFILE_SLOW_MS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, "%s-%d-%dms.prof" % (method, time.time() * 1000, elapsed * 1000)))
+    registry.inc("calendar_slow_profiles_total", (("method", method),), help="cProfile dumps of slow RPCs")
+
+# --- interceptors ---
+
+def _code(context, failed):
+    code = context.code() if hasattr(context, "code") else None
+    if code is None:
+        return "UNKNOWN" if failed else "OK"
+    return code.name if hasattr(code, "name") else str(code)
+
+def _observe_rpc(method, code, elapsed):
+    registry.observe("calendar_rpc_seconds", (("method", method), ("code", code)), elapsed,
+                     "CalendarSync RPC latency, handler only (stream RPCs until the last message)")
+
+def _method_name(handler_call_details):
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+def _otel_span(method):
+    return _tracer.start_as_current_span(method) if _tracer else nullcontext()
+
+def _wrap_unary(method, behavior):
+    def wrapper(request, context):
+        token = _current.set(method)
+        profiler = _start_profile()
+        t0, failed = time.perf_counter(), False
+        try:
+            with _otel_span(method):
+                return behavior(request, context)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _finish_profile(profiler, method, elapsed)
+            _observe_rpc(method, _code(context, failed), elapsed)
+            _current.reset(token)
+    return wrapper
+
+def _wrap_stream(method, behavior):
+    def wrapper(request, context):
+        token = _current.set(method)
+        profiler = _start_profile()
+        t0, failed = time.perf_counter(), False
+        try:
+            with _otel_span(method):
+                yield from behavior(request, context)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _finish_profile(profiler, method, elapsed)
+            _observe_rpc(method, _code(context, failed), elapsed)
+            _current.reset(token)
+    return wrapper
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+        if handler.unary_unary:
+            return grpc.unary_unary_rpc_method_handler(
+                _wrap_unary(method, handler.unary_unary),
+                request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        if handler.unary_stream:
+            return grpc.unary_stream_rpc_method_handler(
+                _wrap_stream(method, handler.unary_stream),
+                request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        return handler
+
+def _wrap_unary_async(method, behavior):
+    async def wrapper(request, context):
+        token = _current.set(method)
+        t0, failed = time.perf_counter(), False
+        try:
+            with _otel_span(method):
+                return await behavior(request, context)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _observe_rpc(method, _code(context, failed), time.perf_counter() - t0)
+            _current.reset(token)
+    return wrapper
+
+def _wrap_stream_async(method, behavior):
+    async def wrapper(request, context):
+        token = _current.set(method)
+        t0, failed = time.perf_counter(), False
+        try:
+            with _otel_span(method):
+                async for msg in behavior(request, context):
+                    yield msg
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _observe_rpc(method, _code(context, failed), time.perf_counter() - t0)
+            _current.reset(token)
+    return wrapper
+
+class AioMetricsInterceptor(grpc.aio.ServerInterceptor):
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+        if handler.unary_unary:
+            return grpc.unary_unary_rpc_method_handler(
+                _wrap_unary_async(method, handler.unary_unary),
+                request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        if handler.unary_stream:
+            return grpc.unary_stream_rpc_method_handler(
+                _wrap_stream_async(method, handler.unary_stream),
+                request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer)
+        return handler
+
+# --- /metrics endpoint ---
+
+def start_http_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve registry.render() on http://host:port/metrics from a daemon thread; returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("content-type", "text/plain; version=0.0.4")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
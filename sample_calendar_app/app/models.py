@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON, Text, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
 Base = declarative_base()
@@ -9,11 +9,37 @@ class UserCalendar(Base):
     user_id = Column(String, unique=True, index=True)
     access_token = Column(String)
     refresh_token = Column(String)
-    token_expiry = Column(DateTime)
+    token_expiry = Column(DateTime, index=True)  # scanned by the background token refresher
     calendar_id = Column(String, default="primary")
     sync_token = Column(String, nullable=True)  # Google syncToken for incremental sync
+    sync_page_token = Column(String, nullable=True)  # checkpoint of an in-progress paginated sync, used to resume it
     is_synced = Column(Boolean, default=False)
+    synced_from = Column(DateTime, nullable=True)  # timeMin of the last full sync; local events are complete from here on
     webhook_channel_id = Column(String, nullable=True)
     webhook_resource_id = Column(String, nullable=True)
+    webhook_expiration = Column(DateTime, nullable=True)  # when Google drops the channel; the channel manager renews ahead of it
     opted_out = Column(Boolean, default=False)
     extra = Column(JSON, default={})
+
+class CalendarEvent(Base):
+    # local copy of a user's Google events, kept current by HandlePushNotification so ListEvents can be served from disk
+    __tablename__ = "calendar_events"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=False)
+    event_id = Column(String, nullable=False)
+    calendar_id = Column(String, default="primary")
+    title = Column(String, default="")
+    description = Column(Text, default="")
+    start = Column(String, default="")  # as returned by Google (dateTime or all-day date)
+    end = Column(String, default="")
+    start_time = Column(DateTime)  # normalised to naive UTC for range queries
+    end_time = Column(DateTime)
+    event_type = Column(String, default="")  # ours, from extendedProperties.private.event_type
+    google_event_type = Column(String, default="")  # Google's eventType ("default", "outOfOffice", ...)
+    transparent = Column(Boolean, default=False)  # Google transparency == "transparent": shown, but not busy
+    etag = Column(String, nullable=True)
+    write_through = Column(Boolean, default=False)  # written by a mutation RPC, not yet seen by a sync
+    __table_args__ = (
+        UniqueConstraint("user_id", "event_id", name="uq_calendar_events_user_event"),
+        Index("ix_calendar_events_user_range", "user_id", "start_time", "end_time"),
+    )
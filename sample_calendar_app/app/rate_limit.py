@@ -0,0 +1,224 @@
+'''
+Shared Google API rate limiter: a token bucket for the whole project plus one per
+user, and jittered exponential backoff on quota errors (429, 403 rateLimitExceeded /
+userRateLimitExceeded).
+
+Every Google call from either server goes through `limiter`: the googleapiclient
+transport is wrapped in LimitedHttp (google_client.build_service_from_tokens) and the
+httpx client calls limiter.acall (google_async). A quota error also pauses the bucket
+it was charged to, so every handler sharing that bucket slows down together instead
+of retrying into the same wall; the throttled call itself retries through the bucket.
+'''
+import asyncio
+from collections import OrderedDict
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+
+GOOGLE_PROJECT_QPS = float(os.environ.get("GOOGLE_PROJECT_QPS", "100"))
+GOOGLE_PROJECT_BURST = float(os.environ.get("GOOGLE_PROJECT_BURST", "200"))
+GOOGLE_USER_QPS = float(os.environ.get("GOOGLE_USER_QPS", "10"))
+GOOGLE_USER_BURST = float(os.environ.get("GOOGLE_USER_BURST", "20"))
+GOOGLE_MAX_RETRIES = int(os.environ.get("GOOGLE_MAX_RETRIES", "5"))
+GOOGLE_BACKOFF_BASE = float(os.environ.get("GOOGLE_BACKOFF_BASE_SECONDS", "0.5"))
+GOOGLE_BACKOFF_MAX = float(os.environ.get("GOOGLE_BACKOFF_MAX_SECONDS", "32"))
+RATE_LIMIT_USERS = int(os.environ.get("RATE_LIMIT_USERS", "10000"))
+
+USER_QUOTA_REASONS = ("userRateLimitExceeded",)
+# daily quotaExceeded is left alone: backing off for seconds won't bring it back
+QUOTA_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+def quota_reason(status, content):
+    """The quota error reason of a Google response, or None if it isn't one."""
+    if status == 429:
+        return "rateLimitExceeded"
+    if status != 403 or not content:
+        return None
+    try:
+        errors = json.loads(content)["error"].get("errors", [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    for error in errors:
+        if error.get("reason") in QUOTA_REASONS:
+            return error["reason"]
+    return None
+
+class TokenBucket:
+    """
+    Reservation-style bucket: reserve() always takes the tokens and returns how long the
+    caller must wait before using them, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, cost=1):
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= cost
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def pause(self, seconds):
+        # no new reservation is granted for at least `seconds` (an existing longer queue is kept)
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+class RateLimiter:
+    def __init__(self, project_qps=GOOGLE_PROJECT_QPS, project_burst=GOOGLE_PROJECT_BURST,
+                 user_qps=GOOGLE_USER_QPS, user_burst=GOOGLE_USER_BURST, max_retries=GOOGLE_MAX_RETRIES,
+                 backoff_base=GOOGLE_BACKOFF_BASE, backoff_max=GOOGLE_BACKOFF_MAX, max_users=RATE_LIMIT_USERS,
+                 clock=time.monotonic):
+        self.project = TokenBucket(project_qps, project_burst, clock)
+        self.user_qps = user_qps
+        self.user_burst = user_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_users = max_users
+        self._clock = clock
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # metrics
+        self.calls = 0
+        self.queued = 0        # calls that had to wait for a token
+        self.waiting = 0       # calls waiting right now
+        self.wait_seconds = 0.0
+        self.throttled = 0     # quota errors returned by Google
+        self.retries = 0
+        self.gave_up = 0       # still throttled after max_retries; the error goes back to the caller
+
+    def _user_bucket(self, user_id):
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = self._users[user_id] = TokenBucket(self.user_qps, self.user_burst, self._clock)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            return bucket
+
+    def _reserve(self, user_id, cost):
+        delay = self.project.reserve(cost)
+        if user_id is not None:
+            delay = max(delay, self._user_bucket(user_id).reserve(cost))
+        with self._lock:
+            self.calls += 1
+            if delay > 0:
+                self.queued += 1
+                self.waiting += 1
+                self.wait_seconds += delay
+        return delay
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def _on_quota_error(self, user_id, reason, attempt, retry_after):
+        """Pause the bucket the error belongs to; False once retries are exhausted."""
+        with self._lock:
+            self.throttled += 1
+            if attempt >= self.max_retries:
+                self.gave_up += 1
+                return False
+            self.retries += 1
+        # full jitter: uniform in [0, base * 2^attempt], capped; Retry-After wins when Google sends one
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, retry_after)
+        if reason in USER_QUOTA_REASONS and user_id is not None:
+            self._user_bucket(user_id).pause(delay)
+        else:
+            self.project.pause(delay)
+        return True
+
+    def call(self, user_id, fn, classify, cost=1):
+        """
+        Run fn() under the limiter. classify(result) -> (quota_reason or None, retry_after
+        seconds or None). The last throttled result is returned as-is once retries run out.
+        """
+        attempt = 0
+        while True:
+            delay = self._reserve(user_id, cost)
+            if delay > 0:
+                with metrics.span("quota_wait"):
+                    time.sleep(delay)
+                self._done_waiting()
+            result = fn()
+            reason, retry_after = classify(result)
+            if reason is None:
+                return result
+            if not self._on_quota_error(user_id, reason, attempt, retry_after):
+                return result
+            attempt += 1  # the retry's reservation waits out the pause
+
+    async def acall(self, user_id, coro_fn, classify, cost=1):
+        """Same as call() for coroutine functions; waits with asyncio.sleep."""
+        attempt = 0
+        while True:
+            delay = self._reserve(user_id, cost)
+            if delay > 0:
+                with metrics.span("quota_wait"):
+                    await asyncio.sleep(delay)
+                self._done_waiting()
+            result = await coro_fn()
+            reason, retry_after = classify(result)
+            if reason is None:
+                return result
+            if not self._on_quota_error(user_id, reason, attempt, retry_after):
+                return result
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "queued": self.queued, "waiting": self.waiting,
+                    "wait_seconds": round(self.wait_seconds, 3), "throttled": self.throttled,
+                    "retries": self.retries, "gave_up": self.gave_up, "users": len(self._users)}
+
+limiter = RateLimiter()
+
+def retry_after_seconds(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None  # HTTP-date form; fall back to our own backoff
+
+def classify_httplib2(result):
+    resp, content = result
+    return quota_reason(resp.status, content), retry_after_seconds(resp.get("retry-after"))
+
+class LimitedHttp:
+    """httplib2.Http look-alike that sends every request through the limiter."""
+
+    def __init__(self, http, user_id=None, limiter=limiter):
+        self.http = http
+        self.user_id = user_id
+        self.limiter = limiter
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        cost = 1
+        if "/batch/" in uri and body:
+            # Google charges every request inside a batch separately
+            cost = max(1, (body.decode() if isinstance(body, bytes) else body).count("Content-ID:"))
+        def send():
+            metrics.count_google_call()
+            return self.http.request(uri, method, body, headers, *args, **kwargs)
+        with metrics.span("google"):
+            return self.limiter.call(self.user_id, send, classify_httplib2, cost)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
@@ -2,21 +2,244 @@ import grpc
 from concurrent import futures
 import calendar_pb2_grpc, calendar_pb2
 from google_client import build_service_from_tokens, make_oauth_flow, SCOPES
-from models import UserCalendar, Base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from service_cache import ServiceCache
+from models import UserCalendar
+import event_store
+import event_mapping
+import interval_index
+import sync_engine
+import sync_scheduler
+import bulk_sync
+import channel_manager
+import change_bus
+import metrics
+import rate_limit
+from db import init_db, session_scope
+from user_cache import user_cache
+import token_refresher
 from googleapiclient.errors import HttpError
-import uuid, datetime, json, os
+from google.protobuf.empty_pb2 import Empty
+import contextlib, uuid, datetime, json, logging, os, threading
+
+logger = logging.getLogger(__name__)
 
 # Config
 CLIENT_SECRETS_FILE = os.environ.get("GOOGLE_CLIENT_SECRETS", "client_secret.json")
 REDIRECT_URI = os.environ.get("OAUTH_REDIRECT_URI", "https://yourdomain.com/oauth2callback")
 CLIENT_ID = "<from file>"
 CLIENT_SECRET = "<from file>"
+SERVICE_CACHE_SIZE = int(os.environ.get("SERVICE_CACHE_SIZE", "1024"))
+# ops per Google batch HTTP request; Google accepts up to 1000 but recommends staying around 50
+GOOGLE_BATCH_SIZE = int(os.environ.get("GOOGLE_BATCH_SIZE", "50"))
+# events read per page by StreamEvents when the request doesn't set page_size
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", "250"))
+# per-user lookups QueryFreeBusy runs at once, shared by all in-flight QueryFreeBusy RPCs
+FREEBUSY_CONCURRENCY = int(os.environ.get("FREEBUSY_CONCURRENCY", "16"))
+# ListEvents lookups BatchListEvents runs at once, shared by all in-flight BatchListEvents RPCs
+BATCH_LIST_CONCURRENCY = int(os.environ.get("BATCH_LIST_CONCURRENCY", "16"))
+# worker threads of the thread-pool server ("thread" mode), i.e. RPCs it handles at once
+SERVER_MAX_WORKERS = int(os.environ.get("SERVER_MAX_WORKERS", "10"))
+# SubscribeChanges streams the thread-pool server serves at once (one per GraphQL gateway); each holds
+# a worker for its whole lifetime, so by default they get half of SERVER_MAX_WORKERS and unary RPCs
+# keep the rest (the aio server has no such limit)
+CHANGE_STREAMS_MAX = int(os.environ.get("CHANGE_STREAMS_MAX", str(max(1, SERVER_MAX_WORKERS // 2))))
+
+init_db()
+
+# built Google services are reused across RPCs; entries are dropped when a user's tokens change
+service_cache = ServiceCache(max_size=SERVICE_CACHE_SIZE)
+freebusy_pool = futures.ThreadPoolExecutor(max_workers=FREEBUSY_CONCURRENCY, thread_name_prefix="freebusy")
+batch_list_pool = futures.ThreadPoolExecutor(max_workers=BATCH_LIST_CONCURRENCY, thread_name_prefix="batchlist")
+change_stream_slots = threading.BoundedSemaphore(CHANGE_STREAMS_MAX)
+
+def _build_service(u):
+    with metrics.span("service_build"):
+        return build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET,
+                                         on_refresh=token_refresher.on_request_refresh(u.user_id), user_id=u.user_id)
+
+def get_service(u):
+    return service_cache.get_or_build(u.user_id, lambda: _build_service(u))
+
+# first (full-window) syncs run here, BULK_SYNC_WORKERS at a time, never inline in an RPC
+onboarding = bulk_sync.BulkSyncRunner(get_service)
+
+def _create_body(request):
+    return {
+        "user_id": request.user_id,
+        "summary": request.title,
+        "description": request.description,
+        "start": {"dateTime": request.start_iso},
+        "end": {"dateTime": request.end_iso},
+        "extendedProperties": {"private": {"event_type": request.event_type}} # extendedProperties.private.event_type is used to persist your internal event type into the Google event so you can read it back later. Google’s event schema supports extendedProperties.
+    }
+
+def _patch_body(request):
+    # only the fields the caller set; events().patch leaves everything else untouched
+    body = {}
+    if request.title:
+        body["summary"] = request.title
+    if request.description:
+        body["description"] = request.description
+    if request.start_iso:
+        body["start"] = {"dateTime": request.start_iso}
+    if request.end_iso:
+        body["end"] = {"dateTime": request.end_iso}
+    if request.event_type:
+        body["extendedProperties"] = {"private": {"event_type": request.event_type}}
+    return body
+
+def _can_serve(u, time_min):
+    """event_store.can_serve; users synced before the local store existed (a syncToken but no
+    synced_from) are queued for the first sync that builds their copy, and served by Google until then."""
+    if u.sync_token and u.synced_from is None and not u.opted_out:
+        onboarding.submit(u.user_id)
+    return event_store.can_serve(u, time_min)
+
+def _page_source(u, request, calendar_id):
+    """("local" | "google", token): page tokens remember which source issued them, so a
+    listing that started on Google keeps paging there even if the user finishes syncing.
+    Raises ValueError on a token _page_token didn't make."""
+    if request.page_token:
+        source, _, token = request.page_token.partition(":")
+        if source not in ("local", "google") or not token:
+            raise ValueError("bad page_token")
+        if source == "local":
+            event_store.decode_cursor(token)  # a malformed cursor fails here, not inside the query
+        return source, token
+    local = calendar_id == u.calendar_id and _can_serve(u, request.time_min)
+    return ("local" if local else "google"), None
 
-engine = create_engine("sqlite:///calendars.db")
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+def _page_token(source, token):
+    return "%s:%s" % (source, token) if token else ""
+
+def _list_params(request, calendar_id):
+    params = {"calendarId": calendar_id, "timeMin": request.time_min, "timeMax": request.time_max,
+              "singleEvents": True, "orderBy": "startTime"}
+    fields = event_mapping.mask_fields(request.read_mask)
+    if fields:
+        # partial response: Google only sends (and we only parse) what the caller selected
+        params["fields"] = event_mapping.google_fields(fields)
+    return params
+
+def _read_page_source(u, request, calendar_id, context):
+    try:
+        return _page_source(u, request, calendar_id)
+    except ValueError:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, "bad page_token")
+
+def _page_size(request, default=0):
+    # Google rejects maxResults above its cap, so larger requests are clamped rather than refused
+    if request.page_size < 0:
+        raise ValueError("page_size must not be negative")
+    return min(request.page_size or default, sync_engine.GOOGLE_MAX_PAGE_SIZE)
+
+def _read_page_size(request, context, default=0):
+    try:
+        return _page_size(request, default)
+    except ValueError as e:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+def _read_fields(request, context):
+    """(fields, columns) for the request's read_mask; both None when it is unset."""
+    try:
+        fields = event_mapping.mask_fields(request.read_mask)
+    except ValueError as e:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+    return fields, (event_mapping.row_columns(fields) if fields else None)
+
+def _freebusy_body(u, time_min, time_max):
+    # one calendar per call: every user is queried with their own credentials
+    return {"timeMin": time_min, "timeMax": time_max, "items": [{"id": u.calendar_id}]}
+
+def _google_busy(resp, calendar_id):
+    cal = resp.get("calendars", {}).get(calendar_id, {})
+    if cal.get("errors"):
+        raise ValueError("freebusy: %s" % cal["errors"][0].get("reason", "error"))
+    return event_store.merge_intervals((event_store.parse_time(b["start"]), event_store.parse_time(b["end"]))
+                                       for b in cal.get("busy", []))
+
+def _user_busy(user_id, busy):
+    return calendar_pb2.UserBusy(user_id=user_id, busy=[
+        calendar_pb2.BusyInterval(start=event_store.format_time(s), end=event_store.format_time(e)) for s, e in busy])
+
+def _lookup_busy(user_id, time_min, time_max):
+    u = user_cache.get(user_id)
+    if not u or u.opted_out:
+        return calendar_pb2.UserBusy(user_id=user_id, error="user not synced or opted out")
+    try:
+        if _can_serve(u, time_min):
+            with session_scope() as session:
+                busy = event_store.busy_intervals(session, user_id, time_min, time_max)
+        else:
+            resp = get_service(u).freebusy().query(body=_freebusy_body(u, time_min, time_max)).execute()
+            busy = _google_busy(resp, u.calendar_id)
+    except Exception as e:
+        # one failing user shouldn't fail the whole fan-out
+        return calendar_pb2.UserBusy(user_id=user_id, error=str(e))
+    return _user_busy(user_id, busy)
+
+def _stop_channel(u):
+    # uses the user's tokens, so it runs before OptOut clears them; a failure leaves the channel to expire
+    try:
+        channels.stop(u)
+    except Exception:
+        logger.exception("stopping channel for %s failed", u.user_id)
+
+def _opt_out(session, u):
+    # one transaction: the user's tokens, channel, synced events and sync state all go together
+    u.opted_out = True
+    # optionally revoke tokens via token revocation endpoint
+    u.access_token = None
+    u.refresh_token = None
+    # delete webhook channel data so we stop watching
+    u.webhook_channel_id = None
+    u.webhook_resource_id = None
+    u.webhook_expiration = None
+    u.sync_token = None
+    u.sync_page_token = None
+    u.synced_from = None
+    u.is_synced = False
+    event_store.clear_user(session, u.user_id)
+    session.add(u)
+
+def _indexed_user(user_id, time_min, context):
+    # the index mirrors the local event store, so it only answers where that store is complete
+    u = user_cache.get(user_id)
+    if not u or u.opted_out:
+        context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+    if not _can_serve(u, time_min):
+        context.abort(grpc.StatusCode.FAILED_PRECONDITION, "calendar not synced for this range yet")
+    return u
+
+def _parse_times(context, *values):
+    # a malformed bound is the caller's mistake, not an UNKNOWN from deep inside a query
+    try:
+        return [event_store.parse_time(v) for v in values]
+    except ValueError:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, "time bounds must be RFC3339 timestamps")
+
+def _parse_range(start_iso, end_iso, context):
+    start, end = _parse_times(context, start_iso, end_iso)
+    if start is None or end is None or end <= start:
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, "a non-empty [start, end) range is required")
+    return start, end
+
+def _overlaps_resp(hits):
+    resp = calendar_pb2.ListEventsResp()
+    for event_id, start, end, event_type in hits:
+        resp.events.add(id=event_id, start=event_store.format_time(start), end=event_store.format_time(end),
+                        event_type=event_type or "", is_out_of_office=event_type == event_mapping.OUT_OF_OFFICE)
+    return resp
+
+def _free_slot(slot):
+    if slot is None:
+        return calendar_pb2.FreeSlot(found=False)
+    return calendar_pb2.FreeSlot(found=True, start=event_store.format_time(slot[0]), end=event_store.format_time(slot[1]))
+
+class _BatchItemContext:
+    # an abort inside one BatchListEvents request becomes that request's error, not the RPC's status
+    def abort(self, code, details):
+        raise ValueError(details)
 
 class CalendarSyncServicer(calendar_pb2_grpc.CalendarSyncServicer):
     def GetOAuthUrl(self, request, context):
@@ -26,168 +249,354 @@ class CalendarSyncServicer(calendar_pb2_grpc.CalendarSyncServicer):
 
     def StoreTokens(self, request, context):
         # request contains access_token, refresh_token, expiry_epoch, user_id
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
-        expiry = datetime.datetime.utcfromtimestamp(request.expiry_epoch)
-        if not u:
-            u = UserCalendar(user_id=request.user_id)
-        u.access_token = request.access_token
-        u.refresh_token = request.refresh_token
-        u.token_expiry = expiry
-        u.opted_out = False
-        session.add(u)
-        session.commit()
-        session.close()
+        with session_scope() as session:
+            u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
+            expiry = datetime.datetime.utcfromtimestamp(request.expiry_epoch)
+            if not u:
+                u = UserCalendar(user_id=request.user_id)
+            u.access_token = request.access_token
+            u.refresh_token = request.refresh_token
+            u.token_expiry = expiry
+            u.opted_out = False
+            session.add(u)
+            session.commit()
+            user_cache.put(u)
+        service_cache.invalidate(request.user_id)
+        # a user without a channel gets one on the channel manager's next pass
+        channels.schedule(request.user_id)
         return Empty()
 
     def OptOut(self, request, context):
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
-        if u:
-            u.opted_out = True
-            # optionally revoke tokens via token revocation endpoint
-            u.access_token = None
-            u.refresh_token = None
-            # delete webhook channel data so we stop watching
-            u.webhook_channel_id = None
-            u.webhook_resource_id = None
-            session.add(u)
-            session.commit()
-        session.close()
+        with session_scope() as session:
+            u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
+            if u:
+                _stop_channel(u)
+                _opt_out(session, u)
+                session.commit()  # the "clear" drops the user's interval index
+                user_cache.put(u)
+        service_cache.invalidate(request.user_id)
         return Empty()
 
     def CreateEvent(self, request, context):
-        session = Session()
-        # auth
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
-        if not u or u.opted_out:
-            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
-
-        svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET)
-
-        # new event object
-        event_body = {
-            "user_id": request.user_id,
-            "summary": request.title,
-            "description": request.description,
-            "start": {"dateTime": request.start_iso},
-            "end": {"dateTime": request.end_iso},
-            "extendedProperties": {"private": {"event_type": request.event_type}} # extendedProperties.private.event_type is used to persist your internal event type into the Google event so you can read it back later. Google’s event schema supports extendedProperties.
-        }
-        created = svc.events().insert(calendarId=request.calendar_id or u.calendar_id, body=event_body).execute()
-        # return mapping
-        ev = calendar_pb2.Event(
-            id=created["id"],
-            title=created.get("summary", ""),
-            description=created.get("description",""),
-            start=created["start"].get("dateTime",""),
-            end=created["end"].get("dateTime",""),
-            event_type=created.get("extendedProperties",{}).get("private",{}).get("event_type","")
-        )
-        session.close()
-        return ev
+        with session_scope() as session:
+            # auth
+            u = user_cache.get(request.user_id)
+            if not u or u.opted_out:
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+
+            svc = get_service(u)
+
+            # new event object
+            event_body = _create_body(request)
+            created = svc.events().insert(calendarId=request.calendar_id or u.calendar_id, body=event_body).execute()
+            # return mapping
+            ev = event_mapping.to_event(created)
+            if (request.calendar_id or u.calendar_id) == u.calendar_id:
+                event_store.apply_changes(session, u.user_id, u.calendar_id, [created], write_through=True)
+                session.commit()
+            return ev
 
     def UpdateEvent(self, request, context):
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
-        if not u or u.opted_out:
-            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
-        svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET)
-        # fetch event
-        ev = svc.events().get(calendarId=request.calendar_id or u.calendar_id, eventId=request.event_id).execute()
-        ev["summary"] = request.title
-        ev["description"] = request.description
-        ev["start"] = {"dateTime": request.start_iso}
-        ev["end"] = {"dateTime": request.end_iso}
-        if "extendedProperties" not in ev:
-            ev["extendedProperties"] = {"private": {}}
-        ev["extendedProperties"]["private"]["event_type"] = request.event_type
-        updated = svc.events().update(calendarId=request.calendar_id or u.calendar_id, eventId=request.event_id, body=ev).execute()
-        resp = calendar_pb2.Event(
-            id=updated["id"],
-            title=updated.get("summary",""),
-            description=updated.get("description",""),
-            start=updated["start"].get("dateTime",""),
-            end=updated["end"].get("dateTime",""),
-            event_type=updated.get("extendedProperties",{}).get("private",{}).get("event_type","")
-        )
-        session.close()
-        return resp
+        with session_scope() as session:
+            u = user_cache.get(request.user_id)
+            if not u or u.opted_out:
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+            svc = get_service(u)
+            calendar_id = request.calendar_id or u.calendar_id
+            # PATCH only the changed fields instead of get + full-body update (one round trip, small payload)
+            req = svc.events().patch(calendarId=calendar_id, eventId=request.event_id, body=_patch_body(request))
+            etag = request.etag
+            if not etag and calendar_id == u.calendar_id:
+                etag = event_store.get_etag(session, u.user_id, request.event_id)
+            if etag:
+                # optimistic concurrency: Google answers 412 if the event changed since this ETag
+                req.headers["If-Match"] = etag
+            try:
+                updated = req.execute()
+            except HttpError as e:
+                if e.status_code == 412:
+                    context.abort(grpc.StatusCode.ABORTED, "conflict: event %s was modified since etag %s" % (request.event_id, etag))
+                raise
+            resp = event_mapping.to_event(updated)
+            if calendar_id == u.calendar_id:
+                event_store.apply_changes(session, u.user_id, u.calendar_id, [updated], write_through=True)
+                session.commit()
+            return resp
 
     def DeleteEvent(self, request, context):
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
-        if not u or u.opted_out:
-            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
-        svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET)
-        svc.events().delete(calendarId=request.calendar_id or u.calendar_id, eventId=request.event_id).execute()
-        session.close()
-        return Empty()
+        with session_scope() as session:
+            u = user_cache.get(request.user_id)
+            if not u or u.opted_out:
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+            svc = get_service(u)
+            svc.events().delete(calendarId=request.calendar_id or u.calendar_id, eventId=request.event_id).execute()
+            if (request.calendar_id or u.calendar_id) == u.calendar_id:
+                event_store.delete_event(session, u.user_id, request.event_id)
+                session.commit()
+            return Empty()
+
+    def BatchMutateEvents(self, request, context):
+        with session_scope() as session:
+            u = user_cache.get(request.user_id)
+            if not u or u.opted_out:
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, "user not synced or opted out")
+            svc = get_service(u)
+            default_calendar = request.calendar_id or u.calendar_id
+            results = [None] * len(request.ops)
+            calendars = [None] * len(request.ops)
+            changed, deleted = [], []
+
+            def on_response(request_id, response, exception):
+                i = int(request_id)
+                if exception is not None:
+                    status = exception.status_code if isinstance(exception, HttpError) else 0
+                    results[i] = calendar_pb2.MutationResult(index=i, ok=False, http_status=status or 0, error=str(exception))
+                elif request.ops[i].WhichOneof("op") == "delete":
+                    if calendars[i] == u.calendar_id:
+                        deleted.append(request.ops[i].delete.event_id)
+                    results[i] = calendar_pb2.MutationResult(index=i, ok=True, http_status=204)
+                else:
+                    if calendars[i] == u.calendar_id:
+                        changed.append(response)
+                    results[i] = calendar_pb2.MutationResult(index=i, ok=True, http_status=200, event=event_mapping.to_event(response))
+
+            # one Google batch HTTP request (a single round trip) per GOOGLE_BATCH_SIZE ops
+            for start in range(0, len(request.ops), GOOGLE_BATCH_SIZE):
+                batch = svc.new_batch_http_request(callback=on_response)
+                for i in range(start, min(start + GOOGLE_BATCH_SIZE, len(request.ops))):
+                    op = request.ops[i]
+                    kind = op.WhichOneof("op")
+                    if kind is None:
+                        results[i] = calendar_pb2.MutationResult(index=i, ok=False, error="empty op")
+                        continue
+                    mutation = getattr(op, kind)
+                    calendars[i] = mutation.calendar_id or default_calendar
+                    if kind == "create":
+                        req = svc.events().insert(calendarId=calendars[i], body=_create_body(mutation))
+                    elif kind == "update":
+                        # patch, not get + update: the batch can't chain a read before the write
+                        req = svc.events().patch(calendarId=calendars[i], eventId=mutation.event_id, body=_patch_body(mutation))
+                    else:
+                        req = svc.events().delete(calendarId=calendars[i], eventId=mutation.event_id)
+                    batch.add(req, request_id=str(i))
+                batch.execute()
+
+            event_store.apply_changes(session, u.user_id, u.calendar_id, changed, write_through=True)
+            for event_id in deleted:
+                event_store.delete_event(session, u.user_id, event_id)
+            session.commit()
+            return calendar_pb2.BatchMutateEventsResp(results=results)
 
     def ListEvents(self, request, context):
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
+        u = user_cache.get(request.user_id)
         if not u or u.opted_out:
             return calendar_pb2.ListEventsResp()
-        svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET)
-        events = []
-        resp = svc.events().list(calendarId=request.calendar_id or u.calendar_id,
-                                 timeMin=request.time_min,
-                                 timeMax=request.time_max,
-                                 singleEvents=True,
-                                 orderBy="startTime").execute()
-        for it in resp.get("items", []):
-            events.append(calendar_pb2.Event(
-                id=it.get("id",""),
-                title=it.get("summary",""),
-                description=it.get("description",""),
-                start=it.get("start",{}).get("dateTime",""),
-                end=it.get("end",{}).get("dateTime",""),
-                event_type=it.get("extendedProperties",{}).get("private",{}).get("event_type","")
-            ))
-        session.close()
-        return calendar_pb2.ListEventsResp(events=events)
+        calendar_id = request.calendar_id or u.calendar_id
+        page_size = _read_page_size(request, context)
+        _parse_times(context, request.time_min, request.time_max)
+        fields, columns = _read_fields(request, context)
+        source, token = _read_page_source(u, request, calendar_id, context)
+        if source == "local":
+            # warm user with a live syncToken: answer from the local index, no Google call
+            with session_scope() as session:
+                resp = calendar_pb2.ListEventsResp()
+                if not page_size:
+                    event_mapping.add_rows(resp.events, event_store.query_range(
+                        session, u.user_id, request.time_min, request.time_max, columns), fields)
+                    return resp
+                rows, cursor = event_store.query_page(session, u.user_id, request.time_min, request.time_max,
+                                                      page_size, token, columns)
+                event_mapping.add_rows(resp.events, rows, fields)
+                resp.next_page_token = _page_token("local", cursor)
+                return resp
+        # cold user (never synced, or syncToken expired): fall back to Google
+        svc = get_service(u)
+        params = _list_params(request, calendar_id)
+        if page_size:
+            params["maxResults"] = page_size
+            if token:
+                params["pageToken"] = token
+            page = svc.events().list(**params).execute()
+            resp = calendar_pb2.ListEventsResp(next_page_token=_page_token("google", page.get("nextPageToken")))
+            event_mapping.add_events(resp.events, page.get("items", []))
+            return resp
+        # no page_size: the whole range, following nextPageToken rather than stopping at Google's first page
+        resp = calendar_pb2.ListEventsResp()
+        for page in sync_engine.iter_pages(svc, params):
+            event_mapping.add_events(resp.events, page.get("items", []))
+        return resp
+
+    def BatchListEvents(self, request, context):
+        def one(req):
+            try:
+                return calendar_pb2.ListEventsResult(resp=self.ListEvents(req, _BatchItemContext()))
+            except Exception as e:
+                # one failing user shouldn't fail the whole batch
+                return calendar_pb2.ListEventsResult(error=str(e))
+        results = batch_list_pool.map(metrics.in_current_rpc(one), request.requests)
+        return calendar_pb2.BatchListEventsResp(results=list(results))
+
+    def StreamEvents(self, request, context):
+        # one page in memory at a time; the DB session is released between pages
+        u = user_cache.get(request.user_id)
+        if not u or u.opted_out:
+            return
+        calendar_id = request.calendar_id or u.calendar_id
+        page_size = _read_page_size(request, context, STREAM_PAGE_SIZE)
+        _parse_times(context, request.time_min, request.time_max)
+        fields, columns = _read_fields(request, context)
+        source, token = _read_page_source(u, request, calendar_id, context)
+        if source == "local":
+            while True:
+                with session_scope() as session:
+                    rows, token = event_store.query_page(session, u.user_id, request.time_min, request.time_max,
+                                                         page_size, token, columns)
+                    events = [event_mapping.row_to_event(r, fields) for r in rows]
+                yield from events
+                if not token:
+                    return
+        svc = get_service(u)
+        params = dict(_list_params(request, calendar_id), maxResults=page_size)
+        for page in sync_engine.iter_pages(svc, params, token):
+            for it in page.get("items", []):
+                yield event_mapping.to_event(it)
+
+    def QueryFreeBusy(self, request, context):
+        if not request.time_min or not request.time_max:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "time_min and time_max are required")
+        _parse_times(context, request.time_min, request.time_max)
+        # synced users come from the local index, the rest from Google's freebusy endpoint
+        users = freebusy_pool.map(metrics.in_current_rpc(lambda user_id: _lookup_busy(user_id, request.time_min, request.time_max)),
+                                  request.user_ids)
+        return calendar_pb2.FreeBusyResp(users=list(users))
+
+    def FindOverlaps(self, request, context):
+        start, end = _parse_range(request.start_iso, request.end_iso, context)
+        u = _indexed_user(request.user_id, request.start_iso, context)
+        with session_scope() as session:
+            index = interval_index.registry.get(session, u.user_id)
+        return _overlaps_resp(index.overlaps(start, end))
+
+    def FindFreeSlot(self, request, context):
+        start, end = _parse_range(request.time_min, request.time_max, context)
+        if request.duration_minutes <= 0:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "duration_minutes must be positive")
+        u = _indexed_user(request.user_id, request.time_min, context)
+        with session_scope() as session:
+            index = interval_index.registry.get(session, u.user_id)
+        return _free_slot(index.first_free_slot(start, end, datetime.timedelta(minutes=request.duration_minutes)))
 
     def HandlePushNotification(self, request, context):
         # Called from webhook receiver; pull changes using syncToken if available
-        session = Session()
-        u = session.query(UserCalendar).filter_by(user_id=request.user_id).first()
+        push_sync(request.user_id)
+        return Empty()
+
+    def SubscribeChanges(self, request, context):
+        # holds a worker thread for as long as the client stays subscribed, so only CHANGE_STREAMS_MAX at once
+        if not change_stream_slots.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                          "too many change streams on the thread-pool server (CALENDAR_SERVER_MODE=aio has no limit)")
+        try:
+            sub = change_bus.bus.subscribe(change_bus.StreamSubscriber(request.user_ids))
+            context.add_callback(lambda: (change_bus.bus.unsubscribe(sub), sub.close()))
+            # headers go out once the subscriber is registered: every change from here on is delivered
+            context.send_initial_metadata(())
+            try:
+                for batch in sub:
+                    yield change_bus.to_proto(batch)
+            finally:
+                change_bus.bus.unsubscribe(sub)
+        finally:
+            change_stream_slots.release()
+
+class _UserLocks:
+    """One lock per user, dropped again once nobody holds or waits for it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # user_id -> [lock, holders and waiters]
+
+    @contextlib.contextmanager
+    def hold(self, user_id):
+        with self._lock:
+            entry = self._locks.setdefault(user_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[user_id]
+
+# push_sync runs from HandlePushNotification and from the catch_up scheduler; two syncs of one user
+# would list the same changes from the same syncToken, insert them twice and publish them twice
+_push_locks = _UserLocks()
+
+def push_sync(user_id):
+    """Incremental sync of one user, publishing every page on the change bus.
+    Serialized per user: a second call waits, then picks up from the syncToken the first one stored."""
+    with _push_locks.hold(user_id), session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
         if not u or u.opted_out:
-            return Empty()
-        svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, CLIENT_ID, CLIENT_SECRET)
-        params = {"calendarId": u.calendar_id, "singleEvents": True, "orderBy":"startTime", "showDeleted":True}
-        if u.sync_token:
-            params["syncToken"] = u.sync_token
-        else:
-            # first sync: set timeMin to now - 30 days (or choose appropriate window)
-            params["timeMin"] = (datetime.datetime.utcnow() - datetime.timedelta(days=30)).isoformat() + "Z"
+            return
+        if not u.sync_token or u.synced_from is None:
+            # no incremental sync possible yet (or no local copy to apply it to): queue the first sync
+            # instead of running it in this handler
+            onboarding.submit(u.user_id)
+            return
+        svc = get_service(u)
+        # walk every page (resuming an interrupted sync if one was checkpointed).
+        # Each page is published before its checkpoint commits, so a crash in between republishes it.
         try:
-            results = svc.events().list(calendarId=u.calendar_id, **params).execute()
-        except HttpError as e:
-            # if syncToken expired, we'll need a full sync (remove token)
-            if e.status_code == 410:
-                u.sync_token = None
-                session.add(u)
-                session.commit()
-                session.close()
-                return Empty()
-            raise
-        # process changes
-        for it in results.get("items", []):
-            # example: log or push into your app event store
-            print("change:", it.get("id"), it.get("status"))
-        # update sync token
-        if "nextSyncToken" in results:
-            u.sync_token = results["nextSyncToken"]
-            session.add(u)
-            session.commit()
-        session.close()
-        return Empty()
+            for changes in sync_engine.sync_pages(session, u, svc, on_commit=user_cache.put, restart=False):
+                if changes:
+                    change_bus.bus.publish(change_bus.make_batch(u, changes))
+        except sync_engine.FullSyncRequired:
+            # 410: the syncToken expired; the full resync is a first sync again, so it goes to onboarding
+            onboarding.submit(u.user_id)
+
+# catch-up syncs for channels that had already expired when renewed (notifications may have been
+# dropped): coalesced per user and run on the scheduler's bounded pool, not on the renewal threads
+catch_up = sync_scheduler.SyncScheduler(push_sync, debounce=0)
+
+# keeps every active user's events().watch channel alive
+channels = channel_manager.ChannelManager(get_service, on_missed=catch_up.notify)
+
+# component stats, exported next to the RPC histograms on /metrics
+for _name, _stats in (("rate_limit", rate_limit.limiter.stats), ("token_refresh", token_refresher.metrics.stats),
+                      ("onboarding", onboarding.stats), ("channels", channels.stats), ("catch_up", catch_up.stats),
+                      ("change_bus", change_bus.bus.stats), ("user_cache", user_cache.stats),
+                      ("service_cache", service_cache.stats)):
+    metrics.register_stats(_name, _stats)
+
+# accept the keepalive pings of long-lived client channels (graphql_api's pool pings every
+# GRPC_KEEPALIVE_MS); with the defaults the server answers frequent pings with GOAWAY
+SERVER_OPTIONS = [
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", 10000),
+    ("grpc.http2.max_ping_strikes", 0),
+]
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def serve(mode=None, address='[::]:50051', max_workers=SERVER_MAX_WORKERS):
+    # "thread" (default): blocking handlers on a thread pool; "aio": grpc.aio server from aio_server.py
+    mode = mode or os.environ.get("CALENDAR_SERVER_MODE", "thread")
+    if os.environ.get("TOKEN_REFRESHER_ENABLED", "1") == "1":
+        # refresh tokens ahead of expiry; the user's cached service still holds the old credentials
+        token_refresher.TokenRefresher(CLIENT_ID, CLIENT_SECRET, on_refreshed=service_cache.invalidate).start()
+    if os.environ.get("CHANNEL_MANAGER_ENABLED", "1") == "1":
+        channels.start()
+    if metrics.METRICS_PORT:
+        metrics.start_http_server(metrics.METRICS_PORT)
+    if mode == "aio":
+        import asyncio, aio_server
+        asyncio.run(aio_server.serve(address))
+        return
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), interceptors=[metrics.MetricsInterceptor()],
+                         options=SERVER_OPTIONS)
     calendar_pb2_grpc.add_CalendarSyncServicer_to_server(CalendarSyncServicer(), server)
-    server.add_insecure_port('[::]:50051')
+    server.add_insecure_port(address)
     server.start()
     server.wait_for_termination()
 
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import threading
+
+class ServiceCache:
+    """
+    Bounded, thread-safe LRU cache of built Google Calendar service objects keyed by user_id.
+    Building Credentials + the discovery client is far more expensive than the API call itself,
+    so RPCs reuse the service until StoreTokens / OptOut invalidates the user's entry.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._services = OrderedDict()
+        self._generations = {}  # bumped on invalidate so in-flight builds with stale tokens are dropped
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, user_id, builder):
+        with self._lock:
+            svc = self._services.get(user_id)
+            if svc is not None:
+                self._services.move_to_end(user_id)
+                self.hits += 1
+                return svc
+            self.misses += 1
+            generation = self._generations.get(user_id, 0)
+        # build outside the lock so one slow build doesn't stall every other RPC
+        svc = builder()
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return svc
+            # another thread may have raced us; keep the first one so everyone shares it
+            existing = self._services.get(user_id)
+            if existing is not None:
+                self._services.move_to_end(user_id)
+                return existing
+            self._services[user_id] = svc
+            while len(self._services) > self.max_size:
+                self._services.popitem(last=False)
+                self.evictions += 1
+        return svc
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._services.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._services),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
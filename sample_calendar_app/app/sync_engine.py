@@ -0,0 +1,114 @@
+'''
+Paginated, resumable Google Calendar sync.
+
+events().list returns at most `maxResults` items per call and only hands out
+nextSyncToken on the last page, so a single .execute() silently drops changes on
+large calendars. sync_pages walks every page, applies it to the local event store
+and checkpoints the page token after each one; the new syncToken is only committed
+once the final page has been processed.
+
+When Google answers 410 (syncToken expired) sync_pages either restarts as a full sync
+in place or, with restart=False, drops the user's tokens and raises FullSyncRequired so
+the caller can hand the full sync to the onboarding pool.
+'''
+import datetime
+
+from googleapiclient.errors import HttpError
+
+import event_store
+
+SYNC_PAGE_SIZE = 1000        # maxResults per events().list call
+GOOGLE_MAX_PAGE_SIZE = 2500  # Google's cap on maxResults
+FULL_SYNC_WINDOW_DAYS = 30   # first sync pulls events from now - 30 days
+
+class FullSyncRequired(Exception):
+    """The user's syncToken expired; their tokens are cleared and a full sync has to run."""
+
+def iter_pages(svc, params, page_token=None):
+    """Yield raw events().list pages, following nextPageToken until the last page."""
+    while True:
+        page_params = dict(params)
+        if page_token:
+            page_params["pageToken"] = page_token
+        page = svc.events().list(**page_params).execute()
+        yield page
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+def _list_params(u, page_size):
+    params = {"calendarId": u.calendar_id, "singleEvents": True, "showDeleted": True, "maxResults": page_size}
+    if u.sync_token:
+        params["syncToken"] = u.sync_token
+    else:
+        params["timeMin"] = u.synced_from.isoformat() + "Z"
+    return params
+
+def _start_full_sync(session, u, on_commit=None):
+    # full sync rebuilds the local copy from scratch; is_synced stays False until the last page lands
+    u.sync_token = None
+    u.sync_page_token = None
+    u.is_synced = False
+    u.synced_from = datetime.datetime.utcnow() - datetime.timedelta(days=FULL_SYNC_WINDOW_DAYS)
+    event_store.clear_user(session, u.user_id)
+    session.add(u)
+    session.commit()
+    if on_commit:
+        on_commit(u)
+
+def _expire_sync(session, u, on_commit=None):
+    # without a token the user is served from Google again until the next full sync lands
+    u.sync_token = None
+    u.sync_page_token = None
+    u.is_synced = False
+    session.add(u)
+    session.commit()
+    if on_commit:
+        on_commit(u)
+
+def sync_pages(session, u, svc, page_size=SYNC_PAGE_SIZE, on_commit=None, restart=True):
+    """
+    Generator that syncs user `u` page by page and yields each page's changes as
+    event_store.apply_changes returns them: (kind, item) pairs.
+
+    Each page is applied to the local store before it is yielded; its checkpoint
+    (the next page token) is committed together with it only when the consumer asks
+    for the next page, so an interrupted sync resumes at the first unconsumed page.
+    Memory stays bounded by one page regardless of calendar size.
+    on_commit(u) runs after every commit of `u` (e.g. to write through to the user cache).
+    On a 410, restart=False raises FullSyncRequired instead of running the full sync here.
+    """
+    if u.synced_from is None or (not u.sync_token and not u.sync_page_token):
+        # never synced, or synced before the local store existed (a token but no synced window)
+        _start_full_sync(session, u, on_commit)
+    restarted = False
+    while True:
+        try:
+            for page in iter_pages(svc, _list_params(u, page_size), u.sync_page_token):
+                yield event_store.apply_changes(session, u.user_id, u.calendar_id, page.get("items", []))
+                if page.get("nextPageToken"):
+                    u.sync_page_token = page["nextPageToken"]
+                else:
+                    u.sync_page_token = None
+                    u.sync_token = page.get("nextSyncToken")
+                    u.is_synced = True
+                session.add(u)
+                session.commit()
+                if on_commit:
+                    on_commit(u)
+            return
+        except HttpError as e:
+            # syncToken (or a checkpointed pageToken) expired: Google wants a fresh full sync
+            if e.status_code != 410 or restarted:
+                session.rollback()
+                raise
+            session.rollback()
+            if not restart:
+                _expire_sync(session, u, on_commit)
+                raise FullSyncRequired(u.user_id) from e
+            restarted = True
+            _start_full_sync(session, u, on_commit)
+
+def sync_user(session, u, svc, page_size=SYNC_PAGE_SIZE, on_commit=None):
+    """Run sync_pages to completion; returns the number of changed items processed."""
+    return sum(len(changes) for changes in sync_pages(session, u, svc, page_size, on_commit))
@@ -0,0 +1,146 @@
+'''
+Background OAuth token refresher.
+
+Without it google-auth refreshes an expired access token lazily, inside a user's RPC
+(an extra round trip on the critical path) and the new token was never written back,
+so every following request refreshed again. The refresher scans the token_expiry
+index for tokens expiring soon, refreshes them in batches on a bounded pool and
+persists token + expiry; refreshes that still happen on the request path are
+persisted too (persist_token) and counted separately.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import os
+import threading
+
+from db import session_scope
+from google_client import refresh_tokens
+from models import UserCalendar
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+REFRESH_AHEAD_SECONDS = int(os.environ.get("TOKEN_REFRESH_AHEAD_SECONDS", "600"))
+REFRESH_BATCH_SIZE = int(os.environ.get("TOKEN_REFRESH_BATCH_SIZE", "100"))
+REFRESH_CONCURRENCY = int(os.environ.get("TOKEN_REFRESH_CONCURRENCY", "8"))
+REFRESH_INTERVAL_SECONDS = float(os.environ.get("TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+
+class RefreshMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.background = 0   # refreshed ahead of expiry by the refresher
+        self.on_request = 0   # refreshed inside a user RPC (what the refresher is meant to avoid)
+        self.failed = 0
+
+    def record(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {"background": self.background, "on_request": self.on_request, "failed": self.failed}
+
+metrics = RefreshMetrics()
+
+def write_back_token(session, user_id, refresh_token, access_token, expiry):
+    """
+    Write a refreshed token back only onto the tokens the refresh started from, so an OptOut
+    (or a new StoreTokens) that ran meanwhile wins. Returns the number of rows updated. Caller commits.
+    """
+    return (session.query(UserCalendar)
+            .filter(UserCalendar.user_id == user_id, UserCalendar.opted_out.isnot(True),
+                    UserCalendar.refresh_token == refresh_token)
+            .update({"access_token": access_token, "token_expiry": expiry}, synchronize_session=False))
+
+def persist_token(user_id, refresh_token, access_token, expiry):
+    """Store a token refreshed with `refresh_token`; False if the user's tokens changed meanwhile."""
+    with session_scope() as session:
+        if not write_back_token(session, user_id, refresh_token, access_token, expiry):
+            return False
+        session.commit()
+        user_cache.put(session.query(UserCalendar).filter_by(user_id=user_id).first())
+        return True
+
+def on_request_refresh(user_id):
+    """on_refresh hook for google_client.build_service_from_tokens."""
+    def hook(creds):
+        metrics.record("on_request")
+        persist_token(user_id, creds.refresh_token, creds.token, creds.expiry)
+    return hook
+
+class TokenRefresher:
+    def __init__(self, client_id, client_secret, on_refreshed=None, refresh_fn=refresh_tokens,
+                 ahead_seconds=REFRESH_AHEAD_SECONDS, batch_size=REFRESH_BATCH_SIZE,
+                 concurrency=REFRESH_CONCURRENCY, interval=REFRESH_INTERVAL_SECONDS):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.on_refreshed = on_refreshed  # e.g. drop the user's cached Google service (it holds the old creds)
+        self.refresh_fn = refresh_fn
+        self.ahead = datetime.timedelta(seconds=ahead_seconds)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="token-refresh")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _due(self, session, after_id):
+        # range scan on the token_expiry index; keyset on id so a failing token is tried once per pass
+        deadline = datetime.datetime.utcnow() + self.ahead
+        q = (session.query(UserCalendar.id, UserCalendar.user_id, UserCalendar.refresh_token)
+             .filter(UserCalendar.token_expiry <= deadline,
+                     UserCalendar.refresh_token.isnot(None),
+                     UserCalendar.opted_out.isnot(True),
+                     UserCalendar.id > after_id)
+             .order_by(UserCalendar.id)
+             .limit(self.batch_size))
+        return q.all()
+
+    def _refresh(self, row):
+        try:
+            return row, self.refresh_fn(row.refresh_token, self.client_id, self.client_secret)
+        except Exception:
+            logger.exception("token refresh for %s failed", row.user_id)
+            metrics.record("failed")
+            return row, None
+
+    def run_once(self):
+        """Refresh every token expiring within the look-ahead window; returns how many were refreshed."""
+        refreshed, after_id = 0, 0
+        while True:
+            with session_scope() as session:
+                batch = self._due(session, after_id)
+            if not batch:
+                return refreshed
+            after_id = batch[-1].id
+            results = list(self._pool.map(self._refresh, batch))
+            with session_scope() as session:
+                written = [row.user_id for row, result in results
+                           if result and write_back_token(session, row.user_id, row.refresh_token, *result)]
+                session.commit()
+                for u in session.query(UserCalendar).filter(UserCalendar.user_id.in_(written)):
+                    user_cache.put(u)
+            for user_id in written:
+                refreshed += 1
+                metrics.record("background")
+                if self.on_refreshed:
+                    self.on_refreshed(user_id)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("token refresh pass failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="token-refresher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._pool.shutdown()
@@ -0,0 +1,137 @@
+from collections import OrderedDict, namedtuple
+import os
+import threading
+import time
+
+from db import session_scope
+from models import UserCalendar
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+# bounds staleness against writers in other processes (e.g. the webhook receiver), which don't write through
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+
+# read-only copy of a UserCalendar row; safe to share between threads and to use after the session closed
+CachedUser = namedtuple("CachedUser", [
+    "user_id", "access_token", "refresh_token", "token_expiry", "calendar_id", "sync_token", "is_synced",
+    "synced_from", "webhook_channel_id", "webhook_resource_id", "opted_out",
+])
+
+def snapshot(u):
+    return CachedUser(*(getattr(u, f) for f in CachedUser._fields))
+
+class UserCalendarCache:
+    """
+    Read-through TTL + LRU cache of UserCalendar rows, indexed by user_id and webhook_channel_id.
+    Writers (StoreTokens, OptOut, sync-token updates) call put() after committing so readers
+    never see the old row; misses load from the DB.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._by_user = OrderedDict()  # user_id -> (expires_at, CachedUser)
+        self._by_channel = {}          # webhook_channel_id -> user_id
+        self._seq = 0                  # bumped on every write
+        self._written_at = {}          # user_id -> _seq of its last write, so a slower DB load can't overwrite it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _fresh(self, user_id):
+        entry = self._by_user.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < self._clock():
+            self._drop(user_id)
+            return None
+        self._by_user.move_to_end(user_id)
+        return user
+
+    def _drop(self, user_id):
+        _, user = self._by_user.pop(user_id, (None, None))
+        if user is not None and user.webhook_channel_id:
+            self._by_channel.pop(user.webhook_channel_id, None)
+
+    def _store(self, user):
+        self._drop(user.user_id)
+        self._by_user[user.user_id] = (self._clock() + self.ttl, user)
+        if user.webhook_channel_id:
+            self._by_channel[user.webhook_channel_id] = user.user_id
+        while len(self._by_user) > self.max_size:
+            oldest = next(iter(self._by_user))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _load(self, **filters):
+        with self._lock:
+            started = self._seq
+        with session_scope() as session:
+            u = session.query(UserCalendar).filter_by(**filters).first()
+            user = snapshot(u) if u else None
+        if user is not None:
+            with self._lock:
+                if self._written_at.get(user.user_id, 0) <= started:
+                    self._store(user)
+        return user
+
+    def _mark_written(self, user_id):
+        self._seq += 1
+        self._written_at[user_id] = self._seq
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._fresh(user_id)
+            if user is not None:
+                self.hits += 1
+                return user
+            self.misses += 1
+        return self._load(user_id=user_id)
+
+    def peek_by_channel(self, channel_id):
+        """Cache-only lookup (never touches the DB), for callers that must not block."""
+        if not channel_id:
+            return None
+        with self._lock:
+            user_id = self._by_channel.get(channel_id)
+            user = self._fresh(user_id) if user_id else None
+            if user is not None and user.webhook_channel_id == channel_id:
+                self.hits += 1
+                return user
+            return None
+
+    def get_by_channel(self, channel_id):
+        user = self.peek_by_channel(channel_id)
+        if user is not None or not channel_id:
+            return user
+        with self._lock:
+            self.misses += 1
+        return self._load(webhook_channel_id=channel_id)
+
+    def put(self, u):
+        """Write-through after a commit; accepts an ORM row or a CachedUser."""
+        user = u if isinstance(u, CachedUser) else snapshot(u)
+        with self._lock:
+            self._mark_written(user.user_id)
+            self._store(user)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._mark_written(user_id)
+            self._drop(user_id)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._by_user),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+user_cache = UserCalendarCache()
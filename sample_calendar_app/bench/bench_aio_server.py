@@ -0,0 +1,78 @@
+'''
+Concurrent ListEvents throughput: thread-pool server vs grpc.aio server.
+
+    python bench/bench_aio_server.py [requests] [concurrency] [google_latency_s]
+
+Each mode runs `python server.py` in a subprocess (CALENDAR_SERVER_MODE=thread|aio)
+against a fake Google endpoint served over HTTP from this process with a fixed
+per-call latency. Users are never synced, so every ListEvents goes to "Google".
+'''
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_google import FakeCalendarBackend, serve_http, HERE
+
+import grpc
+import calendar_pb2, calendar_pb2_grpc
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+USERS = 50
+
+
+def start_server(mode, port, endpoint):
+    app_dir = os.path.join(HERE, "..", "app")
+    env = dict(os.environ, CALENDAR_SERVER_MODE=mode, GOOGLE_API_ENDPOINT=endpoint,
+               PYTHONPATH=os.pathsep.join([app_dir, os.path.join(HERE, "..", "generated")]))
+    proc = subprocess.Popen([sys.executable, "-c", "import server; server.serve(address='127.0.0.1:%d')" % port],
+                            cwd=tempfile.mkdtemp(), env=env)
+    return proc
+
+
+async def run_mode(mode, port, endpoint):
+    proc = start_server(mode, port, endpoint)
+    try:
+        async with grpc.aio.insecure_channel("127.0.0.1:%d" % port) as channel:
+            await asyncio.wait_for(channel.channel_ready(), 30)
+            stub = calendar_pb2_grpc.CalendarSyncStub(channel)
+            for i in range(USERS):
+                await stub.StoreTokens(calendar_pb2.OAuthTokens(user_id="u%d" % i, access_token="at", refresh_token="rt",
+                                                                expiry_epoch=int(time.time()) + 3600))
+            sem = asyncio.Semaphore(CONCURRENCY)
+            latencies = []
+
+            async def one(i):
+                async with sem:
+                    t0 = time.perf_counter()
+                    await stub.ListEvents(calendar_pb2.ListEventsReq(user_id="u%d" % (i % USERS)))
+                    latencies.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(REQUESTS)))
+            elapsed = time.perf_counter() - t0
+        latencies.sort()
+        print("%-6s %7.1f rps  p50 %6.0fms  p99 %6.0fms" % (
+            mode, REQUESTS / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    backend.add_event("primary", {"summary": "hold", "start": {"dateTime": "2030-01-01T10:00:00Z"},
+                                  "end": {"dateTime": "2030-01-01T11:00:00Z"}})
+    httpd, endpoint = serve_http(backend)
+    print("%d ListEvents, concurrency %d, Google latency %.0fms" % (REQUESTS, CONCURRENCY, LATENCY * 1000))
+    asyncio.run(run_mode("thread", 50061, endpoint))
+    asyncio.run(run_mode("aio", 50062, endpoint))
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+'''
+Onboarding throughput of bulk_sync.BulkSyncRunner for different pool sizes.
+
+    python bench/bench_bulk_sync.py [users] [events_per_user] [google_latency_s]
+
+Every run onboards a fresh set of users (300 events each, 100 per list page) against
+fake_google.FakeCalendarBackend with a fixed per-call latency, in a temp SQLite DB,
+and then re-runs the same job to show that finished users are skipped. With SQLite
+(one writer at a time) and the GIL, throughput stops improving at around 8 workers.
+'''
+import datetime
+import os
+import sys
+import tempfile
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import bulk_sync
+import db
+import server
+from models import UserCalendar
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+EVENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+WORKERS = (1, 8, 32)
+
+
+def seed(backend, prefix):
+    now = datetime.datetime.utcnow()
+    with db.session_scope() as session:
+        for i in range(USERS):
+            calendar_id = "%s-cal%d" % (prefix, i)
+            for j in range(EVENTS):
+                t = now + datetime.timedelta(hours=j)
+                backend.add_event(calendar_id, {"summary": "e%d" % j, "start": {"dateTime": t.isoformat() + "Z"},
+                                                "end": {"dateTime": (t + datetime.timedelta(minutes=30)).isoformat() + "Z"}})
+            session.add(UserCalendar(user_id="%s-u%d" % (prefix, i), access_token="at", refresh_token="rt",
+                                     calendar_id=calendar_id, token_expiry=now + datetime.timedelta(hours=1)))
+        session.commit()
+    return ["%s-u%d" % (prefix, i) for i in range(USERS)]
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    print("%d users x %d events, Google latency %.0fms" % (USERS, EVENTS, LATENCY * 1000))
+    for workers in WORKERS:
+        user_ids = seed(backend, "w%d" % workers)
+        runner = bulk_sync.BulkSyncRunner(server.get_service, max_workers=workers, page_size=100)
+        stats = runner.run(user_ids)
+        with db.session_scope() as session:
+            done = session.query(UserCalendar).filter(UserCalendar.user_id.in_(user_ids), UserCalendar.is_synced.is_(True)).count()
+        rerun = bulk_sync.BulkSyncRunner(server.get_service, max_workers=workers).run(user_ids)
+        print("  workers %3d  %7.0f users/min  %5.1fs  synced %d (is_synced %d) failed %d retried %d  rerun skipped %d" % (
+            workers, stats["users_per_minute"], stats["elapsed_seconds"], stats["synced"], done, stats["failed"],
+            stats["retried"], rerun["skipped"]))
+        runner.shutdown()
+
+
+if __name__ == "__main__":
+    main()
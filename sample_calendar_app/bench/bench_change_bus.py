@@ -0,0 +1,147 @@
+'''
+Publishing push-sync changes through change_bus.
+
+    python bench/bench_change_bus.py [users] [changes_per_user]
+
+Every user is first synced, then gets `changes_per_user` new events on the fake Google
+and one HandlePushNotification (pages of 1000, so one batch per page). Rows:
+
+- "no subscribers" is the sync on its own;
+- "file log" / "file log fsync" append every batch to a JSON-lines file;
+- "asyncio queue" hands batches to a consumer coroutine on another thread's loop;
+- "slow consumer" uses a 2-batch queue and a consumer that takes 250ms per batch:
+  syncs wait on it (blocked_seconds) instead of buffering without bound.
+
+The last check fails one delivery: the sync raises, its checkpoint stays put, and the
+retry republishes the page with the same key.
+'''
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httplib2
+from fake_google import DummyContext, FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import calendar_pb2
+import change_bus
+import db
+import server
+from models import UserCalendar
+from user_cache import user_cache
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+CHANGES = int(sys.argv[2]) if len(sys.argv) > 2 else 2500
+
+
+def setup(backend, prefix):
+    user_ids = ["%s-u%d" % (prefix, i) for i in range(USERS)]
+    with db.session_scope() as session:
+        for user_id in user_ids:
+            session.add(UserCalendar(user_id=user_id, access_token="at", refresh_token="rt", calendar_id=user_id,
+                                     token_expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1)))
+        session.commit()
+    server.onboarding.run(user_ids)
+    now = datetime.datetime.utcnow()
+    for user_id in user_ids:
+        for j in range(CHANGES):
+            t = now + datetime.timedelta(hours=j)
+            backend.add_event(user_id, {"summary": "e%d" % j, "start": {"dateTime": t.isoformat() + "Z"},
+                                        "end": {"dateTime": (t + datetime.timedelta(minutes=30)).isoformat() + "Z"}})
+    return user_ids
+
+
+def sync_all(user_ids):
+    servicer, ctx = server.CalendarSyncServicer(), DummyContext()
+    t0 = time.perf_counter()
+    for user_id in user_ids:
+        servicer.HandlePushNotification(calendar_pb2.UserId(user_id=user_id), ctx)
+    return time.perf_counter() - t0
+
+
+def start_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def consume(loop, sub, delay):
+    received = []
+
+    async def run():
+        async for batch in sub:
+            received.append(len(batch.changes))
+            if delay:
+                await asyncio.sleep(delay)
+    return asyncio.run_coroutine_threadsafe(run(), loop), received
+
+
+def row(label, elapsed, received, extra=""):
+    bus = change_bus.bus.stats()
+    print("  %-15s %6.2fs  %7.0f changes/s  delivered %6d  blocked %6.2fs %s" % (
+        label, elapsed, USERS * CHANGES / elapsed, received, bus["blocked_seconds"], extra))
+
+
+def main():
+    backend = FakeCalendarBackend()
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    loop = start_loop()
+    print("%d users x %d changes" % (USERS, CHANGES))
+    for label in ("no subscribers", "file log", "file log fsync", "asyncio queue", "slow consumer"):
+        user_ids = setup(backend, label.replace(" ", "_"))
+        change_bus.bus.__init__()
+        sub, done, received = None, None, []
+        if label.startswith("file log"):
+            sub = change_bus.FileLogSubscriber(label.replace(" ", "_") + ".jsonl", fsync=label.endswith("fsync"))
+        elif label == "asyncio queue":
+            sub = change_bus.AsyncQueueSubscriber(loop)
+            done, received = consume(loop, sub, 0)
+        elif label == "slow consumer":
+            sub = change_bus.AsyncQueueSubscriber(loop, maxsize=2)
+            done, received = consume(loop, sub, 0.25)
+        if sub:
+            change_bus.bus.subscribe(sub)
+        elapsed = sync_all(user_ids)
+        if sub:
+            change_bus.bus.unsubscribe(sub)
+            while done and len(received) < change_bus.bus.stats()["batches"]:
+                time.sleep(0.05)  # let the consumer drain its queue before closing it
+            sub.close()
+        if done:
+            done.result(60)
+        if label.startswith("file log"):
+            with open(sub.path) as f:
+                received = [1] * sum(line.count('"kind"') for line in f)
+        row(label, elapsed, sum(received))
+
+    # at-least-once: the first delivery fails, so the sync fails before its checkpoint moves
+    class FlakyOnce(change_bus.Subscriber):
+        def __init__(self):
+            super().__init__()
+            self.keys = []
+
+        def deliver(self, batch, timeout):
+            self.keys.append(batch.key)
+            if len(self.keys) == 1:
+                raise IOError("consumer down")
+
+    user_id = setup(backend, "flaky")[0]
+    change_bus.bus.__init__()
+    flaky = change_bus.bus.subscribe(FlakyOnce())
+    token_before = user_cache.get(user_id).sync_token
+    try:
+        sync_all([user_id])
+    except IOError:
+        pass
+    assert user_cache.get(user_id).sync_token == token_before
+    sync_all([user_id])
+    print("  failed delivery: keys %s, first page redelivered with the same key: %s" % (
+        len(flaky.keys), flaky.keys[0] == flaky.keys[1]))
+
+
+if __name__ == "__main__":
+    main()
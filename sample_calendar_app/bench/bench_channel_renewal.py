@@ -0,0 +1,83 @@
+'''
+Watch channel coverage with and without channel_manager.ChannelManager.
+
+    python bench/bench_channel_renewal.py [users] [channel_ttl_s] [run_s]
+
+Every user gets one events().watch channel with a short ttl. "no renewal" registers
+them once and lets them run out, which is what used to happen: once a channel has
+expired the user needs a full resync. "manager" runs the channel manager with the
+look-ahead set to a third of the ttl, samples how many users have a live channel on
+the fake Google, and then opts some users out to check that their channels are stopped.
+'''
+import os
+import sys
+import tempfile
+import time
+
+import httplib2
+from fake_google import DummyContext, FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import calendar_pb2
+import channel_manager
+import server
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+TTL = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+RUN = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+
+def live(backend, user_ids):
+    # users whose current channel (per the DB) is still live on the fake Google
+    now_ms = time.time() * 1000
+    alive = 0
+    for user_id in user_ids:
+        u = server.user_cache.get(user_id)
+        channel = backend.channels.get(u.webhook_channel_id) if u and u.webhook_channel_id else None
+        if channel and int(channel["expiration"]) > now_ms:
+            alive += 1
+    return alive
+
+
+def run(label, backend, user_ids, renew):
+    manager = channel_manager.ChannelManager(server.get_service, ttl_seconds=TTL, ahead_seconds=TTL / 3,
+                                             interval=TTL / 3)
+    server.channels = manager
+    if renew:
+        manager.start()  # queues every active user as due, so their first channels are opened right away
+    else:
+        manager.load()
+        manager.run_once()  # register every user's first channel, then leave them alone
+    while manager.stats()["created"] < len(user_ids):
+        time.sleep(0.05)
+    lowest, t0 = len(user_ids), time.monotonic()
+    while time.monotonic() - t0 < RUN:
+        time.sleep(0.2)
+        lowest = min(lowest, live(backend, user_ids))
+    print("%-11s lowest live %4d/%d  at end %4d  %s" % (
+        label, lowest, len(user_ids), live(backend, user_ids), manager.stats()))
+    return manager
+
+
+def main():
+    backend = FakeCalendarBackend(latency=0.01)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    servicer, ctx = server.CalendarSyncServicer(), DummyContext()
+    expiry = int(time.time()) + 3600
+    print("%d users, channel ttl %ds, %.0fs" % (USERS, TTL, RUN))
+    for label, renew in (("no renewal", False), ("manager", True)):
+        user_ids = ["%s-u%d" % (label[:2], i) for i in range(USERS)]
+        for user_id in user_ids:
+            servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="at", refresh_token="rt",
+                                                          expiry_epoch=expiry), ctx)
+        manager = run(label, backend, user_ids, renew)
+        before = len(backend.channels)
+        # opting out stops the user's channel (and takes them out of the next round)
+        for user_id in user_ids:
+            servicer.OptOut(calendar_pb2.UserId(user_id=user_id), ctx)
+        print("%-11s opted out all users: channels on Google %d -> %d" % ("", before, len(backend.channels)))
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
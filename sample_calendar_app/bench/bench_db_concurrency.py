@@ -0,0 +1,82 @@
+'''
+StoreTokens + ListEvents throughput from concurrent gRPC worker threads, comparing a
+default create_engine("sqlite:///...") with the tuned db.make_engine (pool, WAL, synchronous=NORMAL).
+
+    python bench/bench_db_concurrency.py [ops] [threads]
+
+ListEvents users are marked synced so every read is served from the local event store,
+i.e. the numbers are pure DB work. Errors are mostly "database is locked".
+'''
+import datetime
+import os
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+from fake_google import DummyContext
+
+os.chdir(tempfile.mkdtemp())
+from sqlalchemy import create_engine
+
+import calendar_pb2
+import db
+import event_store
+import server
+from models import Base, UserCalendar
+from user_cache import user_cache
+
+OPS = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+USERS = 50
+
+
+def seed(session):
+    now = datetime.datetime.utcnow()
+    for i in range(USERS):
+        u = UserCalendar(user_id="u%d" % i, access_token="at", refresh_token="rt", calendar_id="primary",
+                         token_expiry=now + datetime.timedelta(hours=1), is_synced=True, sync_token="s",
+                         synced_from=now - datetime.timedelta(days=30))
+        session.add(u)
+        event_store.apply_changes(session, u.user_id, "primary", [{
+            "id": "ev%d" % j, "summary": "hold",
+            "start": {"dateTime": (now + datetime.timedelta(hours=j)).isoformat() + "Z"},
+            "end": {"dateTime": (now + datetime.timedelta(hours=j, minutes=30)).isoformat() + "Z"},
+        } for j in range(50)])
+    session.commit()
+
+
+def run(label, engine):
+    Base.metadata.create_all(engine)
+    db.Session.configure(bind=engine)
+    with db.session_scope() as session:
+        seed(session)
+    for i in range(USERS):
+        user_cache.invalidate("u%d" % i)  # rows were seeded behind the cache's back
+    servicer, ctx = server.CalendarSyncServicer(), DummyContext()
+    time_min = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat() + "Z"
+    errors = 0
+
+    def op(i):
+        user_id = "u%d" % (i % USERS)
+        if i % 2:
+            servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="at%d" % i, refresh_token="rt",
+                                                          expiry_epoch=int(time.time()) + 3600), ctx)
+        else:
+            servicer.ListEvents(calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min), ctx)
+
+    t0 = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=THREADS) as pool:
+        for f in [pool.submit(op, i) for i in range(OPS)]:
+            try:
+                f.result()
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - t0
+    print("%-8s %7.0f ops/s  (%d ops, %d threads, %d errors)" % (label, OPS / elapsed, OPS, THREADS, errors))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    run("default", create_engine("sqlite:///default.db"))
+    run("tuned", db.make_engine("sqlite:///tuned.db"))
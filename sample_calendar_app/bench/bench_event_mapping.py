@@ -0,0 +1,65 @@
+'''
+Google JSON -> ListEventsResp for 50k events: the old per-RPC converter vs event_mapping.
+
+    python bench/bench_event_mapping.py [events]
+
+"before" is the dict-walking Event(...) constructor that CreateEvent / ListEvents each
+used to carry, collected into a list and passed to ListEventsResp(events=...), which
+copies every message. "to_event list" uses the new converter the same way; "add_events"
+fills ListEventsResp.events in place. Times are the best of 5 runs.
+'''
+import sys
+import timeit
+
+import fake_google  # sets up sys.path
+import calendar_pb2
+import event_mapping
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+
+def make_items():
+    items = []
+    for i in range(EVENTS):
+        item = {"kind": "calendar#event", "id": "ev%d" % i, "etag": '"%d"' % i, "status": "confirmed",
+                "summary": "meeting %d" % i, "description": "agenda " * 20,
+                "start": {"dateTime": "2030-01-01T10:00:00Z"}, "end": {"dateTime": "2030-01-01T11:00:00Z"}}
+        if i % 3:
+            item["extendedProperties"] = {"private": {"event_type": "out_of_office" if i % 10 == 0 else "hold"}}
+        items.append(item)
+    return items
+
+
+def before(items):
+    return calendar_pb2.ListEventsResp(events=[calendar_pb2.Event(
+        id=it.get("id", ""),
+        title=it.get("summary", ""),
+        description=it.get("description", ""),
+        start=it.get("start", {}).get("dateTime", ""),
+        end=it.get("end", {}).get("dateTime", ""),
+        event_type=it.get("extendedProperties", {}).get("private", {}).get("event_type", ""),
+        etag=it.get("etag", "")
+    ) for it in items])
+
+
+def to_event_list(items):
+    return calendar_pb2.ListEventsResp(events=[event_mapping.to_event(it) for it in items])
+
+
+def add_events(items):
+    resp = calendar_pb2.ListEventsResp()
+    event_mapping.add_events(resp.events, items)
+    return resp
+
+
+def main():
+    items = make_items()
+    assert add_events(items).events[10].is_out_of_office
+    print("%d events" % EVENTS)
+    for fn in (before, to_event_list, add_events):
+        best = min(timeit.repeat(lambda: fn(items), number=1, repeat=5))
+        print("  %-14s %7.1fms  %5.2f us/event" % (fn.__name__, best * 1000, best / EVENTS * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+'''
+Availability for 100 users over one week: N sequential ListEvents vs one QueryFreeBusy.
+
+    python bench/bench_freebusy.py [users] [google_latency_s]
+
+Runs the servicer in-process against fake_google.FakeCalendarBackend with a fixed
+per-call latency. "google" users have never synced, so QueryFreeBusy calls the
+freebusy endpoint once per user (FREEBUSY_CONCURRENCY at a time); "local" users are
+synced and are answered from the event store's time index without any Google call.
+'''
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import httplib2
+from fake_google import DummyContext, FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import calendar_pb2
+import db
+import event_store
+import server
+from models import UserCalendar
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+EVENTS_PER_USER = 200
+
+
+def seed(backend):
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    with db.session_scope() as session:
+        for i in range(USERS):
+            calendar_id = "cal%d" % i
+            items = []
+            for j in range(EVENTS_PER_USER):
+                # ten back-to-back, overlapping 45-minute meetings a day -> one merged busy block per day
+                t = now + datetime.timedelta(days=j // 10, minutes=30 * (j % 10))
+                items.append(backend.add_event(calendar_id, {
+                    "summary": "meeting %d" % j, "description": "agenda " * 50,
+                    "start": {"dateTime": t.isoformat() + "Z"},
+                    "end": {"dateTime": (t + datetime.timedelta(minutes=45)).isoformat() + "Z"}}))
+            for kind, synced in (("google", False), ("local", True)):
+                session.add(UserCalendar(user_id="%s%d" % (kind, i), access_token="at", refresh_token="rt",
+                                         calendar_id=calendar_id, token_expiry=now + datetime.timedelta(hours=1),
+                                         is_synced=synced, sync_token="s" if synced else None,
+                                         synced_from=now - datetime.timedelta(days=1) if synced else None))
+            event_store.apply_changes(session, "local%d" % i, calendar_id, items)
+        session.commit()
+    return (now.isoformat() + "Z", (now + datetime.timedelta(days=7)).isoformat() + "Z")
+
+
+def timed(label, backend, fn):
+    calls = backend.calls
+    t0 = time.perf_counter()
+    busy = fn()
+    print("  %-28s %7.0fms  %4d Google calls  %5d busy intervals" % (
+        label, (time.perf_counter() - t0) * 1000, backend.calls - calls, busy))
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    time_min, time_max = seed(backend)
+    servicer, ctx = server.CalendarSyncServicer(), DummyContext()
+    print("%d users, Google latency %.0fms, concurrency %d" % (USERS, LATENCY * 1000, server.FREEBUSY_CONCURRENCY))
+
+    def sequential(kind):
+        n = 0
+        for i in range(USERS):
+            req = calendar_pb2.ListEventsReq(user_id="%s%d" % (kind, i), time_min=time_min, time_max=time_max)
+            n += len(event_store.merge_intervals((event_store.parse_time(e.start), event_store.parse_time(e.end))
+                                                 for e in servicer.ListEvents(req, ctx).events))
+        return n
+
+    def fan_out(kind):
+        req = calendar_pb2.FreeBusyReq(user_ids=["%s%d" % (kind, i) for i in range(USERS)],
+                                       time_min=time_min, time_max=time_max)
+        resp = servicer.QueryFreeBusy(req, ctx)
+        assert not any(u.error for u in resp.users), [u.error for u in resp.users if u.error][:3]
+        return sum(len(u.busy) for u in resp.users)
+
+    for kind in ("google", "local"):
+        print(kind)
+        sequential(kind)  # warm the service/user caches so both runs pay the same setup
+        timed("sequential ListEvents", backend, lambda: sequential(kind))
+        timed("QueryFreeBusy", backend, lambda: fan_out(kind))
+
+
+if __name__ == "__main__":
+    main()
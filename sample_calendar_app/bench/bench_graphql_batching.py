@@ -0,0 +1,104 @@
+'''
+One GraphQL query asking for many users' events, with and without the DataLoader.
+
+    python bench/bench_graphql_batching.py [users] [repeats] [google_latency_s]
+
+The query has one aliased listEvents field per user plus `users // 5` aliases repeating
+earlier users. "per field" resolves every alias with its own ListEvents RPC (what
+graphql_api did before); "dataloader" is graphql_api.schema, where the aliases are
+collected into one BatchListEvents and repeated (user, window) keys are sent once.
+The RPC count is the backendRpcs value the schema reports in the response extensions.
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import types
+from concurrent import futures
+from typing import List, Optional
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import grpc
+import strawberry
+import calendar_pb2
+import calendar_pb2_grpc
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)
+sys.modules.setdefault("google_protos", types.SimpleNamespace(calendar_pb2=calendar_pb2))
+os.environ.setdefault("GRAPHQL_CACHE_TTL_SECONDS", "0")  # every query goes to the server (no listEvents cache)
+import graphql_api
+import server
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+
+
+def per_field_schema():
+    # one ListEvents per field, counted the same way
+    @strawberry.type
+    class Query:
+        @strawberry.field
+        async def list_events(self, info: strawberry.Info, user_id: str, time_min: Optional[str] = None,
+                              time_max: Optional[str] = None) -> List[graphql_api.Event]:
+            req = calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min or "", time_max=time_max or "")
+            resp = await info.context["backend"].call("ListEvents", req, graphql_api.QUERY_TIMEOUT_SECONDS)
+            return [graphql_api.to_event(e) for e in resp.events]
+
+    return strawberry.Schema(query=Query, extensions=[graphql_api.BackendExtension])
+
+
+def build_query():
+    user_ids = ["u%d" % i for i in range(USERS)] + ["u%d" % i for i in range(USERS // 5)]
+    fields = " ".join('a%d: listEvents(userId: "%s") { id title }' % (i, u) for i, u in enumerate(user_ids))
+    return "{ %s }" % fields, len(user_ids)
+
+
+async def measure(schema, query):
+    latencies, result = [], None
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        result = await schema.execute(query)
+        latencies.append(time.perf_counter() - t0)
+        assert not result.errors, result.errors
+    latencies.sort()
+    events = sum(len(v) for v in result.data.values())
+    return latencies[len(latencies) // 2], result.extensions["backendRpcs"], events
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=32), options=server.SERVER_OPTIONS)
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(server.CalendarSyncServicer(), grpc_server)
+    target = "127.0.0.1:%d" % grpc_server.add_insecure_port("127.0.0.1:0")
+    grpc_server.start()
+    graphql_api.pool = graphql_api.ChannelPool(target)
+
+    servicer = server.CalendarSyncServicer()
+    for i in range(USERS):
+        servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id="u%d" % i, access_token="at", refresh_token="rt",
+                                                      expiry_epoch=int(time.time()) + 3600), None)
+    for i in range(5):
+        backend.add_event("primary", {"summary": "e%d" % i, "start": {"dateTime": "2030-01-01T10:00:00Z"},
+                                      "end": {"dateTime": "2030-01-01T11:00:00Z"}})
+    query, fields = build_query()
+
+    async def run():
+        print("%d listEvents fields (%d users), Google latency %.0fms, median of %d" % (
+            fields, USERS, LATENCY * 1000, REPEATS))
+        await graphql_api.schema.execute(query)  # warm up service objects and channels
+        for label, schema in (("per field", per_field_schema()), ("dataloader", graphql_api.schema)):
+            latency, rpcs, events = await measure(schema, query)
+            print("  %-11s %7.1fms  backendRpcs %3d  events %d" % (label, latency * 1000, rpcs, events))
+        await graphql_api.pool.close()
+
+    asyncio.run(run())
+    grpc_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
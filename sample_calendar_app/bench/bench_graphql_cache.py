@@ -0,0 +1,133 @@
+'''
+Dashboard polling through the GraphQL gateway with and without the listEvents cache.
+
+    python bench/bench_graphql_cache.py [users] [polls_per_user] [google_latency_s]
+
+"no cache" (GRAPHQL_CACHE_TTL_SECONDS=0) and "cache" poll listEvents for the same
+users and window round after round; the users were never synced, so every miss is a
+Google call. Then the invalidation paths, on a synced user:
+
+- push sync: a new event is added on the fake Google, HandlePushNotification runs, and
+  the next poll must show it (the change reaches the gateway over SubscribeChanges);
+- mutation: createEvent through the gateway, then an immediate poll.
+'''
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+import types
+from concurrent import futures
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import grpc
+import calendar_pb2
+import calendar_pb2_grpc
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)
+sys.modules.setdefault("google_protos", types.SimpleNamespace(calendar_pb2=calendar_pb2))
+import graphql_api
+import server
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+POLLS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+QUERY = "query($u: String!, $a: String, $b: String) { listEvents(userId: $u, timeMin: $a, timeMax: $b) { id title start } }"
+CREATE = ('mutation($u: String!, $s: String!, $e: String!) { createEvent(userId: $u, title: "new", desc: "", '
+          'startIso: $s, endIso: $e, eventType: "") { id } }')
+
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+
+def event(title, start):
+    return {"summary": title, "start": {"dateTime": iso(start)}, "end": {"dateTime": iso(start + datetime.timedelta(minutes=30))}}
+
+
+async def poll(user_id, window):
+    result = await graphql_api.schema.execute(QUERY, variable_values=dict(u=user_id, **window))
+    assert not result.errors, result.errors
+    return result
+
+
+async def dashboards(user_ids, window):
+    latencies, rpcs = [], 0
+    for _ in range(POLLS):
+        for user_id in user_ids:
+            t0 = time.perf_counter()
+            result = await poll(user_id, window)
+            latencies.append(time.perf_counter() - t0)
+            rpcs += result.extensions["backendRpcs"]
+    latencies.sort()
+    return latencies[len(latencies) // 2], sum(latencies), rpcs
+
+
+async def wait_for_feed():
+    while graphql_api.events_cache.suspended:
+        await asyncio.sleep(0.01)
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=16), options=server.SERVER_OPTIONS)
+    servicer = server.CalendarSyncServicer()
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(servicer, grpc_server)
+    target = "127.0.0.1:%d" % grpc_server.add_insecure_port("127.0.0.1:0")
+    grpc_server.start()
+    graphql_api.pool = graphql_api.ChannelPool(target)
+
+    now = datetime.datetime.utcnow()
+    window = {"a": iso(now), "b": iso(now + datetime.timedelta(days=7))}
+    user_ids = ["u%d" % i for i in range(USERS + 1)]
+    for user_id in user_ids:
+        servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="at", refresh_token="rt",
+                                                      expiry_epoch=int(time.time()) + 3600), None)
+    for j in range(10):
+        backend.add_event("primary", event("e%d" % j, now + datetime.timedelta(hours=j + 1)))
+    synced, polled = user_ids[-1], user_ids[:-1]
+    server.onboarding.run([synced])
+
+    async def run():
+        print("%d users x %d polls, Google latency %.0fms" % (USERS, POLLS, LATENCY * 1000))
+        await poll(synced, window)  # starts the change feed
+        await wait_for_feed()
+        ttl = graphql_api.events_cache.ttl
+        for label, cache_ttl in (("no cache", 0), ("cache", ttl)):
+            graphql_api.events_cache.__init__(ttl=cache_ttl)
+            latency, total, rpcs = await dashboards(polled, window)
+            print("  %-9s p50 %6.2fms  total %5.2fs  backend RPCs %4d  hit rate %.3f" % (
+                label, latency * 1000, total, rpcs, graphql_api.events_cache.stats()["hit_rate"]))
+
+        before = len((await poll(synced, window)).data["listEvents"])
+        assert (await poll(synced, window)).extensions["cacheHits"] == 1
+        backend.add_event("primary", event("pushed", now + datetime.timedelta(hours=20)))
+        t0 = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(
+            None, servicer.HandlePushNotification, calendar_pb2.UserId(user_id=synced), None)
+        while len((await poll(synced, window)).data["listEvents"]) == before:
+            await asyncio.sleep(0.001)
+        print("  push sync: change visible %.1fms after HandlePushNotification started" % ((time.perf_counter() - t0) * 1000))
+
+        before = len((await poll(synced, window)).data["listEvents"])
+        start = now + datetime.timedelta(hours=30)
+        result = await graphql_api.schema.execute(CREATE, variable_values=dict(
+            u=synced, s=iso(start), e=iso(start + datetime.timedelta(minutes=30))))
+        assert not result.errors, result.errors
+        after = await poll(synced, window)
+        print("  createEvent: next poll has %d -> %d events (cache hits %d)" % (
+            before, len(after.data["listEvents"]), after.extensions["cacheHits"]))
+        print("  %s" % graphql_api.events_cache.stats())
+        await graphql_api.pool.close()
+
+    asyncio.run(run())
+    grpc_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+Concurrent GraphQL queries through graphql_api.
+
+    python bench/bench_graphql_gateway.py [queries] [concurrency] [google_latency_s]
+
+Runs the threaded CalendarSync server against fake_google (fixed latency, users never
+synced so every ListEvents goes to Google) and executes `queries` listEvents queries,
+`concurrency` at a time, on one event loop:
+
+- "blocking stub": the old resolvers, a sync CalendarSyncStub on one channel; each
+  resolver holds the event loop for the whole round trip, so queries run one by one;
+- "aio pool": graphql_api.schema, async resolvers on the grpc.aio channel pool.
+
+It then shows the per-call deadline: with Google slower than GRAPHQL_QUERY_TIMEOUT_SECONDS
+the query fails with DEADLINE_EXCEEDED instead of hanging.
+'''
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+from concurrent import futures
+from typing import List, Optional
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import grpc
+import strawberry
+import calendar_pb2
+import calendar_pb2_grpc
+# graphql_api imports the stub and protos under their deployed names
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)
+sys.modules.setdefault("google_protos", types.SimpleNamespace(calendar_pb2=calendar_pb2))
+os.environ.setdefault("GRAPHQL_CACHE_TTL_SECONDS", "0")  # every query goes to the server (no listEvents cache)
+import graphql_api
+import server
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+LATENCY = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+USERS = 50
+
+QUERY = "query($u: String!) { listEvents(userId: $u) { id title start end } }"
+
+
+def blocking_schema(target):
+    # graphql_api as it was: blocking stub on a module-level channel
+    client = calendar_pb2_grpc.CalendarSyncStub(grpc.insecure_channel(target))
+
+    @strawberry.type
+    class Query:
+        @strawberry.field
+        def list_events(self, user_id: str, time_min: Optional[str] = None, time_max: Optional[str] = None) -> List[graphql_api.Event]:
+            resp = client.ListEvents(calendar_pb2.ListEventsReq(user_id=user_id, time_min=(time_min or ""), time_max=(time_max or "")))
+            return [graphql_api.to_event(e) for e in resp.events]
+
+    return strawberry.Schema(query=Query)
+
+
+async def load(schema, n, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one(i):
+        async with sem:
+            t0 = time.perf_counter()
+            result = await schema.execute(QUERY, variable_values={"u": "u%d" % (i % USERS)})
+            latencies.append(time.perf_counter() - t0)
+            if result.errors:
+                errors.append(result.errors[0].original_error)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - t0, sorted(latencies), errors
+
+
+def row(label, elapsed, latencies, errors):
+    print("  %-14s %7.1f queries/s  p50 %6.1fms  p99 %7.1fms  errors %d" % (
+        label, len(latencies) / elapsed, latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000, len(errors)))
+
+
+def main():
+    logging.getLogger("strawberry.execution").setLevel(logging.CRITICAL)  # the deadline run logs each failure
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=64), options=server.SERVER_OPTIONS)
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(server.CalendarSyncServicer(), grpc_server)
+    target = "127.0.0.1:%d" % grpc_server.add_insecure_port("127.0.0.1:0")
+    grpc_server.start()
+    graphql_api.pool = graphql_api.ChannelPool(target)
+
+    servicer = server.CalendarSyncServicer()
+    for i in range(USERS):
+        servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id="u%d" % i, access_token="at", refresh_token="rt",
+                                                      expiry_epoch=int(time.time()) + 3600), None)
+        backend.add_event("primary", {"summary": "e%d" % i, "start": {"dateTime": "2030-01-01T10:00:00Z"},
+                                      "end": {"dateTime": "2030-01-01T11:00:00Z"}})
+
+    async def run():
+        print("%d queries, %d concurrent, Google latency %.0fms" % (QUERIES, CONCURRENCY, LATENCY * 1000))
+        await load(graphql_api.schema, USERS, CONCURRENCY)  # warm up service objects and channels
+        row("blocking stub", *await load(blocking_schema(target), QUERIES, CONCURRENCY))
+        row("aio pool", *await load(graphql_api.schema, QUERIES, CONCURRENCY))
+
+        backend.latency = 1.0
+        graphql_api.QUERY_TIMEOUT_SECONDS = 0.3
+        elapsed, latencies, errors = await load(graphql_api.schema, 10, 10)
+        print("  Google at 1s, 0.3s deadline: %d/10 failed after %.0fms (%s)" % (
+            len(errors), latencies[-1] * 1000, errors[0].code() if errors else "-"))
+        await graphql_api.pool.close()
+
+    asyncio.run(run())
+    grpc_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+'''
+List-view GraphQL queries with and without projection pushdown.
+
+    python bench/bench_graphql_projection.py [users] [events_per_user] [description_bytes]
+
+Every event has a `description_bytes` description. The query selects `id start end`
+only. "all fields" sends no read_mask (what graphql_api did before): Google returns
+whole events and the server copies every field into the response. "projected" sends
+the selected fields as read_mask, which becomes `fields=` on the Google call and a
+column list on the local store. Both sources are measured: "google" users were never
+synced, "local" users are answered from the event store.
+'''
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+import types
+from concurrent import futures
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import grpc
+import calendar_pb2
+import calendar_pb2_grpc
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)
+sys.modules.setdefault("google_protos", types.SimpleNamespace(calendar_pb2=calendar_pb2))
+os.environ.setdefault("GRAPHQL_CACHE_TTL_SECONDS", "0")  # every query goes to the server (no listEvents cache)
+import db
+import graphql_api
+import server
+from models import UserCalendar
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+EVENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+DESCRIPTION = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+ROUNDS = 3
+
+QUERY = "query($u: String!, $a: String, $b: String) { listEvents(userId: $u, timeMin: $a, timeMax: $b) { id start end } }"
+
+
+def setup(backend, prefix):
+    now = datetime.datetime.utcnow()
+    user_ids = ["%s-u%d" % (prefix, i) for i in range(USERS)]
+    with db.session_scope() as session:
+        for user_id in user_ids:
+            session.add(UserCalendar(user_id=user_id, access_token="at", refresh_token="rt", calendar_id=user_id,
+                                     token_expiry=now + datetime.timedelta(hours=1)))
+        session.commit()
+    for user_id in user_ids:
+        for j in range(EVENTS):
+            t = now + datetime.timedelta(hours=j + 1)
+            backend.add_event(user_id, {"summary": "event %d" % j, "description": "x" * DESCRIPTION,
+                                        "start": {"dateTime": t.isoformat() + "Z"},
+                                        "end": {"dateTime": (t + datetime.timedelta(minutes=30)).isoformat() + "Z"}})
+    return user_ids
+
+
+async def measure(backend, user_ids, window):
+    grpc_bytes = []
+    call = graphql_api.Backend.call
+
+    async def counting_call(self, method, req, timeout):
+        resp = await call(self, method, req, timeout)
+        grpc_bytes.append(resp.ByteSize())
+        return resp
+    graphql_api.Backend.call = counting_call
+    google_before, latencies = backend.bytes_sent, []
+    try:
+        for _ in range(ROUNDS):
+            for user_id in user_ids:
+                t0 = time.perf_counter()
+                result = await graphql_api.schema.execute(QUERY, variable_values=dict(u=user_id, **window))
+                latencies.append(time.perf_counter() - t0)
+                assert not result.errors and len(result.data["listEvents"]) == EVENTS, result.errors
+    finally:
+        graphql_api.Backend.call = call
+    queries = len(latencies)
+    latencies.sort()
+    return (latencies[queries // 2], (backend.bytes_sent - google_before) / queries, sum(grpc_bytes) / queries)
+
+
+def main():
+    backend = FakeCalendarBackend()
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), options=server.SERVER_OPTIONS)
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(server.CalendarSyncServicer(), grpc_server)
+    target = "127.0.0.1:%d" % grpc_server.add_insecure_port("127.0.0.1:0")
+    grpc_server.start()
+    graphql_api.pool = graphql_api.ChannelPool(target)
+
+    google_users = setup(backend, "google")
+    local_users = setup(backend, "local")
+    server.onboarding.run(local_users)
+    now = datetime.datetime.utcnow()
+    window = {"a": now.isoformat() + "Z", "b": (now + datetime.timedelta(days=60)).isoformat() + "Z"}
+    selected = graphql_api.selected_event_fields
+
+    async def run():
+        print("%d users x %d events, %dB descriptions, query selects id start end" % (USERS, EVENTS, DESCRIPTION))
+        print("  %-7s %-11s %9s %15s %15s" % ("source", "mode", "p50 ms", "Google B/query", "gRPC B/query"))
+        for source, user_ids in (("google", google_users), ("local", local_users)):
+            for mode in ("all fields", "projected"):
+                graphql_api.selected_event_fields = (lambda info: ()) if mode == "all fields" else selected
+                await measure(backend, user_ids[:1], window)  # warm up
+                latency, google_bytes, grpc_bytes = await measure(backend, user_ids, window)
+                print("  %-7s %-11s %9.2f %15.0f %15.0f" % (source, mode, latency * 1000, google_bytes, grpc_bytes))
+        graphql_api.selected_event_fields = selected
+        await graphql_api.pool.close()
+
+    asyncio.run(run())
+    grpc_server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''
+interval_index.IntervalIndex vs a linear scan over one user's events.
+
+    python bench/bench_interval_index.py [events] [queries]
+
+Builds 100k random events (15 min - 8 h, a few multi-day out_of_office blocks) over
+two years and runs the same random overlap and first-free-slot queries against both.
+Results are checked against the scan before anything is timed.
+'''
+import datetime
+import random
+import sys
+import time
+
+import fake_google  # sets up sys.path
+from interval_index import IntervalIndex
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+QUERIES = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+BASE = datetime.datetime(2030, 1, 1)
+SPAN_MINUTES = 2 * 365 * 24 * 60
+
+
+def make_events(rng):
+    events = []
+    for i in range(EVENTS):
+        start = BASE + datetime.timedelta(minutes=rng.randrange(SPAN_MINUTES))
+        if i % 500 == 0:
+            events.append(("ooo%d" % i, start, start + datetime.timedelta(days=rng.randint(1, 10)), "out_of_office"))
+        else:
+            events.append(("ev%d" % i, start, start + datetime.timedelta(minutes=rng.choice((15, 30, 60, 120, 480))), "hold"))
+    return events
+
+
+def scan_overlaps(events, start, end):
+    return sorted((e for e in events if e[1] < end and start < e[2]), key=lambda e: (e[1], e[2], e[0]))
+
+
+def scan_free_slot(events, start, end, duration):
+    cursor = start
+    for _, s, e, _ in scan_overlaps(events, start, end):
+        if s - cursor >= duration:
+            break
+        cursor = max(cursor, e)
+    return (cursor, cursor + duration) if end - cursor >= duration else None
+
+
+def timed(label, fn, queries):
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(*q)
+    elapsed = time.perf_counter() - t0
+    print("  %-22s %9.1f us/query" % (label, elapsed / len(queries) * 1e6))
+    return elapsed
+
+
+def main():
+    rng = random.Random(42)
+    events = make_events(rng)
+    t0 = time.perf_counter()
+    index = IntervalIndex(events)
+    index.overlaps(BASE, BASE)  # force the lazy build
+    print("%d events, %d queries, index build %.0fms" % (EVENTS, QUERIES, (time.perf_counter() - t0) * 1000))
+
+    windows = []
+    for _ in range(QUERIES):
+        start = BASE + datetime.timedelta(minutes=rng.randrange(SPAN_MINUTES))
+        windows.append((start, start + datetime.timedelta(hours=rng.choice((1, 8, 24, 24 * 7)))))
+    slots = [(s, e, datetime.timedelta(minutes=rng.choice((30, 60, 120)))) for s, e in windows]
+
+    for start, end in windows[:200]:
+        assert index.overlaps(start, end) == scan_overlaps(events, start, end)
+    for q in slots[:200]:
+        assert index.first_free_slot(*q) == scan_free_slot(events, *q)
+
+    print("overlaps [start, end)")
+    scan = timed("linear scan", lambda s, e: scan_overlaps(events, s, e), windows)
+    tree = timed("interval index", index.overlaps, windows)
+    print("  speedup %.0fx" % (scan / tree))
+    print("first free slot")
+    scan = timed("linear scan", lambda s, e, d: scan_free_slot(events, s, e, d), slots)
+    tree = timed("interval index", index.first_free_slot, slots)
+    print("  speedup %.0fx" % (scan / tree))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+'''
+Where the time goes per CalendarSync RPC, as recorded by metrics.py.
+
+    python bench/bench_rpc_metrics.py [rpcs_per_method] [google_latency_s]
+
+Runs a threaded gRPC server with MetricsInterceptor against fake_google (fixed
+latency), drives a mix of RPCs through a real channel, scrapes /metrics and prints
+the average latency and per-phase time of every method and its Google calls.
+It then compares a cheap RPC (ListEvents from the local store) with and without
+the interceptor, and turns on slow-request profiling to show the .prof dumps.
+'''
+import datetime
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent import futures
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import grpc
+import calendar_pb2
+import calendar_pb2_grpc
+import metrics
+import server
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+
+def start(interceptors):
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), interceptors=interceptors)
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(server.CalendarSyncServicer(), grpc_server)
+    port = grpc_server.add_insecure_port("127.0.0.1:0")
+    grpc_server.start()
+    return grpc_server, calendar_pb2_grpc.CalendarSyncStub(grpc.insecure_channel("127.0.0.1:%d" % port))
+
+
+def drive(stub):
+    now = datetime.datetime.utcnow()
+    window = dict(time_min=(now - datetime.timedelta(days=1)).isoformat() + "Z",
+                  time_max=(now + datetime.timedelta(days=7)).isoformat() + "Z")
+    for i in range(N):
+        user_id = "u%d" % i
+        stub.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="at", refresh_token="rt",
+                                                  expiry_epoch=int(time.time()) + 3600))
+        start_iso = (now + datetime.timedelta(hours=i % 24)).isoformat() + "Z"
+        end_iso = (now + datetime.timedelta(hours=i % 24, minutes=30)).isoformat() + "Z"
+        stub.CreateEvent(calendar_pb2.CreateEventReq(user_id=user_id, title="t", start_iso=start_iso, end_iso=end_iso))
+        stub.ListEvents(calendar_pb2.ListEventsReq(user_id=user_id, **window))  # not synced yet: Google
+    server.onboarding.run(["u%d" % i for i in range(N)])
+    for i in range(N):
+        stub.HandlePushNotification(calendar_pb2.UserId(user_id="u%d" % i))
+        stub.ListEvents(calendar_pb2.ListEventsReq(user_id="u%d" % i, **window))  # synced: local store
+    stub.QueryFreeBusy(calendar_pb2.FreeBusyReq(user_ids=["u%d" % i for i in range(N)], **window))
+    return window
+
+
+def scrape(port):
+    text = urllib.request.urlopen("http://127.0.0.1:%d/metrics" % port).read().decode()
+    sums, counts = defaultdict(float), defaultdict(int)
+    for line in text.splitlines():
+        m = re.match(r'(calendar_(?:rpc|phase)_seconds)_(sum|count)\{(.*)\} (\S+)', line)
+        if m:
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group(3)))
+            key = (labels["method"], labels.get("phase", "total"))
+            (sums if m.group(2) == "sum" else counts)[key] += float(m.group(4))
+        m = re.match(r'calendar_google_calls_total\{method="(\w+)"\} (\S+)', line)
+        if m:
+            sums[(m.group(1), "google_calls")] += float(m.group(2))
+    return sums, counts
+
+
+def report(sums, counts):
+    methods = sorted({m for m, p in counts if p == "total"})
+    phases = ("db", "service_build", "google", "quota_wait", "convert")
+    print("  %-22s %5s %9s  %s  %s" % ("method", "rpcs", "avg ms", "  ".join("%13s" % p for p in phases), "google/rpc"))
+    for method in methods:
+        n = counts[(method, "total")]
+        cells = "  ".join("%13.2f" % (sums[(method, p)] / n * 1000) for p in phases)
+        print("  %-22s %5d %9.2f  %s  %10.2f" % (method, n, sums[(method, "total")] / n * 1000, cells,
+                                               sums[(method, "google_calls")] / n))
+
+
+def local_qps(stub, window, seconds=3.0):
+    done, t0 = 0, time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        stub.ListEvents(calendar_pb2.ListEventsReq(user_id="u%d" % (done % N), **window))
+        done += 1
+    return done / (time.perf_counter() - t0)
+
+
+def main():
+    backend = FakeCalendarBackend(latency=LATENCY)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    httpd = metrics.start_http_server(0, host="127.0.0.1")
+    grpc_server, stub = start([metrics.MetricsInterceptor()])
+    print("%d RPCs per method, Google latency %.0fms; per-phase columns are avg ms per RPC" % (N, LATENCY * 1000))
+    window = drive(stub)
+    sums, counts = scrape(httpd.server_address[1])
+    report(sums, counts)
+
+    with_interceptor = local_qps(stub, window)
+    grpc_server.stop(None)
+    grpc_server, plain_stub = start([])
+    without = local_qps(plain_stub, window)
+    grpc_server.stop(None)
+    print("local ListEvents: %.0f rpc/s without the interceptor, %.0f with it (spans are on in both)" % (
+        without, with_interceptor))
+
+    metrics.PROFILE_SAMPLE_RATE, metrics.PROFILE_SLOW_MS = 1.0, LATENCY * 1000
+    grpc_server, stub = start([metrics.MetricsInterceptor()])
+    for i in range(10):
+        stub.HandlePushNotification(calendar_pb2.UserId(user_id="u%d" % i))
+    grpc_server.stop(None)
+    dumps = os.listdir(metrics.PROFILE_DIR) if os.path.isdir(metrics.PROFILE_DIR) else []
+    print("profiling every RPC, keeping those over %.0fms: %d .prof files, e.g. %s" % (
+        metrics.PROFILE_SLOW_MS, len(dumps), dumps[:1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+'''
+Server-side peak memory of one large listing: ListEvents (whole range in one response)
+vs StreamEvents (one page at a time) vs walking ListEvents with page_size/page_token.
+
+    python bench/bench_stream_events.py [events]
+
+Runs the servicer in-process against a temp SQLite DB. "local" is a synced user served
+from the event store, "google" an unsynced user served by fake_google.FakeCalendarBackend.
+Streamed events are consumed and dropped as they arrive, like a gRPC client would.
+tracemalloc doesn't see memory held by the protobuf C extension, so the google rows
+(dicts -> Event messages) under-report the single-response ListEvents.
+'''
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httplib2
+from fake_google import DummyContext, FakeCalendarBackend, FakeHttp
+
+os.chdir(tempfile.mkdtemp())
+import calendar_pb2
+import db
+import event_store
+import server
+from models import UserCalendar
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+
+def seed(backend):
+    now = datetime.datetime.utcnow()
+    items = []
+    for i in range(EVENTS):
+        t = now + datetime.timedelta(minutes=30 * i)
+        items.append({"id": "ev%d" % i, "summary": "hold %d" % i, "description": "x" * 200,
+                      "start": {"dateTime": t.isoformat() + "Z"},
+                      "end": {"dateTime": (t + datetime.timedelta(minutes=30)).isoformat() + "Z"}})
+    with db.session_scope() as session:
+        session.add(UserCalendar(user_id="local", access_token="at", refresh_token="rt", calendar_id="primary",
+                                 token_expiry=now + datetime.timedelta(hours=1), is_synced=True, sync_token="s",
+                                 synced_from=now - datetime.timedelta(days=30)))
+        session.add(UserCalendar(user_id="google", access_token="at", refresh_token="rt", calendar_id="primary",
+                                 token_expiry=now + datetime.timedelta(hours=1)))
+        event_store.apply_changes(session, "local", "primary", items)
+        session.commit()
+    for it in items:
+        backend.add_event("primary", it)
+
+
+def list_all(servicer, req):
+    return len(servicer.ListEvents(req, DummyContext()).events)
+
+
+def stream(servicer, req):
+    return sum(1 for _ in servicer.StreamEvents(req, DummyContext()))
+
+
+def list_paged(servicer, req):
+    n = 0
+    while True:
+        resp = servicer.ListEvents(req, DummyContext())
+        n += len(resp.events)
+        if not resp.next_page_token:
+            return n
+        req = calendar_pb2.ListEventsReq(user_id=req.user_id, time_min=req.time_min,
+                                         page_size=req.page_size, page_token=resp.next_page_token)
+
+
+def measure(label, fn, servicer, req):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = fn(servicer, req)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert n == EVENTS, (label, n)
+    print("  %-22s %6.2fs  peak %6.1f MiB" % (label, elapsed, peak / 2 ** 20))
+
+
+def main():
+    backend = FakeCalendarBackend()
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    seed(backend)
+    servicer = server.CalendarSyncServicer()
+    time_min = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).isoformat() + "Z"
+    print("%d events" % EVENTS)
+    for user_id in ("local", "google"):
+        print(user_id)
+        measure("ListEvents", list_all, servicer, calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min))
+        measure("StreamEvents", stream, servicer, calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min))
+        measure("ListEvents page_size", list_paged, servicer,
+                calendar_pb2.ListEventsReq(user_id=user_id, time_min=time_min, page_size=server.STREAM_PAGE_SIZE))
+
+
+if __name__ == "__main__":
+    main()
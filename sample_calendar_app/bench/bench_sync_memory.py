@@ -0,0 +1,66 @@
+'''
+Peak memory of a full paginated sync (sync_engine.sync_pages) for growing calendar sizes.
+
+    python bench/bench_sync_memory.py [10000 50000 100000]
+
+Each run syncs a fresh user against fake_google.FakeCalendarBackend into a temp SQLite DB.
+Only allocations made after the fake calendar is populated are traced, so the reported
+peak is what the sync itself holds -- it should stay flat as the calendar grows.
+'''
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httplib2
+from fake_google import FakeCalendarBackend, FakeHttp
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import sync_engine
+from google_client import build_service_from_tokens
+from models import Base, UserCalendar
+
+SIZES = [int(a) for a in sys.argv[1:]] or [10000, 50000, 100000]
+
+
+def populate(backend, n):
+    start = datetime.datetime.utcnow()
+    for i in range(n):
+        t = start + datetime.timedelta(minutes=30 * i)
+        backend.add_event("primary", {
+            "id": "ev%d" % i, "summary": "hold %d" % i, "description": "x" * 200,
+            "start": {"dateTime": t.isoformat() + "Z"},
+            "end": {"dateTime": (t + datetime.timedelta(minutes=30)).isoformat() + "Z"},
+        })
+
+
+def run(n):
+    backend = FakeCalendarBackend()
+    populate(backend, n)
+    httplib2.Http = lambda *a, **kw: FakeHttp(backend)
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    u = UserCalendar(user_id="u1", access_token="at", refresh_token="rt", calendar_id="primary",
+                     token_expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    session.add(u)
+    session.commit()
+    svc = build_service_from_tokens(u.access_token, u.refresh_token, u.token_expiry, "id", "secret")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    synced = sync_engine.sync_user(session, u, svc)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert synced == n and u.sync_token, (synced, u.sync_token)
+    print("%7d events: %6.1fs  %4d list calls  peak %.1f MiB" % (n, elapsed, backend.calls, peak / 2 ** 20))
+    session.close()
+
+
+if __name__ == "__main__":
+    for n in SIZES:
+        run(n)
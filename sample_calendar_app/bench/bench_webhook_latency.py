@@ -0,0 +1,80 @@
+'''
+Webhook receiver latency while syncs are slow.
+
+    python bench/bench_webhook_latency.py [requests] [concurrency]
+
+Runs google_push.app under uvicorn and fires push notifications for 200 channels,
+once with instant syncs and once with syncs that take 2s. HandlePushNotification is
+replaced by a sleep, so only the receiver + scheduler are measured; p99 should not
+move with sync latency.
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import fake_google  # sets up sys.path
+
+os.environ.setdefault("CALENDAR_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "webhook.db"))
+import calendar_pb2_grpc
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)  # google_push imports the stub under this name
+
+import httpx
+import uvicorn
+
+import db
+import google_push
+from models import UserCalendar
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+CHANNELS = 200
+PORT = 8765
+
+
+def seed():
+    db.init_db()
+    with db.session_scope() as session:
+        for i in range(CHANNELS):
+            session.add(UserCalendar(user_id="u%d" % i, webhook_channel_id="ch%d" % i, webhook_resource_id="r%d" % i))
+        session.commit()
+
+
+async def fire(label):
+    latencies = []
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(base_url="http://127.0.0.1:%d" % PORT) as client:
+        async def one(i):
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post("/webhook/calendar", headers={
+                    "X-Goog-Channel-ID": "ch%d" % (i % CHANNELS), "X-Goog-Resource-ID": "r%d" % (i % CHANNELS),
+                    "X-Goog-Resource-State": "exists"})
+                latencies.append(time.perf_counter() - t0)
+                assert r.status_code == 200
+
+        await asyncio.gather(*(one(i) for i in range(REQUESTS)))
+    latencies.sort()
+    print("%-12s p50 %5.1fms  p99 %5.1fms  max %6.1fms" % (
+        label, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000, latencies[-1] * 1000))
+
+
+def main():
+    seed()
+    server = uvicorn.Server(uvicorn.Config(google_push.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    google_push.scheduler.debounce = 0.5
+    for label, sync_latency in (("sync 0s", 0.0), ("sync 2s", 2.0)):
+        google_push.scheduler.sync_fn = lambda user_id, d=sync_latency: time.sleep(d)
+        asyncio.run(fire(label))
+    print("scheduler:", google_push.scheduler.stats())
+    server.should_exit = True
+    google_push.scheduler.stop(wait=False)
+
+
+if __name__ == "__main__":
+    main()
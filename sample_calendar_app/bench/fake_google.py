@@ -0,0 +1,284 @@
+'''
+In-memory stand-in for the Google Calendar v3 REST API used by the benchmarks.
+FakeHttp is an httplib2.Http look-alike, so the real googleapiclient service objects
+(static discovery doc, request building, JSON model) run unchanged against it.
+'''
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+import httplib2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# app modules use flat imports (server.py, models.py, ...) plus the generated protobuf code
+sys.path[:0] = [os.path.join(HERE, "..", "app"), os.path.join(HERE, "..", "generated")]
+# the fake has no quota unless asked for one (qps_limit), so the app's Google rate limiter is
+# opened up for the benchmarks (also inherited by server subprocesses); bench_rate_limit sets its own
+os.environ.setdefault("GOOGLE_PROJECT_QPS", "1e9")
+os.environ.setdefault("GOOGLE_USER_QPS", "1e9")
+
+
+def parse_fields(spec):
+    """Google partial-response selector -> tree: "nextPageToken,items(id,start/dateTime)" ->
+    {"nextPageToken": None, "items": {"id": None, "start": {"dateTime": None}}} (None: the whole value)."""
+    def at(node, path, subtree):
+        *parents, last = path.split("/")
+        for p in parents:
+            node = node.setdefault(p, {})
+        return node.setdefault(last, subtree)
+
+    root, stack, token = {}, [], ""
+    node = root
+    for ch in spec:
+        if ch == "(":
+            stack.append(node)
+            node, token = at(node, token, {}), ""
+        elif ch in ",)":
+            if token:
+                at(node, token, None)
+            token = ""
+            if ch == ")":
+                node = stack.pop()
+        elif not ch.isspace():
+            token += ch
+    if token:
+        at(node, token, None)
+    return root
+
+
+def select_fields(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(v, tree) for v in value]
+    if isinstance(value, dict):
+        return {k: select_fields(value[k], sub) for k, sub in tree.items() if k in value}
+    return value
+
+
+class FakeCalendarBackend:
+    def __init__(self, latency=0.0, qps_limit=None):
+        self.latency = latency
+        self.qps_limit = qps_limit  # like the Calendar quota: calls over the limit in a 1s window get 403 rateLimitExceeded
+        self.throttled = 0
+        self._window = (0, 0)  # (second, calls in it)
+        self.calendars = {}  # calendar_id -> {event_id: event}, in change order
+        self.seq = {}        # event_id -> change sequence number, used as the fake syncToken
+        self.counter = 0
+        self.calls = 0
+        self.channels = {}  # channel_id -> watch response of a live channel
+        self.bytes_sent = 0  # response body bytes, after `fields=` trimming
+        self._lock = threading.Lock()
+
+    def add_event(self, calendar_id, event):
+        event = dict(event)
+        event.setdefault("id", uuid.uuid4().hex)
+        event.setdefault("etag", '"%s"' % uuid.uuid4().hex)
+        event.setdefault("status", "confirmed")
+        with self._lock:
+            self._touch(calendar_id, event)
+        return event
+
+    def _touch(self, calendar_id, event):
+        # re-insert so dict order stays in change order, like Google's incremental feed
+        events = self.calendars.setdefault(calendar_id, {})
+        events.pop(event["id"], None)
+        events[event["id"]] = event
+        self.counter += 1
+        self.seq[event["id"]] = self.counter
+
+    def list_events(self, calendar_id, query):
+        events = self.calendars.setdefault(calendar_id, {})
+        since = int(query["syncToken"]) if "syncToken" in query else None
+        if since is None:
+            lo, hi = query.get("timeMin", ""), query.get("timeMax", "\uffff")
+            changed = (e for e in events.values() if e.get("status") != "cancelled"
+                       and e["end"].get("dateTime", "") > lo and e["start"].get("dateTime", "") < hi)
+        else:
+            changed = (e for e in events.values() if self.seq[e["id"]] > since)
+        offset = int(query.get("pageToken", 0))
+        size = int(query.get("maxResults", 250))
+        items = list(itertools.islice(changed, offset, offset + size + 1))
+        page = {"kind": "calendar#events", "items": items[:size]}
+        if len(items) > size:
+            page["nextPageToken"] = str(offset + size)
+        else:
+            page["nextSyncToken"] = str(self.counter)
+        return page
+
+    def freebusy(self, query):
+        # busy = every confirmed event overlapping the window, clipped to it (Google merges; callers merge anyway)
+        lo, hi = query["timeMin"], query["timeMax"]
+        calendars = {}
+        for item in query.get("items", []):
+            busy = [{"start": max(e["start"]["dateTime"], lo), "end": min(e["end"]["dateTime"], hi)}
+                    for e in self.calendars.get(item["id"], {}).values()
+                    if e.get("status") != "cancelled" and e["end"]["dateTime"] > lo and e["start"]["dateTime"] < hi]
+            calendars[item["id"]] = {"busy": sorted(busy, key=lambda b: b["start"])}
+        return {"kind": "calendar#freeBusy", "timeMin": lo, "timeMax": hi, "calendars": calendars}
+
+    def watch(self, calendar_id, body):
+        ttl = int(body.get("params", {}).get("ttl", 604800))
+        channel = {"kind": "api#channel", "id": body["id"], "resourceId": "res-%s" % calendar_id,
+                   "resourceUri": "calendars/%s/events" % calendar_id,
+                   "expiration": str(int((time.time() + ttl) * 1000))}
+        with self._lock:
+            self.channels[body["id"]] = channel
+        return channel
+
+    def stop_channel(self, body):
+        with self._lock:
+            if self.channels.pop(body["id"], None) is None:
+                return 404, {"error": {"code": 404, "message": "Channel not found"}}
+        return 204, None
+
+    def _over_quota(self):
+        second = int(time.monotonic())
+        with self._lock:
+            start, count = self._window
+            count = count + 1 if start == second else 1
+            self._window = (second, count)
+            if count > self.qps_limit:
+                self.throttled += 1
+                return True
+        return False
+
+    def handle(self, method, uri, body, headers=None):
+        with self._lock:
+            self.calls += 1
+        if self.qps_limit and self._over_quota():
+            return 403, {"error": {"code": 403, "message": "Rate Limit Exceeded",
+                                   "errors": [{"domain": "usageLimits", "reason": "rateLimitExceeded"}]}}
+        if self.latency:
+            time.sleep(self.latency)
+        status, payload = self.dispatch(method, uri, body, headers)
+        fields = parse_qs(urlparse(uri).query).get("fields")
+        if fields and payload:
+            # partial response, like Google's `fields=` standard parameter
+            payload = select_fields(payload, parse_fields(fields[0]))
+        return status, payload
+
+    def sent(self, content):
+        with self._lock:
+            self.bytes_sent += len(content)
+        return content
+
+    def dispatch(self, method, uri, body, headers=None):
+        url = urlparse(uri)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        if parts[-1] == "freeBusy" and method == "POST":
+            return 200, self.freebusy(json.loads(body))
+        if parts[-2:] == ["channels", "stop"]:
+            return self.stop_channel(json.loads(body))
+        # .../calendars/{calendarId}/events[/{eventId}]
+        i = parts.index("calendars")
+        calendar_id = parts[i + 1]
+        rest = parts[i + 3:]
+        events = self.calendars.setdefault(calendar_id, {})
+        payload = json.loads(body) if body else {}
+
+        if not rest and method == "GET":
+            return 200, self.list_events(calendar_id, query)
+        if not rest and method == "POST":
+            return 200, self.add_event(calendar_id, payload)
+        if rest == ["watch"] and method == "POST":
+            return 200, self.watch(calendar_id, payload)
+        event_id = rest[0]
+        if event_id not in events:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        if method == "GET":
+            return 200, events[event_id]
+        if_match = {k.lower(): v for k, v in (headers or {}).items()}.get("if-match")
+        if if_match and if_match != events[event_id]["etag"]:
+            return 412, {"error": {"code": 412, "message": "Precondition Failed"}}
+        if method == "DELETE":
+            self._touch(calendar_id, dict(events[event_id], status="cancelled"))
+            return 204, None
+        etag = '"%s"' % uuid.uuid4().hex
+        if method == "PUT":
+            self._touch(calendar_id, dict(payload, id=event_id, etag=etag))
+        elif method == "PATCH":
+            self._touch(calendar_id, dict(events[event_id], **payload, etag=etag))
+        return 200, events[event_id]
+
+
+class FakeHttp:
+    """Drop-in for httplib2.Http that answers from a FakeCalendarBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=1, connection_type=None):
+        if "/batch/" in uri:
+            return self._batch(body, headers)
+        status, payload = self.backend.handle(method, uri, body, headers)
+        content = self.backend.sent(b"" if payload is None else json.dumps(payload).encode())
+        return httplib2.Response({"status": str(status), "content-type": "application/json"}), content
+
+    def _batch(self, body, headers):
+        # one round trip for the whole multipart/mixed batch, then every part is answered in order
+        with self.backend._lock:
+            self.backend.calls += 1
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        message = Parser().parsestr("content-type: %s\r\n\r\n%s" % (headers["content-type"], body))
+        out = []
+        for part in message.get_payload():
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, uri, _ = request_line.split(" ", 2)
+            sub_body = rest.split("\r\n\r\n", 1)[1] if "\r\n\r\n" in rest else rest.split("\n\n", 1)[-1]
+            status, payload = self.backend.dispatch(method, uri, sub_body.strip() or None)
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            out.append("--fake_batch\r\nContent-Type: application/http\r\nContent-ID: %s\r\n\r\n"
+                       "HTTP/1.1 %d OK\r\nContent-Type: application/json\r\n\r\n%s\r\n"
+                       % (content_id, status, "" if payload is None else json.dumps(payload)))
+        content = self.backend.sent(("".join(out) + "--fake_batch--").encode())
+        return httplib2.Response({"status": "200", "content-type": "multipart/mixed; boundary=fake_batch"}), content
+
+    def close(self):
+        pass
+
+
+class DummyContext:
+    """Minimal grpc.ServicerContext for calling servicer methods in-process."""
+
+    def abort(self, code, details):
+        raise RuntimeError("%s: %s" % (code, details))
+
+
+def serve_http(backend, host="127.0.0.1", port=0):
+    """
+    Serve the fake backend over real HTTP (one thread per request) for load benchmarks.
+    Returns (server, base_url); point GOOGLE_API_ENDPOINT at base_url.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self):
+            length = int(self.headers.get("content-length") or 0)
+            body = self.rfile.read(length).decode() if length else None
+            status, payload = backend.handle(self.command, self.path, body, dict(self.headers))
+            content = backend.sent(b"" if payload is None else json.dumps(payload).encode())
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, "http://%s:%d/calendar/v3/" % httpd.server_address
@@ -23,33 +23,68 @@ _sym_db = _symbol_database.Default()
 
 
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
+from google.protobuf import field_mask_pb2 as google_dot_protobuf_dot_field__mask__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x63\x61lendar.proto\x12\x08\x63\x61lendar\x1a\x1bgoogle/protobuf/empty.proto\"\x19\n\x06UserId\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\x17\n\x08OAuthUrl\x12\x0b\n\x03url\x18\x01 \x01(\t\"a\n\x0bOAuthTokens\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x14\n\x0c\x61\x63\x63\x65ss_token\x18\x02 \x01(\t\x12\x15\n\rrefresh_token\x18\x03 \x01(\t\x12\x14\n\x0c\x65xpiry_epoch\x18\x04 \x01(\x03\"\x81\x01\n\x05\x45vent\x12\n\n\x02id\x18\x01 \x01(\t\x12\r\n\x05title\x18\x02 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x01(\t\x12\r\n\x05start\x18\x04 \x01(\t\x12\x0b\n\x03\x65nd\x18\x05 \x01(\t\x12\x12\n\nevent_type\x18\x06 \x01(\t\x12\x18\n\x10is_out_of_office\x18\x07 \x01(\x08\"\x92\x01\n\x0e\x43reateEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\r\n\x05title\x18\x03 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x04 \x01(\t\x12\x11\n\tstart_iso\x18\x05 \x01(\t\x12\x0f\n\x07\x65nd_iso\x18\x06 \x01(\t\x12\x12\n\nevent_type\x18\x07 \x01(\t\"\xa4\x01\n\x0eUpdateEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08\x65vent_id\x18\x03 \x01(\t\x12\r\n\x05title\x18\x04 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x05 \x01(\t\x12\x11\n\tstart_iso\x18\x06 \x01(\t\x12\x0f\n\x07\x65nd_iso\x18\x07 \x01(\t\x12\x12\n\nevent_type\x18\x08 \x01(\t\"H\n\x0e\x44\x65leteEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08\x65vent_id\x18\x03 \x01(\t\"Y\n\rListEventsReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08time_min\x18\x03 \x01(\t\x12\x10\n\x08time_max\x18\x04 \x01(\t\"1\n\x0eListEventsResp\x12\x1f\n\x06\x65vents\x18\x01 \x03(\x0b\x32\x0f.calendar.Event2\xef\x03\n\x0c\x43\x61lendarSync\x12\x33\n\x0bGetOAuthUrl\x12\x10.calendar.UserId\x1a\x12.calendar.OAuthUrl\x12<\n\x0bStoreTokens\x12\x15.calendar.OAuthTokens\x1a\x16.google.protobuf.Empty\x12\x32\n\x06OptOut\x12\x10.calendar.UserId\x1a\x16.google.protobuf.Empty\x12\x38\n\x0b\x43reateEvent\x12\x18.calendar.CreateEventReq\x1a\x0f.calendar.Event\x12\x38\n\x0bUpdateEvent\x12\x18.calendar.UpdateEventReq\x1a\x0f.calendar.Event\x12?\n\x0b\x44\x65leteEvent\x12\x18.calendar.DeleteEventReq\x1a\x16.google.protobuf.Empty\x12?\n\nListEvents\x12\x17.calendar.ListEventsReq\x1a\x18.calendar.ListEventsResp\x12\x42\n\x16HandlePushNotification\x12\x10.calendar.UserId\x1a\x16.google.protobuf.Emptyb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x63\x61lendar.proto\x12\x08\x63\x61lendar\x1a\x1bgoogle/protobuf/empty.proto\x1a google/protobuf/field_mask.proto\"\x19\n\x06UserId\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\x17\n\x08OAuthUrl\x12\x0b\n\x03url\x18\x01 \x01(\t\"a\n\x0bOAuthTokens\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x14\n\x0c\x61\x63\x63\x65ss_token\x18\x02 \x01(\t\x12\x15\n\rrefresh_token\x18\x03 \x01(\t\x12\x14\n\x0c\x65xpiry_epoch\x18\x04 \x01(\x03\"\x8f\x01\n\x05\x45vent\x12\n\n\x02id\x18\x01 \x01(\t\x12\r\n\x05title\x18\x02 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x03 \x01(\t\x12\r\n\x05start\x18\x04 \x01(\t\x12\x0b\n\x03\x65nd\x18\x05 \x01(\t\x12\x12\n\nevent_type\x18\x06 \x01(\t\x12\x18\n\x10is_out_of_office\x18\x07 \x01(\x08\x12\x0c\n\x04\x65tag\x18\x08 \x01(\t\"\x92\x01\n\x0e\x43reateEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\r\n\x05title\x18\x03 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x04 \x01(\t\x12\x11\n\tstart_iso\x18\x05 \x01(\t\x12\x0f\n\x07\x65nd_iso\x18\x06 \x01(\t\x12\x12\n\nevent_type\x18\x07 \x01(\t\"\xb2\x01\n\x0eUpdateEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08\x65vent_id\x18\x03 \x01(\t\x12\r\n\x05title\x18\x04 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x05 \x01(\t\x12\x11\n\tstart_iso\x18\x06 \x01(\t\x12\x0f\n\x07\x65nd_iso\x18\x07 \x01(\t\x12\x12\n\nevent_type\x18\x08 \x01(\t\x12\x0c\n\x04\x65tag\x18\t \x01(\t\"H\n\x0e\x44\x65leteEventReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08\x65vent_id\x18\x03 \x01(\t\"\xaf\x01\n\rListEventsReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12\x10\n\x08time_min\x18\x03 \x01(\t\x12\x10\n\x08time_max\x18\x04 \x01(\t\x12\x11\n\tpage_size\x18\x05 \x01(\x05\x12\x12\n\npage_token\x18\x06 \x01(\t\x12-\n\tread_mask\x18\x07 \x01(\x0b\x32\x1a.google.protobuf.FieldMask\"J\n\x0eListEventsResp\x12\x1f\n\x06\x65vents\x18\x01 \x03(\x0b\x32\x0f.calendar.Event\x12\x17\n\x0fnext_page_token\x18\x02 \x01(\t\"?\n\x12\x42\x61tchListEventsReq\x12)\n\x08requests\x18\x01 \x03(\x0b\x32\x17.calendar.ListEventsReq\"I\n\x10ListEventsResult\x12&\n\x04resp\x18\x01 \x01(\x0b\x32\x18.calendar.ListEventsResp\x12\r\n\x05\x65rror\x18\x02 \x01(\t\"B\n\x13\x42\x61tchListEventsResp\x12+\n\x07results\x18\x01 \x03(\x0b\x32\x1a.calendar.ListEventsResult\"\x99\x01\n\rEventMutation\x12*\n\x06\x63reate\x18\x01 \x01(\x0b\x32\x18.calendar.CreateEventReqH\x00\x12*\n\x06update\x18\x02 \x01(\x0b\x32\x18.calendar.UpdateEventReqH\x00\x12*\n\x06\x64\x65lete\x18\x03 \x01(\x0b\x32\x18.calendar.DeleteEventReqH\x00\x42\x04\n\x02op\"b\n\x14\x42\x61tchMutateEventsReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x02 \x01(\t\x12$\n\x03ops\x18\x03 \x03(\x0b\x32\x17.calendar.EventMutation\"o\n\x0eMutationResult\x12\r\n\x05index\x18\x01 \x01(\x05\x12\n\n\x02ok\x18\x02 \x01(\x08\x12\x13\n\x0bhttp_status\x18\x03 \x01(\x05\x12\r\n\x05\x65rror\x18\x04 \x01(\t\x12\x1e\n\x05\x65vent\x18\x05 \x01(\x0b\x32\x0f.calendar.Event\"B\n\x15\x42\x61tchMutateEventsResp\x12)\n\x07results\x18\x01 \x03(\x0b\x32\x18.calendar.MutationResult\"C\n\x0b\x46reeBusyReq\x12\x10\n\x08user_ids\x18\x01 \x03(\t\x12\x10\n\x08time_min\x18\x02 \x01(\t\x12\x10\n\x08time_max\x18\x03 \x01(\t\"*\n\x0c\x42usyInterval\x12\r\n\x05start\x18\x01 \x01(\t\x12\x0b\n\x03\x65nd\x18\x02 \x01(\t\"P\n\x08UserBusy\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12$\n\x04\x62usy\x18\x02 \x03(\x0b\x32\x16.calendar.BusyInterval\x12\r\n\x05\x65rror\x18\x03 \x01(\t\"1\n\x0c\x46reeBusyResp\x12!\n\x05users\x18\x01 \x03(\x0b\x32\x12.calendar.UserBusy\"F\n\x0f\x46indOverlapsReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x11\n\tstart_iso\x18\x02 \x01(\t\x12\x0f\n\x07\x65nd_iso\x18\x03 \x01(\t\"`\n\x0f\x46indFreeSlotReq\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08time_min\x18\x02 \x01(\t\x12\x10\n\x08time_max\x18\x03 \x01(\t\x12\x18\n\x10\x64uration_minutes\x18\x04 \x01(\x05\"5\n\x08\x46reeSlot\x12\r\n\x05\x66ound\x18\x01 \x01(\x08\x12\r\n\x05start\x18\x02 \x01(\t\x12\x0b\n\x03\x65nd\x18\x03 \x01(\t\"N\n\x0c\x43hangeRecord\x12\x0c\n\x04kind\x18\x01 \x01(\t\x12\x10\n\x08\x65vent_id\x18\x02 \x01(\t\x12\x1e\n\x05\x65vent\x18\x03 \x01(\x0b\x32\x0f.calendar.Event\"i\n\x0b\x43hangeBatch\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\x13\n\x0b\x63\x61lendar_id\x18\x03 \x01(\t\x12\'\n\x07\x63hanges\x18\x04 \x03(\x0b\x32\x16.calendar.ChangeRecord\"\'\n\x13SubscribeChangesReq\x12\x10\n\x08user_ids\x18\x01 \x03(\t2\xe1\x07\n\x0c\x43\x61lendarSync\x12\x33\n\x0bGetOAuthUrl\x12\x10.calendar.UserId\x1a\x12.calendar.OAuthUrl\x12<\n\x0bStoreTokens\x12\x15.calendar.OAuthTokens\x1a\x16.google.protobuf.Empty\x12\x32\n\x06OptOut\x12\x10.calendar.UserId\x1a\x16.google.protobuf.Empty\x12\x38\n\x0b\x43reateEvent\x12\x18.calendar.CreateEventReq\x1a\x0f.calendar.Event\x12\x38\n\x0bUpdateEvent\x12\x18.calendar.UpdateEventReq\x1a\x0f.calendar.Event\x12?\n\x0b\x44\x65leteEvent\x12\x18.calendar.DeleteEventReq\x1a\x16.google.protobuf.Empty\x12?\n\nListEvents\x12\x17.calendar.ListEventsReq\x1a\x18.calendar.ListEventsResp\x12N\n\x0f\x42\x61tchListEvents\x12\x1c.calendar.BatchListEventsReq\x1a\x1d.calendar.BatchListEventsResp\x12:\n\x0cStreamEvents\x12\x17.calendar.ListEventsReq\x1a\x0f.calendar.Event0\x01\x12T\n\x11\x42\x61tchMutateEvents\x12\x1e.calendar.BatchMutateEventsReq\x1a\x1f.calendar.BatchMutateEventsResp\x12>\n\rQueryFreeBusy\x12\x15.calendar.FreeBusyReq\x1a\x16.calendar.FreeBusyResp\x12\x43\n\x0c\x46indOverlaps\x12\x19.calendar.FindOverlapsReq\x1a\x18.calendar.ListEventsResp\x12=\n\x0c\x46indFreeSlot\x12\x19.calendar.FindFreeSlotReq\x1a\x12.calendar.FreeSlot\x12J\n\x10SubscribeChanges\x12\x1d.calendar.SubscribeChangesReq\x1a\x15.calendar.ChangeBatch0\x01\x12\x42\n\x16HandlePushNotification\x12\x10.calendar.UserId\x1a\x16.google.protobuf.Emptyb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'calendar_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_USERID']._serialized_start=57
-  _globals['_USERID']._serialized_end=82
-  _globals['_OAUTHURL']._serialized_start=84
-  _globals['_OAUTHURL']._serialized_end=107
-  _globals['_OAUTHTOKENS']._serialized_start=109
-  _globals['_OAUTHTOKENS']._serialized_end=206
-  _globals['_EVENT']._serialized_start=209
-  _globals['_EVENT']._serialized_end=338
-  _globals['_CREATEEVENTREQ']._serialized_start=341
-  _globals['_CREATEEVENTREQ']._serialized_end=487
-  _globals['_UPDATEEVENTREQ']._serialized_start=490
-  _globals['_UPDATEEVENTREQ']._serialized_end=654
-  _globals['_DELETEEVENTREQ']._serialized_start=656
-  _globals['_DELETEEVENTREQ']._serialized_end=728
-  _globals['_LISTEVENTSREQ']._serialized_start=730
-  _globals['_LISTEVENTSREQ']._serialized_end=819
-  _globals['_LISTEVENTSRESP']._serialized_start=821
-  _globals['_LISTEVENTSRESP']._serialized_end=870
-  _globals['_CALENDARSYNC']._serialized_start=873
-  _globals['_CALENDARSYNC']._serialized_end=1368
+  _globals['_USERID']._serialized_start=91
+  _globals['_USERID']._serialized_end=116
+  _globals['_OAUTHURL']._serialized_start=118
+  _globals['_OAUTHURL']._serialized_end=141
+  _globals['_OAUTHTOKENS']._serialized_start=143
+  _globals['_OAUTHTOKENS']._serialized_end=240
+  _globals['_EVENT']._serialized_start=243
+  _globals['_EVENT']._serialized_end=386
+  _globals['_CREATEEVENTREQ']._serialized_start=389
+  _globals['_CREATEEVENTREQ']._serialized_end=535
+  _globals['_UPDATEEVENTREQ']._serialized_start=538
+  _globals['_UPDATEEVENTREQ']._serialized_end=716
+  _globals['_DELETEEVENTREQ']._serialized_start=718
+  _globals['_DELETEEVENTREQ']._serialized_end=790
+  _globals['_LISTEVENTSREQ']._serialized_start=793
+  _globals['_LISTEVENTSREQ']._serialized_end=968
+  _globals['_LISTEVENTSRESP']._serialized_start=970
+  _globals['_LISTEVENTSRESP']._serialized_end=1044
+  _globals['_BATCHLISTEVENTSREQ']._serialized_start=1046
+  _globals['_BATCHLISTEVENTSREQ']._serialized_end=1109
+  _globals['_LISTEVENTSRESULT']._serialized_start=1111
+  _globals['_LISTEVENTSRESULT']._serialized_end=1184
+  _globals['_BATCHLISTEVENTSRESP']._serialized_start=1186
+  _globals['_BATCHLISTEVENTSRESP']._serialized_end=1252
+  _globals['_EVENTMUTATION']._serialized_start=1255
+  _globals['_EVENTMUTATION']._serialized_end=1408
+  _globals['_BATCHMUTATEEVENTSREQ']._serialized_start=1410
+  _globals['_BATCHMUTATEEVENTSREQ']._serialized_end=1508
+  _globals['_MUTATIONRESULT']._serialized_start=1510
+  _globals['_MUTATIONRESULT']._serialized_end=1621
+  _globals['_BATCHMUTATEEVENTSRESP']._serialized_start=1623
+  _globals['_BATCHMUTATEEVENTSRESP']._serialized_end=1689
+  _globals['_FREEBUSYREQ']._serialized_start=1691
+  _globals['_FREEBUSYREQ']._serialized_end=1758
+  _globals['_BUSYINTERVAL']._serialized_start=1760
+  _globals['_BUSYINTERVAL']._serialized_end=1802
+  _globals['_USERBUSY']._serialized_start=1804
+  _globals['_USERBUSY']._serialized_end=1884
+  _globals['_FREEBUSYRESP']._serialized_start=1886
+  _globals['_FREEBUSYRESP']._serialized_end=1935
+  _globals['_FINDOVERLAPSREQ']._serialized_start=1937
+  _globals['_FINDOVERLAPSREQ']._serialized_end=2007
+  _globals['_FINDFREESLOTREQ']._serialized_start=2009
+  _globals['_FINDFREESLOTREQ']._serialized_end=2105
+  _globals['_FREESLOT']._serialized_start=2107
+  _globals['_FREESLOT']._serialized_end=2160
+  _globals['_CHANGERECORD']._serialized_start=2162
+  _globals['_CHANGERECORD']._serialized_end=2240
+  _globals['_CHANGEBATCH']._serialized_start=2242
+  _globals['_CHANGEBATCH']._serialized_end=2347
+  _globals['_SUBSCRIBECHANGESREQ']._serialized_start=2349
+  _globals['_SUBSCRIBECHANGESREQ']._serialized_end=2388
+  _globals['_CALENDARSYNC']._serialized_start=2391
+  _globals['_CALENDARSYNC']._serialized_end=3384
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,38 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the app uses flat imports (server.py, models.py, ...) plus the generated protobuf code;
+# fake_google (bench/) stands in for the Google API
+sys.path[:0] = [os.path.join(HERE, "..", "app"), os.path.join(HERE, "..", "generated"), os.path.join(HERE, "..", "bench")]
+os.environ.setdefault("CALENDAR_DB_URL", "sqlite://")  # one private in-memory DB per test run
+
+import itertools
+import time
+
+import httplib2
+import pytest
+
+_user_ids = itertools.count()
+
+@pytest.fixture
+def google(monkeypatch):
+    """Fake Google Calendar API behind the real googleapiclient service objects."""
+    from fake_google import FakeCalendarBackend, FakeHttp
+    backend = FakeCalendarBackend()
+    monkeypatch.setattr(httplib2, "Http", lambda *a, **kw: FakeHttp(backend))
+    return backend
+
+@pytest.fixture
+def servicer(google):
+    import server
+    return server.CalendarSyncServicer()
+
+@pytest.fixture
+def user_id(servicer):
+    """A fresh user with tokens, never synced; their calendar is the fake's "primary"."""
+    import calendar_pb2
+    user_id = "test-user-%d" % next(_user_ids)
+    servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="at", refresh_token="rt",
+                                                  expiry_epoch=int(time.time()) + 3600), None)
+    return user_id
@@ -0,0 +1,27 @@
+import asyncio
+
+import calendar_pb2
+import server
+
+def test_batch_list_events_is_bounded(monkeypatch):
+    import aio_server
+    monkeypatch.setattr(server, "BATCH_LIST_CONCURRENCY", 3)
+    in_flight, peak = 0, 0
+
+    async def list_events(request, context):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return calendar_pb2.ListEventsResp(next_page_token=request.user_id)
+
+    async def run():
+        servicer = aio_server.AsyncCalendarSyncServicer()
+        servicer.ListEvents = list_events
+        requests = [calendar_pb2.ListEventsReq(user_id="u%d" % i) for i in range(10)]
+        return await servicer.BatchListEvents(calendar_pb2.BatchListEventsReq(requests=requests), None)
+    resp = asyncio.run(run())
+
+    assert [r.resp.next_page_token for r in resp.results] == ["u%d" % i for i in range(10)]
+    assert peak == 3
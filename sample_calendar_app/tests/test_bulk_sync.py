@@ -0,0 +1,72 @@
+import datetime
+
+import bulk_sync
+import calendar_pb2
+import event_store
+import server
+from db import session_scope
+from fake_google import DummyContext
+from models import CalendarEvent, UserCalendar
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+def make_legacy(user_id):
+    # a row synced before the local event store: a live syncToken, but no synced window and no events
+    with session_scope() as session:
+        session.query(UserCalendar).filter_by(user_id=user_id).update(
+            {"sync_token": "1", "is_synced": True, "synced_from": None})
+        session.commit()
+    server.user_cache.invalidate(user_id)
+
+def load_user(user_id):
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        session.expunge(u)
+        return u
+
+def test_legacy_row_without_synced_from_gets_a_first_sync(google, user_id):
+    start = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    google.add_event("primary", {"summary": "old", "start": {"dateTime": iso(start)},
+                                 "end": {"dateTime": iso(start + datetime.timedelta(minutes=30))}})
+    make_legacy(user_id)
+    u = load_user(user_id)
+    assert bulk_sync.needs_first_sync(u)
+    assert user_id in set(bulk_sync.pending_users())
+
+    assert server.onboarding.sync_one(user_id) == "synced"
+
+    u = load_user(user_id)
+    assert u.synced_from is not None and u.is_synced and u.sync_token
+    with session_scope() as session:
+        assert session.query(CalendarEvent).filter_by(user_id=user_id).count() == 1
+    assert event_store.can_serve(u, iso(datetime.datetime.utcnow()))
+    assert not bulk_sync.needs_first_sync(u)
+    assert user_id not in set(bulk_sync.pending_users())
+
+def test_push_for_legacy_row_queues_the_first_sync(google, servicer, user_id, monkeypatch):
+    make_legacy(user_id)
+    queued = []
+    monkeypatch.setattr(server.onboarding, "submit", queued.append)
+    google.calls = 0
+    servicer.HandlePushNotification(calendar_pb2.UserId(user_id=user_id), None)
+    assert queued == [user_id]
+    assert google.calls == 0  # no full sync inside the handler
+
+def test_reads_for_legacy_row_backfill_the_local_store(google, servicer, user_id, monkeypatch):
+    now = datetime.datetime.utcnow()
+    google.add_event("primary", {"summary": "old", "start": {"dateTime": iso(now + datetime.timedelta(hours=1))},
+                                 "end": {"dateTime": iso(now + datetime.timedelta(hours=2))}})
+    make_legacy(user_id)
+    queued, submit = [], server.onboarding.submit
+    monkeypatch.setattr(server.onboarding, "submit", queued.append)
+    req = calendar_pb2.ListEventsReq(user_id=user_id, time_min=iso(now))
+
+    assert len(servicer.ListEvents(req, DummyContext()).events) == 1  # from Google meanwhile
+    assert queued == [user_id]
+
+    monkeypatch.setattr(server.onboarding, "submit", submit)
+    assert server.onboarding.sync_one(user_id) == "synced"
+    google.calls = 0
+    assert len(servicer.ListEvents(req, DummyContext()).events) == 1
+    assert google.calls == 0
@@ -0,0 +1,85 @@
+import datetime
+import threading
+
+import pytest
+
+import channel_manager
+import server
+from db import session_scope
+from models import UserCalendar
+
+def set_channel(user_id, channel_id, expiration):
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        u.webhook_channel_id, u.webhook_resource_id, u.webhook_expiration = channel_id, "res-primary", expiration
+        session.commit()
+
+def channel_of(user_id):
+    with session_scope() as session:
+        return session.query(UserCalendar.webhook_channel_id).filter_by(user_id=user_id).scalar()
+
+@pytest.fixture
+def manager():
+    managers = []
+
+    def make(**kwargs):
+        managers.append(channel_manager.ChannelManager(server.get_service, **kwargs))
+        return managers[-1]
+    yield make
+    for m in managers:
+        m.shutdown()
+
+def test_missed_channel_catch_up_runs_on_the_sync_scheduler(google, user_id, manager, monkeypatch):
+    synced = []
+    done = threading.Event()
+
+    def sync(uid):
+        synced.append((uid, threading.current_thread().name))
+        done.set()
+    monkeypatch.setattr(server.catch_up, "sync_fn", sync)
+    expired = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    set_channel(user_id, "old", expired)
+    m = manager(on_missed=server.channels.on_missed)
+    m.schedule(user_id, "old", expired)
+
+    assert m.run_once() == 1
+    assert done.wait(5)
+    assert synced[0][0] == user_id
+    assert synced[0][1].startswith("sync")  # not a channel-renew thread
+    assert m.stats()["missed"] == 1
+    assert channel_of(user_id) in google.channels
+
+def test_new_channel_is_stopped_when_renewal_fails_after_watch(google, user_id, manager, monkeypatch):
+    soon = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+    set_channel(user_id, "old", soon)
+    m = manager()
+    m.schedule(user_id, "old", soon)
+
+    def broken(resp, ttl_seconds):
+        raise ValueError("bad expiration")
+    monkeypatch.setattr(channel_manager, "channel_expiration", broken)
+
+    assert m.run_once() == 0
+    assert google.channels == {}  # the channel watch() opened was stopped again
+    assert channel_of(user_id) == "old"
+    assert (m.stats()["failed"], m.stats()["stopped"]) == (1, 1)
+
+def test_new_channel_is_stopped_when_user_opts_out_during_renewal(google, user_id, manager, monkeypatch):
+    soon = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+    set_channel(user_id, "old", soon)
+    m = manager()
+    m.schedule(user_id, "old", soon)
+    put = channel_manager.user_cache.put
+
+    def opt_out_after_swap(u):
+        put(u)
+        # what an OptOut that loaded the row before the swap commits afterwards
+        with session_scope() as session:
+            session.query(UserCalendar).filter_by(user_id=user_id).update(
+                {"opted_out": True, "refresh_token": None, "webhook_channel_id": None})
+            session.commit()
+    monkeypatch.setattr(channel_manager.user_cache, "put", opt_out_after_swap)
+
+    assert m.run_once() == 0
+    assert google.channels == {}
+    assert m.stats()["renewed"] == 0
@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine, inspect, text
+
+import db
+
+def test_init_db_adds_missing_columns_and_indexes(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "old.db"))
+    with engine.begin() as conn:
+        # calendar_events as the first version of the event store created it
+        conn.execute(text('CREATE TABLE calendar_events (id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL, '
+                          'event_id VARCHAR NOT NULL, title VARCHAR, start VARCHAR, "end" VARCHAR)'))
+        conn.execute(text("INSERT INTO calendar_events (user_id, event_id, title) VALUES ('u1', 'e1', 'kept')"))
+    db.init_db(engine)
+    insp = inspect(engine)
+    columns = {c["name"] for c in insp.get_columns("calendar_events")}
+    assert {"calendar_id", "start_time", "end_time", "event_type", "etag"} <= columns
+    assert "ix_calendar_events_user_range" in {i["name"] for i in insp.get_indexes("calendar_events")}
+    assert insp.has_table("user_calendars")
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT title, event_type FROM calendar_events")).all() == [("kept", None)]
+
+def test_init_db_is_idempotent(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "new.db"))
+    db.init_db(engine)
+    db.init_db(engine)
+    assert {c["name"] for c in inspect(engine).get_columns("calendar_events")} == set(
+        db.Base.metadata.tables["calendar_events"].columns.keys())
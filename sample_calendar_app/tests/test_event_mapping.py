@@ -0,0 +1,47 @@
+import datetime
+
+import pytest
+
+import calendar_pb2
+import event_mapping
+import server
+from fake_google import DummyContext
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+def test_out_of_office_from_either_type():
+    assert event_mapping.out_of_office("out_of_office", "")
+    assert event_mapping.out_of_office("", "outOfOffice")
+    assert not event_mapping.out_of_office("", "default")
+    assert not event_mapping.out_of_office(None, None)
+
+def test_row_columns_cover_out_of_office():
+    assert event_mapping.row_columns(("is_out_of_office",)) == ["event_id", "event_type", "google_event_type", "start_time"]
+
+@pytest.mark.parametrize("paths", [[], ["id", "is_out_of_office"], ["id", "event_type", "is_out_of_office", "start"]])
+def test_local_events_match_google(google, servicer, user_id, paths):
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    for i, extra in enumerate([
+        {"eventType": "outOfOffice"},                                            # set in the Calendar UI
+        {"extendedProperties": {"private": {"event_type": "out_of_office"}}},  # set through CreateEvent
+        {"eventType": "default"},
+        {"eventType": "focusTime", "extendedProperties": {"private": {"event_type": "deep_work"}}},
+    ]):
+        start = now + datetime.timedelta(hours=i + 1)
+        google.add_event("primary", dict(extra, summary="e%d" % i, start={"dateTime": iso(start)},
+                                         end={"dateTime": iso(start + datetime.timedelta(minutes=30))}))
+    req = calendar_pb2.ListEventsReq(user_id=user_id, time_min=iso(now), time_max=iso(now + datetime.timedelta(days=1)))
+    req.read_mask.paths.extend(paths)
+
+    from_google = servicer.ListEvents(req, DummyContext())
+    assert server.onboarding.sync_one(user_id) == "synced"
+    google.calls = 0
+    from_store = servicer.ListEvents(req, DummyContext())
+
+    assert google.calls == 0  # answered locally
+    assert [e.is_out_of_office for e in from_google.events] == [True, True, False, False]
+    # Google's partial response may carry more than the mask asked for; the selected fields must agree
+    fields = paths or event_mapping.EVENT_FIELDS
+    assert ([[getattr(e, f) for f in fields] for e in from_store.events] ==
+            [[getattr(e, f) for f in fields] for e in from_google.events])
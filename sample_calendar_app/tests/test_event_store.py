@@ -0,0 +1,41 @@
+import datetime
+
+import pytest
+
+import db
+import event_store
+
+@pytest.fixture
+def session():
+    db.init_db()
+    with db.session_scope() as session:
+        yield session
+        session.rollback()
+
+def test_busy_intervals_skip_transparent_events(session):
+    event_store.apply_changes(session, "busy-u1", "primary", [
+        # all-day "working from home" marker, shown as available
+        {"id": "wfh", "summary": "WFH", "start": {"date": "2030-01-01"}, "end": {"date": "2030-01-02"},
+         "transparency": "transparent"},
+        {"id": "meeting", "summary": "1:1", "start": {"dateTime": "2030-01-01T10:00:00Z"},
+         "end": {"dateTime": "2030-01-01T11:00:00Z"}, "transparency": "opaque"},
+        {"id": "lunch", "summary": "lunch", "start": {"dateTime": "2030-01-01T12:00:00Z"},
+         "end": {"dateTime": "2030-01-01T13:00:00Z"}},
+    ])
+    session.flush()
+    busy = event_store.busy_intervals(session, "busy-u1", "2030-01-01T00:00:00Z", "2030-01-02T00:00:00Z")
+    assert busy == [(datetime.datetime(2030, 1, 1, 10), datetime.datetime(2030, 1, 1, 11)),
+                    (datetime.datetime(2030, 1, 1, 12), datetime.datetime(2030, 1, 1, 13))]
+    # still listed, only not busy
+    assert len(event_store.query_range(session, "busy-u1", "2030-01-01T00:00:00Z", "2030-01-02T00:00:00Z")) == 3
+
+def test_event_made_opaque_becomes_busy(session):
+    item = {"id": "e1", "start": {"dateTime": "2030-01-01T10:00:00Z"}, "end": {"dateTime": "2030-01-01T11:00:00Z"},
+            "transparency": "transparent"}
+    event_store.apply_changes(session, "busy-u2", "primary", [item])
+    session.flush()
+    assert event_store.busy_intervals(session, "busy-u2", "2030-01-01T00:00:00Z", "2030-01-02T00:00:00Z") == []
+    event_store.apply_changes(session, "busy-u2", "primary", [dict(item, transparency="opaque")])
+    session.flush()
+    assert event_store.busy_intervals(session, "busy-u2", "2030-01-01T00:00:00Z", "2030-01-02T00:00:00Z") == [
+        (datetime.datetime(2030, 1, 1, 10), datetime.datetime(2030, 1, 1, 11))]
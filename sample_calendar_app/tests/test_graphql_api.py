@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import sys
+import types
+from concurrent import futures
+from urllib.parse import parse_qs, urlparse
+
+import grpc
+import pytest
+
+import calendar_pb2
+import calendar_pb2_grpc
+import event_store
+import server
+
+# graphql_api imports the generated code under the names it is deployed with
+sys.modules.setdefault("server_stub", calendar_pb2_grpc)
+sys.modules.setdefault("google_protos", types.SimpleNamespace(calendar_pb2=calendar_pb2))
+import graphql_api
+from graphql_cache import EventsCache
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+@pytest.fixture
+def grpc_target(servicer):
+    """The thread-pool CalendarSync server on a free local port, in front of the fake Google."""
+    srv = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    calendar_pb2_grpc.add_CalendarSyncServicer_to_server(servicer, srv)
+    port = srv.add_insecure_port("localhost:0")
+    srv.start()
+    yield "localhost:%d" % port
+    srv.stop(None)
+
+@pytest.fixture
+def gateway(grpc_target, monkeypatch):
+    """execute(query, **variables) -> ExecutionResult, over a fresh channel pool and cache."""
+    monkeypatch.setattr(graphql_api, "pool", graphql_api.ChannelPool(target=grpc_target, size=2))
+    monkeypatch.setattr(graphql_api, "events_cache", EventsCache())
+    monkeypatch.setattr(graphql_api, "GRAPHQL_CACHE_CHANGE_FEED", False)  # the feed is tested on its own
+
+    def execute(query, **variables):
+        async def run():
+            try:
+                return await graphql_api.schema.execute(query, variable_values=variables)
+            finally:
+                await graphql_api.pool.close()
+        return asyncio.run(run())
+    return execute
+
+@pytest.fixture
+def window(google):
+    start = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(hours=1)
+    for i in range(2):
+        google.add_event("primary", {"summary": "e%d" % i, "description": "about e%d" % i,
+                                     "start": {"dateTime": iso(start + datetime.timedelta(hours=i))},
+                                     "end": {"dateTime": iso(start + datetime.timedelta(hours=i, minutes=30))}})
+    return iso(start - datetime.timedelta(hours=1)), iso(start + datetime.timedelta(days=1))
+
+LIST_TITLES = """
+query($user: String!, $min: String, $max: String) { listEvents(userId: $user, timeMin: $min, timeMax: $max) { id title } }
+"""
+
+def titles(result):
+    assert not result.errors, result.errors
+    return [e["title"] for e in result.data["listEvents"]]
+
+def test_list_events_is_cached_until_a_mutation(gateway, user_id, window):
+    first = gateway(LIST_TITLES, user=user_id, min=window[0], max=window[1])
+    again = gateway(LIST_TITLES, user=user_id, min=window[0], max=window[1])
+    assert titles(first) == titles(again) == ["e0", "e1"]
+    assert (first.extensions["backendRpcs"], first.extensions["cacheHits"]) == (1, 0)
+    assert (again.extensions["backendRpcs"], again.extensions["cacheHits"]) == (0, 1)
+
+    event_id = first.data["listEvents"][0]["id"]
+    updated = gateway("mutation($user: String!, $id: String!) { updateEvent(userId: $user, eventId: $id, title: \"retro\") { id } }",
+                      user=user_id, id=event_id)
+    assert not updated.errors, updated.errors
+
+    after = gateway(LIST_TITLES, user=user_id, min=window[0], max=window[1])
+    assert sorted(titles(after)) == ["e1", "retro"]
+    assert after.extensions["backendRpcs"] == 1
+
+class FeedCall:
+    """A SubscribeChanges call: refused, or a stream of `steps` (ChangeBatch messages, or callables run in between)."""
+    def __init__(self, refused=False, steps=()):
+        self.refused = refused
+        self.steps = list(steps)
+
+    async def initial_metadata(self):
+        if self.refused:
+            raise grpc.aio.AioRpcError(grpc.StatusCode.RESOURCE_EXHAUSTED, None, None, "too many change streams")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.steps:
+            step = self.steps.pop(0)
+            if not callable(step):
+                return step
+            step()
+        raise StopAsyncIteration  # the server ends the stream
+
+    def cancel(self):
+        pass
+
+def test_change_feed_backs_off_while_refused(monkeypatch):
+    outcomes = iter([True, True, True, False, True, True])
+    stub = types.SimpleNamespace(SubscribeChanges=lambda req: FeedCall(next(outcomes)))
+    monkeypatch.setattr(graphql_api, "pool", types.SimpleNamespace(stub=lambda: stub))
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+        if len(delays) == 6:
+            raise asyncio.CancelledError
+    monkeypatch.setattr(graphql_api.asyncio, "sleep", sleep)
+
+    feed = graphql_api.ChangeFeed(EventsCache(), retry_seconds=1, retry_max_seconds=4)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(feed._run())
+    assert delays == [1, 2, 4, 1, 2, 4]  # doubled up to the max, reset by the successful connect
+
+def test_change_feed_invalidates_synced_users(monkeypatch):
+    cache = EventsCache()
+    keys = [("synced", "", "", ()), ("other", "", "", ())]
+    live = {}
+
+    def fill():
+        for key in keys:
+            cache.put(key, (), ["events of %s" % key[0]], cache.generation(key[0]))
+
+    def check():
+        # still connected: only the pushed user's windows are gone
+        live.update((key[0], cache.get(key, ())) for key in keys)
+    call = FeedCall(steps=[fill, calendar_pb2.ChangeBatch(user_id="synced"), check])
+    monkeypatch.setattr(graphql_api, "pool", types.SimpleNamespace(stub=lambda: types.SimpleNamespace(
+        SubscribeChanges=lambda req: call)))
+
+    async def sleep(seconds):
+        raise asyncio.CancelledError
+    monkeypatch.setattr(graphql_api.asyncio, "sleep", sleep)
+
+    cache.suspend()  # as ChangeFeed leaves it until the stream is up
+    feed = graphql_api.ChangeFeed(cache)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(feed._run())
+    assert live == {"synced": None, "other": ["events of other"]}
+    assert cache.suspended  # the stream ended: nothing is answered from the cache until it is back
+
+def test_lookups_of_one_operation_share_one_batch_rpc(gateway, user_id, window):
+    narrow = (window[0], window[0][:11] + "23:59:59Z")
+    result = gateway("""
+        query($user: String!, $min: String, $max: String, $narrowMax: String) {
+            all: listEvents(userId: $user, timeMin: $min, timeMax: $max) { title }
+            same: listEvents(userId: $user, timeMin: $min, timeMax: $max) { title }
+            narrow: listEvents(userId: $user, timeMin: $min, timeMax: $narrowMax) { title }
+        }""", user=user_id, min=window[0], max=window[1], narrowMax=narrow[1])
+    assert not result.errors, result.errors
+    assert [e["title"] for e in result.data["all"]] == ["e0", "e1"]
+    assert result.data["same"] == result.data["all"]
+    assert result.extensions["backendRpcs"] == 1  # one BatchListEvents for both distinct windows
+
+def test_queries_run_with_a_deadline(gateway, google, user_id, window, monkeypatch):
+    monkeypatch.setattr(graphql_api, "QUERY_TIMEOUT_SECONDS", 0.1)
+    google.latency = 0.5
+    result = gateway(LIST_TITLES, user=user_id, min=window[0], max=window[1])
+    assert result.errors and "DEADLINE_EXCEEDED" in result.errors[0].message
+
+def test_channel_pool_round_robins_per_event_loop():
+    pool = graphql_api.ChannelPool(target="localhost:1", size=2)
+
+    async def stubs():
+        try:
+            picked = [pool.stub() for _ in range(4)]
+            return picked, pool._by_loop[asyncio.get_running_loop()][0]
+        finally:
+            await pool.close()
+    first, first_channels = asyncio.run(stubs())
+    second, second_channels = asyncio.run(stubs())
+
+    assert first[0] is first[2] and first[1] is first[3] and first[0] is not first[1]
+    assert len(first_channels) == 2
+    assert not set(map(id, first_channels)) & set(map(id, second_channels))  # aio channels are bound to their loop
+
+FRAGMENT_QUERY = """
+query($user: String!, $min: String, $max: String) { listEvents(userId: $user, timeMin: $min, timeMax: $max) { id ...Named } }
+fragment Named on Event { title }
+"""
+
+def test_selected_fields_are_pushed_down_to_google(gateway, google, user_id, window, monkeypatch):
+    asked = []
+    dispatch = google.dispatch
+
+    def record(method, uri, body, headers=None):
+        asked.extend(parse_qs(urlparse(uri).query).get("fields", []))
+        return dispatch(method, uri, body, headers)
+    monkeypatch.setattr(google, "dispatch", record)
+
+    result = gateway(FRAGMENT_QUERY, user=user_id, min=window[0], max=window[1])
+    assert not result.errors, result.errors
+    assert asked == ["nextPageToken,items(id,summary)"]
+    assert [sorted(e) for e in result.data["listEvents"]] == [["id", "title"]] * 2
+
+def test_selected_fields_are_pushed_down_to_the_event_store(gateway, user_id, window, monkeypatch):
+    assert server.onboarding.sync_one(user_id) == "synced"
+    loaded = []
+    query_range = event_store.query_range
+
+    def record(session, user_id, time_min, time_max, columns=None):
+        loaded.append(columns)
+        return query_range(session, user_id, time_min, time_max, columns)
+    monkeypatch.setattr(event_store, "query_range", record)
+
+    result = gateway(FRAGMENT_QUERY, user=user_id, min=window[0], max=window[1])
+    assert [e["title"] for e in result.data["listEvents"]] == ["e0", "e1"]
+    assert loaded == [["event_id", "start_time", "title"]]
+
+def test_cached_window_answers_queries_for_fewer_fields(gateway, user_id, window):
+    wide = gateway("query($user: String!, $min: String, $max: String) "
+                   "{ listEvents(userId: $user, timeMin: $min, timeMax: $max) { id title description } }",
+                   user=user_id, min=window[0], max=window[1])
+    narrower = gateway(LIST_TITLES, user=user_id, min=window[0], max=window[1])
+    wider = gateway("query($user: String!, $min: String, $max: String) "
+                    "{ listEvents(userId: $user, timeMin: $min, timeMax: $max) { title start } }",
+                    user=user_id, min=window[0], max=window[1])
+    assert [e["description"] for e in wide.data["listEvents"]] == ["about e0", "about e1"]
+    assert titles(narrower) == titles(wider) == ["e0", "e1"]
+    assert narrower.extensions["cacheHits"] == 1
+    assert (wider.extensions["cacheHits"], wider.extensions["backendRpcs"]) == (0, 1)  # start was not fetched
@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+
+import pytest
+
+import calendar_pb2
+import interval_index
+import server
+from db import session_scope
+from fake_google import DummyContext
+from models import CalendarEvent, UserCalendar
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+@pytest.fixture
+def day():
+    return datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+
+@pytest.fixture
+def synced_user(google, user_id, day):
+    # busy 09:00-10:00 and 10:30-11:00
+    for start, minutes in [(day.replace(hour=9), 60), (day.replace(hour=10, minute=30), 30)]:
+        google.add_event("primary", {"summary": "busy", "start": {"dateTime": iso(start)},
+                                     "end": {"dateTime": iso(start + datetime.timedelta(minutes=minutes))}})
+    assert server.onboarding.sync_one(user_id) == "synced"
+    return user_id
+
+def test_find_overlaps(servicer, synced_user, day):
+    resp = servicer.FindOverlaps(calendar_pb2.FindOverlapsReq(
+        user_id=synced_user, start_iso=iso(day.replace(hour=9, minute=30)), end_iso=iso(day.replace(hour=10, minute=45))),
+        DummyContext())
+    assert [e.start for e in resp.events] == [iso(day.replace(hour=9)), iso(day.replace(hour=10, minute=30))]
+
+def test_find_free_slot(servicer, synced_user, day):
+    slot = servicer.FindFreeSlot(calendar_pb2.FindFreeSlotReq(
+        user_id=synced_user, time_min=iso(day.replace(hour=9)), time_max=iso(day.replace(hour=12)), duration_minutes=45),
+        DummyContext())
+    assert slot.found and slot.start == iso(day.replace(hour=11))
+
+@pytest.mark.parametrize("bounds", [("not-a-time", "2030-01-02T00:00:00Z"), ("2030-01-01T00:00:00Z", "2030-13-01")])
+def test_malformed_bounds_are_invalid_argument(servicer, synced_user, bounds):
+    start, end = bounds
+    calls = [
+        lambda: servicer.FindOverlaps(calendar_pb2.FindOverlapsReq(user_id=synced_user, start_iso=start, end_iso=end),
+                                      DummyContext()),
+        lambda: servicer.FindFreeSlot(calendar_pb2.FindFreeSlotReq(user_id=synced_user, time_min=start, time_max=end,
+                                                                   duration_minutes=30), DummyContext()),
+        lambda: servicer.ListEvents(calendar_pb2.ListEventsReq(user_id=synced_user, time_min=start, time_max=end),
+                                    DummyContext()),
+        lambda: list(servicer.StreamEvents(calendar_pb2.ListEventsReq(user_id=synced_user, time_min=start, time_max=end),
+                                           DummyContext())),
+        lambda: servicer.QueryFreeBusy(calendar_pb2.FreeBusyReq(user_ids=[synced_user], time_min=start, time_max=end),
+                                       DummyContext()),
+    ]
+    for call in calls:
+        with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: time bounds must be RFC3339 timestamps"):
+            call()
+
+def test_aio_malformed_bounds_are_invalid_argument(synced_user):
+    import aio_server
+    servicer = aio_server.AsyncCalendarSyncServicer()
+    req = calendar_pb2.FindOverlapsReq(user_id=synced_user, start_iso="not-a-time", end_iso="2030-01-02T00:00:00Z")
+    with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: time bounds must be RFC3339 timestamps"):
+        asyncio.run(servicer.FindOverlaps(req, DummyContext()))
+
+def test_opt_out_drops_synced_events_and_index(servicer, synced_user, day):
+    req = calendar_pb2.FindOverlapsReq(user_id=synced_user, start_iso=iso(day), end_iso=iso(day + datetime.timedelta(days=1)))
+    assert len(servicer.FindOverlaps(req, DummyContext()).events) == 2
+    assert synced_user in interval_index.registry._indexes
+
+    servicer.OptOut(calendar_pb2.UserId(user_id=synced_user), None)
+
+    with session_scope() as session:
+        assert session.query(CalendarEvent).filter_by(user_id=synced_user).count() == 0
+        u = session.query(UserCalendar).filter_by(user_id=synced_user).first()
+        assert (u.sync_token, u.sync_page_token, u.synced_from, u.is_synced) == (None, None, None, False)
+    assert synced_user not in interval_index.registry._indexes
+    with pytest.raises(RuntimeError, match="FAILED_PRECONDITION"):
+        servicer.FindOverlaps(req, DummyContext())
@@ -0,0 +1,60 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import calendar_pb2
+import event_store
+from fake_google import DummyContext
+
+def test_cursor_round_trip():
+    row = type("Row", (), {"start_time": datetime.datetime(2030, 1, 1, 10), "event_id": "e1"})()
+    assert event_store.decode_cursor(event_store.encode_cursor(row)) == (datetime.datetime(2030, 1, 1, 10), "e1")
+
+@pytest.mark.parametrize("token", [
+    "!!!",                   # not base64
+    "bm9waXBl",              # "nopipe": no event id
+    "fA==",                  # "|": empty event id
+    "bm90LWEtZGF0ZXxlMQ==",  # "not-a-date|e1"
+    "_w==",                  # not UTF-8
+])
+def test_decode_cursor_rejects_malformed_tokens(token):
+    with pytest.raises(ValueError):
+        event_store.decode_cursor(token)
+
+@pytest.mark.parametrize("page_token", ["local:!!!", "local:", "local:bm9waXBl", "elsewhere:abc", "garbage"])
+def test_list_events_rejects_bad_page_token(servicer, user_id, page_token):
+    req = calendar_pb2.ListEventsReq(user_id=user_id, page_size=10, page_token=page_token)
+    with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: bad page_token"):
+        servicer.ListEvents(req, DummyContext())
+    with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: bad page_token"):
+        list(servicer.StreamEvents(req, DummyContext()))
+
+def test_batch_list_events_reports_bad_page_token_per_request(servicer, user_id):
+    resp = servicer.BatchListEvents(calendar_pb2.BatchListEventsReq(requests=[
+        calendar_pb2.ListEventsReq(user_id=user_id, page_size=10, page_token="local:!!!"),
+        calendar_pb2.ListEventsReq(user_id=user_id, page_size=10)]), DummyContext())
+    assert resp.results[0].error == "bad page_token"
+    assert not resp.results[1].error
+
+def test_negative_page_size_is_rejected(servicer, user_id):
+    req = calendar_pb2.ListEventsReq(user_id=user_id, page_size=-2)
+    with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: page_size must not be negative"):
+        servicer.ListEvents(req, DummyContext())
+    with pytest.raises(RuntimeError, match="INVALID_ARGUMENT: page_size must not be negative"):
+        list(servicer.StreamEvents(req, DummyContext()))
+
+def test_page_size_is_capped_at_googles_maximum(servicer, user_id, google, monkeypatch):
+    sent = []
+    dispatch = google.dispatch
+
+    def record(method, uri, body, headers=None):
+        sent.extend(parse_qs(urlparse(uri).query).get("maxResults", []))
+        return dispatch(method, uri, body, headers)
+    monkeypatch.setattr(google, "dispatch", record)
+
+    req = calendar_pb2.ListEventsReq(user_id=user_id, time_min="2030-01-01T00:00:00Z",
+                                     time_max="2030-01-02T00:00:00Z", page_size=100000)
+    servicer.ListEvents(req, DummyContext())
+    list(servicer.StreamEvents(req, DummyContext()))
+    assert sent == ["2500", "2500"]
@@ -0,0 +1,119 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+import calendar_pb2
+import change_bus
+import server
+from db import session_scope
+from fake_google import DummyContext
+from models import UserCalendar
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+def add_event(google, title, hours=1):
+    start = datetime.datetime.utcnow() + datetime.timedelta(hours=hours)
+    return google.add_event("primary", {"summary": title, "start": {"dateTime": iso(start)},
+                                        "end": {"dateTime": iso(start + datetime.timedelta(minutes=30))}})
+
+def load_user(user_id):
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        session.expunge(u)
+        return u
+
+def test_expired_sync_token_is_handed_to_onboarding(google, servicer, user_id, monkeypatch):
+    add_event(google, "before")
+    assert server.onboarding.sync_one(user_id) == "synced"
+    dispatch = google.dispatch
+
+    def gone_for_sync_tokens(method, uri, body, headers=None):
+        if "syncToken=" in uri:
+            return 410, {"error": {"code": 410, "message": "Sync token is no longer valid"}}
+        return dispatch(method, uri, body, headers)
+    monkeypatch.setattr(google, "dispatch", gone_for_sync_tokens)
+    queued = []
+    monkeypatch.setattr(server.onboarding, "submit", queued.append)
+    google.calls = 0
+
+    servicer.HandlePushNotification(calendar_pb2.UserId(user_id=user_id), None)
+
+    assert google.calls == 1  # the 410 only, no full sync inside the handler
+    assert queued == [user_id]
+    u = load_user(user_id)
+    assert (u.sync_token, u.sync_page_token, u.is_synced) == (None, None, False)
+
+    monkeypatch.setattr(google, "dispatch", dispatch)
+    add_event(google, "after", hours=2)
+    assert server.onboarding.sync_one(user_id) == "synced"
+    assert load_user(user_id).is_synced
+
+class Collector(change_bus.Subscriber):
+    def __init__(self, user_ids):
+        super().__init__(user_ids)
+        self.changes = []
+
+    def deliver(self, batch, timeout):
+        self.changes.extend((c.kind, c.event["summary"] if c.kind != "deleted" else c.event_id) for c in batch.changes)
+
+@pytest.fixture
+def collector(user_id):
+    sub = change_bus.bus.subscribe(Collector([user_id]))
+    yield sub
+    change_bus.bus.unsubscribe(sub)
+
+def test_event_created_through_the_api_is_published_as_created(google, servicer, user_id, collector):
+    assert server.onboarding.sync_one(user_id) == "synced"
+    start = datetime.datetime.utcnow() + datetime.timedelta(hours=3)
+    created = servicer.CreateEvent(calendar_pb2.CreateEventReq(
+        user_id=user_id, title="standup", start_iso=iso(start), end_iso=iso(start + datetime.timedelta(minutes=15))),
+        DummyContext())
+    add_event(google, "from google")
+
+    servicer.HandlePushNotification(calendar_pb2.UserId(user_id=user_id), None)
+    assert sorted(collector.changes) == [("created", "from google"), ("created", "standup")]
+
+    servicer.UpdateEvent(calendar_pb2.UpdateEventReq(user_id=user_id, event_id=created.id, title="standup v2"),
+                         DummyContext())
+    servicer.HandlePushNotification(calendar_pb2.UserId(user_id=user_id), None)
+    assert collector.changes[2:] == [("updated", "standup v2")]
+
+def test_first_sync_publishes_created_events(google, user_id, collector):
+    add_event(google, "a")
+    add_event(google, "b", hours=2)
+    assert server.onboarding.sync_one(user_id) == "synced"
+    assert sorted(collector.changes) == [("created", "a"), ("created", "b")]
+
+def test_push_syncs_of_one_user_are_serialized(google, servicer, monkeypatch):
+    user_ids = []
+    for _ in range(2):
+        user_ids.append("test-user-locks-%d" % len(user_ids))
+        servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_ids[-1], access_token="at", refresh_token="rt",
+                                                      expiry_epoch=int(time.time()) + 3600), None)
+        assert server.onboarding.sync_one(user_ids[-1]) == "synced"
+    lock = threading.Lock()
+    in_flight, peak = {}, {}
+
+    def sync_pages(session, u, svc, **kw):
+        with lock:
+            in_flight[u.user_id] = in_flight.get(u.user_id, 0) + 1
+            peak[u.user_id] = max(peak.get(u.user_id, 0), in_flight[u.user_id])
+            peak["all"] = max(peak.get("all", 0), sum(in_flight.values()))
+        time.sleep(0.05)
+        with lock:
+            in_flight[u.user_id] -= 1
+        return iter(())
+    monkeypatch.setattr(server.sync_engine, "sync_pages", sync_pages)
+
+    threads = [threading.Thread(target=server.push_sync, args=(user_id,)) for user_id in user_ids * 3]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak[user_ids[0]] == peak[user_ids[1]] == 1
+    assert peak["all"] == 2  # different users still sync in parallel
+    assert not server._push_locks._locks
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock.sleep(seconds)
+
+    async def async_sleep(seconds):
+        sleep(seconds)
+    monkeypatch.setattr(rate_limit.time, "sleep", sleep)
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", async_sleep)
+    clock.slept = slept
+    return clock
+
+def test_bucket_starts_full_and_refills_at_rate(clock):
+    bucket = TokenBucket(rate=4, burst=5, clock=clock)
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    clock.now += 0.75  # 3 tokens back
+    assert [bucket.reserve() for _ in range(3)] == [0.0] * 3
+    assert bucket.reserve() == pytest.approx(0.25)
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=10, burst=5, clock=clock)
+    bucket.reserve(5)
+    clock.now += 3600
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    assert bucket.reserve() == pytest.approx(0.1)
+
+def test_reserve_never_blocks_and_queues_in_order(clock):
+    # the non-blocking side: reserve() takes the tokens at once and says how long to wait
+    bucket = TokenBucket(rate=10, burst=1, clock=clock)
+    delays = [bucket.reserve() for _ in range(4)]
+    assert delays == pytest.approx([0.0, 0.1, 0.2, 0.3])
+    assert clock.slept == []
+    assert bucket.reserve(cost=5) == pytest.approx(0.8)
+
+def test_pause_holds_new_reservations(clock):
+    bucket = TokenBucket(rate=10, burst=5, clock=clock)
+    bucket.pause(2.0)
+    assert bucket.reserve() == pytest.approx(2.1)
+    clock.now += 2.1
+    assert bucket.reserve() == pytest.approx(0.1)
+
+def test_call_blocks_until_its_tokens_are_available(clock):
+    limiter = RateLimiter(project_qps=100, project_burst=100, user_qps=2, user_burst=2, clock=clock)
+    ok = lambda result: (None, None)
+    assert [limiter.call("u1", lambda: "r", ok) for _ in range(4)] == ["r"] * 4
+    # two calls fit the user's burst, the next two wait for the user bucket (2/s)
+    assert clock.slept == pytest.approx([0.5, 0.5])
+    assert limiter.call("u2", lambda: "r", ok) == "r"  # another user isn't held back
+    assert len(clock.slept) == 2
+    stats = limiter.stats()
+    assert (stats["calls"], stats["queued"], stats["waiting"]) == (5, 2, 0)
+
+def test_acall_waits_without_blocking_the_loop(clock):
+    limiter = RateLimiter(project_qps=1, project_burst=1, user_qps=100, user_burst=100, clock=clock)
+
+    async def fetch():
+        return "r"
+
+    async def run():
+        return [await limiter.acall(None, fetch, lambda result: (None, None)) for _ in range(3)]
+    assert asyncio.run(run()) == ["r"] * 3
+    assert clock.slept == pytest.approx([1.0, 1.0])
+
+def test_quota_error_backoff_is_jittered_and_capped(clock, monkeypatch):
+    limiter = RateLimiter(project_qps=1000, project_burst=1000, max_retries=3, backoff_base=0.5,
+                          backoff_max=1.5, clock=clock)
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda lo, hi: hi)  # worst case of the jitter
+    results = iter(["throttled"] * 5)
+    classify = lambda result: ("rateLimitExceeded", None) if result == "throttled" else (None, None)
+    assert limiter.call(None, lambda: next(results), classify) == "throttled"
+    # pauses 0.5, 1.0, then capped at 1.5; the fourth error is returned
+    assert sum(clock.slept) == pytest.approx(0.5 + 1.0 + 1.5, abs=0.01)
+    stats = limiter.stats()
+    assert (stats["throttled"], stats["retries"], stats["gave_up"]) == (4, 3, 1)
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+import calendar_pb2
+import server
+
+class StreamContext:
+    def __init__(self):
+        self.callbacks = []
+        self.subscribed = threading.Event()
+
+    def add_callback(self, fn):
+        self.callbacks.append(fn)
+
+    def send_initial_metadata(self, metadata):
+        self.subscribed.set()
+
+    def abort(self, code, details):
+        raise RuntimeError("%s: %s" % (code, details))
+
+    def cancel(self):
+        # what grpc does when the client goes away
+        for fn in self.callbacks:
+            fn()
+
+def open_stream(servicer):
+    context = StreamContext()
+    stream = servicer.SubscribeChanges(calendar_pb2.SubscribeChangesReq(user_ids=["nobody"]), context)
+    thread = threading.Thread(target=list, args=(stream,))
+    thread.start()
+    assert context.subscribed.wait(5)
+    return context, thread
+
+def test_thread_server_caps_change_streams(servicer, monkeypatch):
+    monkeypatch.setattr(server, "change_stream_slots", threading.BoundedSemaphore(2))
+    streams = [open_stream(servicer) for _ in range(2)]
+
+    with pytest.raises(RuntimeError, match="RESOURCE_EXHAUSTED"):
+        next(servicer.SubscribeChanges(calendar_pb2.SubscribeChangesReq(), StreamContext()))
+
+    context, thread = streams.pop()
+    context.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    streams.append(open_stream(servicer))  # the slot was given back
+    for context, thread in streams:
+        context.cancel()
+        thread.join(5)
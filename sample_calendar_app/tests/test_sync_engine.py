@@ -0,0 +1,51 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import server
+import sync_engine
+from db import session_scope
+from models import CalendarEvent, UserCalendar
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+def test_interrupted_sync_resumes_at_the_checkpointed_page(google, user_id, monkeypatch):
+    start = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    for i in range(5):
+        google.add_event("primary", {"summary": "e%d" % i, "start": {"dateTime": iso(start + datetime.timedelta(hours=i))},
+                                     "end": {"dateTime": iso(start + datetime.timedelta(hours=i, minutes=30))}})
+    dispatch = google.dispatch
+    requested = []  # pageToken of every events().list call ("" for the first page)
+    fail = True
+
+    def failing_third_page(method, uri, body, headers=None):
+        page_token = parse_qs(urlparse(uri).query).get("pageToken", [""])[0]
+        requested.append(page_token)
+        if page_token == "4" and fail:
+            return 500, {"error": {"code": 500, "message": "Backend Error"}}
+        return dispatch(method, uri, body, headers)
+    monkeypatch.setattr(google, "dispatch", failing_third_page)
+
+    seen = []
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        with pytest.raises(HttpError):
+            for changes in sync_engine.sync_pages(session, u, server.get_service(u), page_size=2):
+                seen.extend(item["summary"] for _, item in changes)
+    assert seen == ["e0", "e1", "e2", "e3"]
+    assert requested == ["", "2", "4"]
+
+    fail = False
+    del seen[:], requested[:]
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        assert (u.sync_page_token, u.is_synced) == ("4", False)
+        for changes in sync_engine.sync_pages(session, u, server.get_service(u), page_size=2):
+            seen.extend(item["summary"] for _, item in changes)
+        assert u.is_synced and u.sync_token and u.sync_page_token is None
+        assert session.query(CalendarEvent).filter_by(user_id=user_id).count() == 5
+    assert seen == ["e4"]  # only the page that failed, not a restart from the first page
+    assert requested == ["4"]
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from sync_scheduler import SyncScheduler
+
+class Recorder:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+        self.done = threading.Semaphore(0)
+
+    def __call__(self, user_id):
+        self.calls.append(user_id)
+        self.done.release()
+        if user_id in self.fail:
+            raise RuntimeError("sync failed")
+
+    def wait(self, n):
+        for _ in range(n):
+            assert self.done.acquire(timeout=5)
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(sync_fn, **kwargs):
+        kwargs.setdefault("debounce", 0.05)
+        schedulers.append(SyncScheduler(sync_fn, **kwargs))
+        return schedulers[-1]
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+def test_notifications_within_window_coalesce(make_scheduler):
+    sync = Recorder()
+    scheduler = make_scheduler(sync)
+    for _ in range(5):
+        scheduler.notify("u1")
+    sync.wait(1)
+    time.sleep(0.1)
+    assert sync.calls == ["u1"]
+    assert scheduler.stats()["coalesced"] == 4
+    assert scheduler.stats()["coalesce_ratio"] == 5.0
+
+def test_users_run_in_due_order(make_scheduler):
+    sync = Recorder()
+    scheduler = make_scheduler(sync, max_workers=1)
+    for user_id in ("u3", "u1", "u2"):
+        scheduler.notify(user_id)
+        time.sleep(0.01)
+    sync.wait(3)
+    assert sync.calls == ["u3", "u1", "u2"]
+
+@pytest.mark.parametrize("attempt,rand,expected", [
+    (0, 0.0, 1.0),
+    (0, 1.0, 0.5),
+    (3, 0.0, 8.0),
+    (3, 1.0, 4.0),
+    (10, 0.0, 60.0),  # capped at backoff_max
+    (10, 1.0, 30.0),
+])
+def test_retry_delay_limits(make_scheduler, attempt, rand, expected):
+    scheduler = make_scheduler(Recorder(), backoff_base=1.0, backoff_max=60.0, rand=lambda: rand)
+    assert scheduler.retry_delay(attempt) == expected
+
+def test_retry_delay_stays_in_jitter_range(make_scheduler):
+    scheduler = make_scheduler(Recorder(), backoff_base=1.0, backoff_max=60.0)
+    for attempt in range(12):
+        cap = min(60.0, 2.0 ** attempt)
+        assert cap / 2 <= scheduler.retry_delay(attempt) <= cap
+
+def test_failed_sync_is_retried_then_given_up(make_scheduler):
+    sync = Recorder(fail={"u1"})
+    scheduler = make_scheduler(sync, max_retries=2, backoff_base=0.01, backoff_max=0.01)
+    scheduler.notify("u1")
+    sync.wait(3)
+    time.sleep(0.1)
+    assert sync.calls == ["u1"] * 3
+    stats = scheduler.stats()
+    assert (stats["syncs_failed"], stats["retried"], stats["queue_depth"]) == (3, 2, 0)
+
+def test_opted_out_users_are_skipped(make_scheduler):
+    sync = Recorder()
+    opted_out = {"gone"}
+    scheduler = make_scheduler(sync, should_sync=lambda user_id: user_id not in opted_out)
+    scheduler.notify("gone")
+    scheduler.notify("here")
+    sync.wait(1)
+    time.sleep(0.1)
+    assert sync.calls == ["here"]
+    assert scheduler.stats()["skipped"] == 1
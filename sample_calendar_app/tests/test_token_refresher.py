@@ -0,0 +1,50 @@
+import datetime
+
+import calendar_pb2
+import token_refresher
+from db import session_scope
+from models import UserCalendar
+
+def row_of(user_id):
+    with session_scope() as session:
+        u = session.query(UserCalendar).filter_by(user_id=user_id).first()
+        return u.opted_out, u.refresh_token, u.access_token
+
+def make_refresher(refresh_fn):
+    return token_refresher.TokenRefresher("id", "secret", refresh_fn=refresh_fn, ahead_seconds=7200)
+
+def test_refresh_is_written_back(user_id):
+    refresher = make_refresher(lambda refresh_token, *_: ("fresh-token", datetime.datetime.utcnow()))
+    try:
+        assert refresher.run_once() >= 1
+    finally:
+        refresher.stop()
+    assert row_of(user_id) == (False, "rt", "fresh-token")
+
+def test_opt_out_during_refresh_keeps_the_row_cleared(servicer, user_id):
+    def refresh(refresh_token, *_):
+        servicer.OptOut(calendar_pb2.UserId(user_id=user_id), None)  # lands while the refresh is in flight
+        return "fresh-token", datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    refresher = make_refresher(refresh)
+    try:
+        refresher.run_once()
+    finally:
+        refresher.stop()
+    assert row_of(user_id) == (True, None, None)
+
+def test_new_tokens_during_refresh_are_not_overwritten(servicer, user_id):
+    def refresh(refresh_token, *_):
+        servicer.StoreTokens(calendar_pb2.OAuthTokens(user_id=user_id, access_token="new-at", refresh_token="new-rt",
+                                                      expiry_epoch=0), None)
+        return "fresh-token", datetime.datetime.utcnow()
+    refresher = make_refresher(refresh)
+    try:
+        refresher.run_once()
+    finally:
+        refresher.stop()
+    assert row_of(user_id) == (False, "new-rt", "new-at")
+
+def test_request_path_refresh_after_opt_out_is_dropped(servicer, user_id):
+    servicer.OptOut(calendar_pb2.UserId(user_id=user_id), None)
+    assert not token_refresher.persist_token(user_id, "rt", "fresh-token", datetime.datetime.utcnow())
+    assert row_of(user_id) == (True, None, None)
@@ -0,0 +1,53 @@
+import datetime
+
+import pytest
+
+import calendar_pb2
+import event_store
+import server
+from db import session_scope
+from fake_google import DummyContext
+
+def iso(dt):
+    return dt.isoformat() + "Z"
+
+@pytest.fixture
+def event(google, user_id):
+    start = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    event = google.add_event("primary", {"summary": "standup", "start": {"dateTime": iso(start)},
+                                         "end": {"dateTime": iso(start + datetime.timedelta(minutes=30))}})
+    assert server.onboarding.sync_one(user_id) == "synced"
+    return event
+
+def stored_etag(user_id, event_id):
+    with session_scope() as session:
+        return event_store.get_etag(session, user_id, event_id)
+
+def test_update_uses_the_stored_etag(google, servicer, user_id, event):
+    assert stored_etag(user_id, event["id"]) == event["etag"]
+
+    resp = servicer.UpdateEvent(calendar_pb2.UpdateEventReq(user_id=user_id, event_id=event["id"], title="retro"),
+                                DummyContext())
+
+    current = google.calendars["primary"][event["id"]]
+    assert resp.title == current["summary"] == "retro"
+    assert resp.etag == current["etag"] != event["etag"]
+    assert stored_etag(user_id, event["id"]) == current["etag"]  # written through for the next update
+
+def test_update_of_an_event_changed_elsewhere_is_aborted(google, servicer, user_id, event):
+    google.add_event("primary", dict(event, summary="moved by someone else", etag='"newer"'))
+
+    with pytest.raises(RuntimeError, match="ABORTED: conflict"):
+        servicer.UpdateEvent(calendar_pb2.UpdateEventReq(user_id=user_id, event_id=event["id"], title="retro"),
+                             DummyContext())
+    assert google.calendars["primary"][event["id"]]["summary"] == "moved by someone else"
+
+def test_request_etag_overrides_the_stored_one(google, servicer, user_id, event):
+    with pytest.raises(RuntimeError, match="ABORTED: conflict"):
+        servicer.UpdateEvent(calendar_pb2.UpdateEventReq(user_id=user_id, event_id=event["id"], title="retro",
+                                                         etag='"stale"'), DummyContext())
+
+    google.add_event("primary", dict(event, etag='"newer"'))
+    resp = servicer.UpdateEvent(calendar_pb2.UpdateEventReq(user_id=user_id, event_id=event["id"], title="retro",
+                                                            etag='"newer"'), DummyContext())
+    assert resp.title == "retro"
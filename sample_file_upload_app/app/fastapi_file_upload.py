@@ -7,6 +7,8 @@ import aiofiles
 import os
 from pathlib import Path
 import uuid
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -26,13 +28,15 @@ app.add_middleware(
 async def save_upload_file(upload_file: UploadFile, destination: Path, chunk_size: int = 1024*1024):
     """
     Save UploadFile.stream to disk in chunks.
-    This works for both sync and async file-like backends because UploadFile.file is BytesIO/spooled file.
+    UploadFile.read/seek run the spooled temp file's blocking calls in a thread.
+    Starlette has already written the whole upload to that temp file, so every byte hits the disk twice;
+    /upload/stream below avoids that.
     """
     async with aiofiles.open(destination, "wb") as out_file:
         # Seek to beginning
-        upload_file.file.seek(0)
+        await upload_file.seek(0)
         while True:
-            chunk = await upload_file.file.read(chunk_size)
+            chunk = await upload_file.read(chunk_size)
             if not chunk:
                 break
             await out_file.write(chunk)
@@ -90,6 +94,119 @@ async def upload_single_with_limit(file: UploadFile = File(...)):
     await save_upload_file(file, dest)
     return {"stored_as": dest.name, "size": dest.stat().st_size}
 
+# Streaming upload: the multipart body is parsed straight from request.stream() and every file
+# part is written to its destination as it arrives, with no UploadFile / SpooledTemporaryFile
+# in between (one disk write per byte instead of two). The size limit is checked per chunk,
+# so an oversized or chunked (no Content-Length) body is cut off as soon as it crosses it.
+STREAM_MAX_UPLOAD_BYTES = int(os.environ.get("STREAM_MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))  # 2 GB
+STREAM_CONTENT_TYPES = ("image/jpeg", "image/png", "application/pdf", "text/plain", "application/octet-stream")
+
+class _MultipartEvents:
+    """python-multipart callbacks are sync; they queue events that upload_stream then writes out with await."""
+
+    def __init__(self):
+        self.events = []
+        self._field = b""
+        self._value = b""
+        self._headers = {}
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def on_headers_finished(self):
+        self.events.append(("headers", self._headers))
+
+    def on_part_data(self, data, start, end):
+        # whole-chunk parts are passed on without slicing (no copy)
+        self.events.append(("data", data if start == 0 and end == len(data) else data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", None))
+
+def _stream_part_target(headers):
+    """(original filename, content type) of a file part, or None for a plain form field."""
+    _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+    filename = disposition.get(b"filename")
+    if filename is None:
+        return None
+    filename = filename.decode("utf-8", "replace")
+    content_type = headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+    if not filename:
+        raise HTTPException(400, "Empty filename")
+    if content_type not in STREAM_CONTENT_TYPES:
+        raise HTTPException(400, f"Unsupported content type: {content_type}")
+    return filename, content_type
+
+@app.post("/upload/stream")
+async def upload_stream(request: Request):
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(400, "Expected multipart/form-data with a boundary")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > STREAM_MAX_UPLOAD_BYTES:
+        raise HTTPException(413, f"File too large (limit {STREAM_MAX_UPLOAD_BYTES} bytes)")
+
+    events = _MultipartEvents()
+    parser = MultipartParser(params[b"boundary"], events.callbacks())
+    results, written = [], []
+    out, current, received = None, None, 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > STREAM_MAX_UPLOAD_BYTES:
+                raise HTTPException(413, f"File too large (limit {STREAM_MAX_UPLOAD_BYTES} bytes)")
+            parser.write(chunk)
+            for kind, value in events.events:
+                if kind == "headers":
+                    target = _stream_part_target(value)
+                    if target:
+                        dest = UPLOAD_DIR / f"{uuid.uuid4().hex}{Path(target[0]).suffix}"
+                        written.append(dest)
+                        out = await aiofiles.open(dest, "wb")
+                        current = {"original": target[0], "stored_as": dest.name, "content_type": target[1], "size": 0}
+                elif kind == "data" and out:
+                    await out.write(value)
+                    current["size"] += len(value)
+                elif kind == "end" and out:
+                    await out.close()
+                    results.append(current)
+                    out, current = None, None
+            events.events.clear()
+        parser.finalize()
+        if out or not results:
+            raise HTTPException(400, "Incomplete multipart body" if out else "No file parts in the body")
+    except BaseException as e:
+        # never leave a partial upload behind
+        if out:
+            await out.close()
+        for dest in written:
+            dest.unlink(missing_ok=True)
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(400, "Malformed multipart body")
+        raise
+    return {"uploaded": results}
+
 # Upload and process in background (e.g., virus scan, thumbnail)
 async def background_process(path: Path):
     # placeholder: you would call a real scan or processing routine
@@ -113,7 +230,8 @@ def health():
 @app.middleware("http")
 async def check_content_length(request: Request, call_next):
     content_length = request.headers.get("content-length")
-    if content_length:
+    # /upload/stream enforces its own (larger) limit while it reads the body
+    if content_length and request.url.path != "/upload/stream":
         try:
             if int(content_length) > (50 * 1024 * 1024):  # reject >50MB early
                 return JSONResponse(status_code=413, content={"detail": "Payload too large"})
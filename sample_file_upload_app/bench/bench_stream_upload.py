@@ -0,0 +1,81 @@
+'''
+Large uploads through /upload/single (UploadFile) and /upload/stream.
+
+    python bench/bench_stream_upload.py [size_mb] [runs]
+
+Starts the app under uvicorn in a subprocess (cwd is a temp dir, so uploads/ lands
+there) and posts one `size_mb` file per run as a chunked multipart body. For each
+endpoint it prints the upload time and the server process's /proc/<pid>/io deltas:
+rchar/wchar are bytes passed to read()/write() (uvicorn's socket recv/send are not
+counted, so this is file traffic: the spooled temp file and the destination);
+write_bytes is what actually went to the block device (0 on tmpfs).
+'''
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIZE_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+PORT = 8766
+BOUNDARY = "benchboundary7f3a"
+CHUNK = b"\x5a" * (1024 * 1024)
+
+
+def body(field):
+    yield ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="big.bin"\r\n'
+           'Content-Type: application/pdf\r\n\r\n' % (BOUNDARY, field)).encode()
+    for _ in range(SIZE_MB):
+        yield CHUNK
+    yield ("\r\n--%s--\r\n" % BOUNDARY).encode()
+
+
+def io_counters(pid):
+    with open("/proc/%d/io" % pid) as f:
+        return {k: int(v) for k, v in (line.split(": ") for line in f)}
+
+
+def upload(client, pid, path, field):
+    before = io_counters(pid)
+    t0 = time.perf_counter()
+    r = client.post("http://127.0.0.1:%d%s" % (PORT, path), content=body(field),
+                    headers={"content-type": "multipart/form-data; boundary=%s" % BOUNDARY})
+    elapsed = time.perf_counter() - t0
+    after = io_counters(pid)
+    r.raise_for_status()
+    return elapsed, {k: after[k] - before[k] for k in ("rchar", "wchar", "write_bytes")}
+
+
+def main():
+    workdir = tempfile.mkdtemp(dir=os.environ.get("BENCH_DIR"))
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "fastapi_file_upload:app", "--port", str(PORT),
+                             "--log-level", "warning", "--app-dir", os.path.join(HERE, "..", "app")], cwd=workdir)
+    try:
+        with httpx.Client(timeout=600) as client:
+            while True:
+                try:
+                    client.get("http://127.0.0.1:%d/health" % PORT)
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            print("%d MB upload, median of %d runs (uploads in %s, temp files in %s)" % (
+                SIZE_MB, RUNS, workdir, tempfile.gettempdir()))
+            print("  %-15s %8s %10s %12s %12s %14s" % ("endpoint", "seconds", "MB/s", "rchar MB", "wchar MB", "write_bytes MB"))
+            for path, field in (("/upload/single", "file"), ("/upload/stream", "file")):
+                runs = sorted((upload(client, proc.pid, path, field) for _ in range(RUNS)), key=lambda r: r[0])
+                elapsed, io = runs[len(runs) // 2]
+                print("  %-15s %8.2f %10.0f %12.0f %12.0f %14.0f" % (
+                    path, elapsed, SIZE_MB / elapsed, io["rchar"] / 2**20, io["wchar"] / 2**20, io["write_bytes"] / 2**20))
+                for name in os.listdir(os.path.join(workdir, "uploads")):
+                    os.unlink(os.path.join(workdir, "uploads", name))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -45,3 +45,51 @@ def test_multiple_upload(tmp_path):
         p = Path(UPLOAD_DIR) / info["stored_as"]
         if p.exists():
             p.unlink()
+
+def test_stream_upload():
+    files = [
+        ("files", ("a.txt", io.BytesIO(b"a" * 100000), "text/plain")),
+        ("files", ("b.pdf", io.BytesIO(b"%PDF-1.4 b"), "application/pdf")),
+    ]
+    r = client.post("/upload/stream", files=files, data={"note": "form fields are skipped"})
+    assert r.status_code == 200
+    uploaded = r.json()["uploaded"]
+    assert [u["original"] for u in uploaded] == ["a.txt", "b.pdf"]
+    assert [u["size"] for u in uploaded] == [100000, 10]
+    for info, expected in zip(uploaded, (b"a" * 100000, b"%PDF-1.4 b")):
+        p = Path(UPLOAD_DIR) / info["stored_as"]
+        assert p.read_bytes() == expected
+        p.unlink()
+
+def test_stream_upload_size_limit(monkeypatch):
+    # the limit is checked while reading, and the partial file is removed
+    monkeypatch.setattr("app.STREAM_MAX_UPLOAD_BYTES", 64 * 1024)
+    before = set(Path(UPLOAD_DIR).iterdir())
+    files = {"file": ("big.txt", io.BytesIO(b"x" * (256 * 1024)), "text/plain")}
+    r = client.post("/upload/stream", files=files)
+    assert r.status_code == 413
+    assert set(Path(UPLOAD_DIR).iterdir()) == before
+
+def test_stream_upload_size_limit_chunked(monkeypatch):
+    # no Content-Length (chunked transfer encoding): only the running byte count can stop the upload,
+    # after the destination file was already opened and partly written
+    monkeypatch.setattr("app.STREAM_MAX_UPLOAD_BYTES", 64 * 1024)
+    before = set(Path(UPLOAD_DIR).iterdir())
+
+    def body():
+        yield (b'--chunkedboundary\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n'
+               b"Content-Type: text/plain\r\n\r\n")
+        for _ in range(16):
+            yield b"x" * (16 * 1024)
+        yield b"\r\n--chunkedboundary--\r\n"
+    r = client.post("/upload/stream", content=body(),
+                    headers={"content-type": "multipart/form-data; boundary=chunkedboundary"})
+    assert r.status_code == 413
+    assert set(Path(UPLOAD_DIR).iterdir()) == before
+
+def test_stream_upload_invalid_input():
+    r = client.post("/upload/stream", content=b"not multipart", headers={"content-type": "text/plain"})
+    assert r.status_code == 400
+    files = {"file": ("x.exe", io.BytesIO(b"MZ"), "application/x-msdownload")}
+    r = client.post("/upload/stream", files=files)
+    assert r.status_code == 400